@@ -0,0 +1,280 @@
+"""Management call benchmark for every pybatchai command.
+
+Runs a scenario of commands, in order, against benchmarks.fake_arm for
+Resource Manager and AAD and benchmarks.fake_storage for the storage data
+plane: `up` creates an environment and runs again over it, then every cluster,
+job and storage command, and `run` with a manifest of several of them, runs
+against what it made, and the cluster is deleted. Each command runs in a fresh
+interpreter with a fresh cache directory, so no command benefits from the
+caches of the one before, and the fakes count the management calls it makes.
+
+    python -m benchmarks.control_plane --output control_plane.json
+    python -m benchmarks.control_plane --compare control_plane.json
+    python -m benchmarks.control_plane --latency-ms 50
+
+Every command has a call budget. The script exits non-zero when a command
+fails, makes more calls than its budget or than the baseline, or got slower
+than the baseline by more than --threshold (relative).
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GLOBAL_OPTIONS = [
+    '--subscription-id', '00000000-0000-4000-8000-000000000001',
+    '--resource-group', 'benchmark',
+    '--aad-app-id', '00000000-0000-4000-8000-000000000002',
+    '--aad-key', 'benchmark',
+    '--aad-directory-id', '00000000-0000-4000-8000-000000000003'
+]
+STORAGE_ACCOUNT = 'benchmarkstorage'
+WORKSPACE = 'benchmark'
+CLUSTER = 'gpu'
+UP_SPEC = {
+    'storage_accounts': [{'name': STORAGE_ACCOUNT, 'fileshares': ['scripts'],
+                          'containers': ['data']}],
+    'clusters': [{'name': CLUSTER, 'workspace': WORKSPACE,
+                  'vm_size': 'STANDARD_NC6', 'target_node_count': 0,
+                  'admin_user_name': 'batchai',
+                  'admin_user_password': 'Benchmark-1'}]
+}
+SWEEP_SPEC = {
+    'experiment': 'benchmark',
+    'node_count': 1,
+    'std_out_err_path_prefix': '$AZ_BATCHAI_MOUNT_ROOT/logs',
+    'command_line': 'python train.py --seed {seed}',
+    'job_name': 'seed{seed}',
+    'grid': {'seed': [1, 2, 3, 4]}
+}
+CLUSTER_OPTIONS = ['cluster', '--workspace', WORKSPACE, '--name', CLUSTER]
+BLOB_OPTIONS = ['storage', '--name', STORAGE_ACCOUNT, 'blobstorage',
+                '--container', 'data']
+FILESHARE_OPTIONS = ['storage', '--name', STORAGE_ACCOUNT, 'fileshare',
+                     '--name', 'scripts']
+# plain transfers make the same management calls with either engine, and
+# blobxfer's threads poll their queues, which can starve a one core runner
+ENGINE_OPTIONS = ['--engine', 'async']
+RUN_MANIFEST = {
+    'operations': [
+        {'name': 'show', 'command': CLUSTER_OPTIONS + ['show']},
+        {'name': 'status', 'command': ['cluster', 'status', WORKSPACE]},
+        {'name': 'blob', 'command': BLOB_OPTIONS + [
+            'upload', '--local-path', '{data}', '--pack']},
+        {'name': 'fileshare', 'command': FILESHARE_OPTIONS + [
+            'upload', '--local-path', '{data}', '--pack']}
+    ]
+}
+# name, arguments after the global options, most management calls allowed
+SCENARIO = [
+    ('up', ['up', '--spec', '{up_spec}'], 15),
+    ('up existing', ['up', '--spec', '{up_spec}'], 6),
+    ('cluster show', CLUSTER_OPTIONS + ['show'], 3),
+    ('cluster status', ['cluster', 'status', WORKSPACE], 3),
+    ('cluster watch', CLUSTER_OPTIONS + ['watch', '--until', 'steady'], 3),
+    ('cluster record', CLUSTER_OPTIONS + ['record', '--samples', '1',
+                                          '--data-dir', '{timeseries}'], 3),
+    ('cluster report', CLUSTER_OPTIONS + ['report', '--data-dir',
+                                          '{timeseries}'], 2),
+    ('job sweep', CLUSTER_OPTIONS + ['job', 'sweep', '--spec', '{sweep_spec}'],
+     10),
+    ('job logs', CLUSTER_OPTIONS + ['job', 'logs', '--experiment', 'benchmark',
+                                    '--job', 'seed1', '--lines', '0'], 4),
+    ('blobstorage upload', BLOB_OPTIONS + ['upload', '--local-path', '{data}',
+                                           '--pack'], 4),
+    ('blobstorage upload plain', BLOB_OPTIONS + ['upload', '--local-path', '{data}']
+     + ENGINE_OPTIONS, 4),
+    ('blobstorage download', BLOB_OPTIONS + ['download', '--local-path',
+                                             '{downloads}/blob']
+     + ENGINE_OPTIONS, 4),
+    ('fileshare upload', FILESHARE_OPTIONS + ['upload', '--local-path', '{data}',
+                                             '--pack'], 4),
+    ('fileshare upload plain', FILESHARE_OPTIONS + ['upload', '--local-path',
+                                                    '{data}'] + ENGINE_OPTIONS, 4),
+    ('fileshare download', FILESHARE_OPTIONS + ['download', '--local-path',
+                                                '{downloads}/fileshare']
+     + ENGINE_OPTIONS, 4),
+    ('fileshare tail', FILESHARE_OPTIONS + ['tail', 'f0.txt', '--lines', '1'], 4),
+    ('upload', ['upload', '--local-path', '{data}',
+                '--blob', STORAGE_ACCOUNT + '/data/fanout',
+                '--fileshare', STORAGE_ACCOUNT + '/scripts/fanout'], 4),
+    ('run', ['run', '{run_manifest}'], 7),
+    ('cluster delete', CLUSTER_OPTIONS + ['delete', '--wait'], 5)
+]
+
+def command_args(arguments, paths, cache_dir):
+    return GLOBAL_OPTIONS + ['--cache-dir', cache_dir] + \
+        [argument.format(**paths) for argument in arguments]
+
+def write_inputs(scratch):
+    """The spec files, manifest, upload source and download targets the
+    scenario refers to.
+    """
+    paths = {'up_spec': os.path.join(scratch, 'up.json'),
+             'sweep_spec': os.path.join(scratch, 'sweep.json'),
+             'run_manifest': os.path.join(scratch, 'run.json'),
+             'data': os.path.join(scratch, 'data'),
+             'downloads': os.path.join(scratch, 'downloads'),
+             'timeseries': os.path.join(scratch, 'timeseries')}
+    manifest = {'operations': [
+        dict(operation, command=[argument.format(**paths)
+                                 for argument in operation['command']])
+        for operation in RUN_MANIFEST['operations']]}
+    for key, spec in [('up_spec', UP_SPEC), ('sweep_spec', SWEEP_SPEC),
+                      ('run_manifest', manifest)]:
+        with open(paths[key], 'w') as spec_file:
+            json.dump(spec, spec_file)
+    os.makedirs(paths['data'])
+    for number in range(3):
+        with open(os.path.join(paths['data'], 'f{}.txt'.format(number)),
+                  'w') as data_file:
+            data_file.write('benchmark\n' * 100)
+    return paths
+
+def run_command(args, arm_address, storage_address):
+    """Run pybatchai with args against the fakes; its exit code."""
+    import benchmarks.fake_arm
+    import benchmarks.fake_storage
+    import pybatchai
+
+    with benchmarks.fake_arm.redirect(arm_address), \
+            benchmarks.fake_storage.redirect(storage_address):
+        # without standalone mode click returns the exit code of context.exit
+        return pybatchai.main.main(args=list(args), prog_name='pybatchai',
+                                   standalone_mode=False) or 0
+
+def run_isolated(args, arm_address, storage_address, work_dir, timeout):
+    """Time one command in a fresh interpreter."""
+    job = {'args': args, 'arm_address': arm_address,
+           'storage_address': storage_address}
+    started = time.monotonic()
+    try:
+        result = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.control_plane', '--worker',
+             json.dumps(job)],
+            cwd=work_dir, env=dict(os.environ, PYTHONPATH=ROOT),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError('did not finish within {} s.'.format(timeout))
+    seconds = time.monotonic() - started
+    if result.returncode != 0:
+        raise RuntimeError('exited with {}:\n{}'.format(result.returncode,
+                                                        result.stdout[-4000:]))
+    return seconds
+
+def run_scenario(latency, timeout):
+    """One pass over SCENARIO on fresh fakes; a result per command."""
+    import benchmarks.fake_arm
+    import benchmarks.fake_storage
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='pybatchai-benchmark-') as scratch, \
+            benchmarks.fake_arm.running(latency=latency) as arm, \
+            benchmarks.fake_storage.running() as storage:
+        paths = write_inputs(scratch)
+        for number, (name, arguments, budget) in enumerate(SCENARIO):
+            args = command_args(arguments, paths,
+                                os.path.join(scratch, 'cache{}'.format(number)))
+            arm.store.reset_counters()
+            result = {'command': name, 'budget': budget}
+            try:
+                result['seconds'] = run_isolated(args, arm.address, storage.address,
+                                                 scratch, timeout)
+            except RuntimeError as error:
+                result['error'] = str(error)
+            result.update(arm.store.counters())
+            results.append(result)
+    return results
+
+def benchmark(latency, repeat, timeout):
+    """Median seconds over repeated scenarios; calls are those of the last."""
+    runs = [run_scenario(latency, timeout) for _ in range(repeat)]
+    results = runs[-1]
+    for position, result in enumerate(results):
+        seconds = [run[position]['seconds'] for run in runs
+                   if 'seconds' in run[position]]
+        if seconds and 'error' not in result:
+            result['seconds'] = statistics.median(seconds)
+        print(format_result(result))
+    return results
+
+def format_result(result):
+    if 'error' in result:
+        return '{:<24} failed: {}'.format(result['command'], result['error'])
+    return '{:<24} {:>4d} calls (budget {:>3d}) {:>8.2f} s'.format(
+        result['command'], result['requests'], result['budget'],
+        result['seconds'])
+
+def check(results, baseline, threshold):
+    """Print deltas and return the commands that failed or regressed."""
+    problems = []
+    for result in results:
+        name = result['command']
+        if 'error' in result:
+            problems.append(name)
+            continue
+        if result['requests'] > result['budget']:
+            print('{:<24} {} calls exceed the budget of {}: {}'.format(
+                name, result['requests'], result['budget'],
+                ', '.join('{} x{}'.format(operation, count) for operation, count
+                          in sorted(result['operations'].items()))))
+            problems.append(name)
+            continue
+        before = baseline.get(name)
+        if before is None or 'error' in before:
+            print('{:<24} {:>4d} calls {:>8.2f} s  (new)'.format(
+                name, result['requests'], result['seconds']))
+            continue
+        change = (result['seconds'] - before['seconds']) / before['seconds'] \
+            if before['seconds'] else math.inf
+        print('{:<24} {:>4d} calls ({:+d}) {:>8.2f} s ({:+.1%})'.format(
+            name, result['requests'], result['requests'] - before['requests'],
+            result['seconds'], change))
+        if result['requests'] > before['requests'] or change > threshold:
+            problems.append(name)
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='added to every management call')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--timeout', type=int, default=300,
+                        help='seconds one command may take')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON written by --output')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    if args.worker:
+        job = json.loads(args.worker)
+        return run_command(job['args'], job['arm_address'], job['storage_address'])
+    results = benchmark(args.latency_ms / 1000.0, args.repeat, args.timeout)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'python': sys.version.split()[0],
+                       'latency_ms': args.latency_ms,
+                       'results': {result['command']: result
+                                   for result in results}},
+                      output, indent=2, sort_keys=True)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    problems = check(results, baseline, args.threshold)
+    if problems:
+        print('failed, over budget or regressed: {}'.format(', '.join(problems)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
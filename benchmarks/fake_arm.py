@@ -0,0 +1,275 @@
+"""In-process stand-in for Azure Resource Manager and AAD.
+
+A threaded HTTP/1.1 server answers the AAD client credentials token request
+and keeps ARM resources in memory: resource groups, storage accounts with
+their name check and keys, and Batch AI workspaces, clusters, experiments and
+jobs. A PUT creates or replaces a resource that has already finished
+provisioning, so pollers are done after their first check. Tokens are not
+checked.
+
+Every request waits store.latency seconds before it is answered, to see how
+commands behave against a distant region, and is counted under the operation
+name cli.trace gives it, so the calls a command makes can be budgeted.
+
+The management clients talk https to management.azure.com and
+login.microsoftonline.com, so redirect() rewrites those requests, inside the
+process that makes them, to http://<host>:<port>/arm/... and /aad/... on this
+server.
+"""
+import base64
+import collections
+import contextlib
+import http.server
+import json
+import socketserver
+import threading
+import time
+import urllib.parse
+
+import requests
+
+import cli.trace
+
+ARM_HOST = 'management.azure.com'
+AAD_HOST = 'login.microsoftonline.com'
+PREFIXES = {ARM_HOST: '/arm', AAD_HOST: '/aad'}
+ACCOUNT_KEY = base64.b64encode(b'k' * 64).decode()
+TOKEN_LIFETIME = 3600
+DEFAULT_LOCATION = 'eastus'
+RESOURCES_PROVIDER = 'Microsoft.Resources'
+BATCHAI_PROVIDER = 'microsoft.batchai'
+# Batch AI reports provisioning states in lower case, other providers do not
+PROVISIONING_SUCCEEDED = {BATCHAI_PROVIDER: 'succeeded'}
+
+class Store:
+    def __init__(self, latency=0.0):
+        self.lock = threading.Lock()
+        # lower-cased resource id to resource
+        self.resources = {}
+        self.latency = latency
+        self.requests = 0
+        self.operations = collections.Counter()
+
+    def counters(self):
+        with self.lock:
+            return {'requests': self.requests,
+                    'operations': dict(self.operations)}
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.operations.clear()
+
+class ArmError(Exception):
+    def __init__(self, status, code):
+        super().__init__(code)
+        self.status = status
+        self.code = code
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request()
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_PUT(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def do_DELETE(self):
+        self.handle_request()
+
+    def handle_request(self):
+        url = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        store = self.server.store
+        if url.path.startswith(PREFIXES[AAD_HOST] + '/'):
+            operation = '{} {}'.format(self.command, AAD_HOST)
+        else:
+            path = url.path[len(PREFIXES[ARM_HOST]):]
+            operation = cli.trace.operation_name(self.command, urllib.parse.urlsplit(
+                'https://{}{}'.format(ARM_HOST, path)))
+        with store.lock:
+            store.requests += 1
+            store.operations[operation] += 1
+        if store.latency:
+            time.sleep(store.latency)
+        try:
+            if url.path.startswith(PREFIXES[AAD_HOST] + '/'):
+                status, payload = token_response(body)
+            elif url.path.startswith(PREFIXES[ARM_HOST] + '/'):
+                status, payload = self.arm_request(
+                    store, url.path[len(PREFIXES[ARM_HOST]):], body)
+            else:
+                raise ArmError(404, 'UnknownHost')
+        except ArmError as error:
+            status, payload = error.status, {
+                'error': {'code': error.code, 'message': error.code}}
+        self.respond(status, payload)
+
+    def respond(self, status, payload):
+        body = b'' if payload is None or self.command == 'HEAD' else \
+            json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def arm_request(self, store, path, body):
+        segments = [segment for segment in path.split('/') if segment]
+        key = '/'.join(segments).lower()
+        with store.lock:
+            if self.command == 'POST':
+                return post_action(store, segments, body)
+            if self.command == 'PUT':
+                # only resource groups answer a creation with 201
+                status = 201 if key not in store.resources and \
+                    provider(segments)[0] == RESOURCES_PROVIDER else 200
+                store.resources[key] = new_resource(segments, body)
+                return status, store.resources[key]
+            if key in store.resources:
+                if self.command == 'DELETE':
+                    for resource_key in list(store.resources):
+                        if resource_key == key or resource_key.startswith(key + '/'):
+                            del store.resources[resource_key]
+                    return 200, None
+                return (204, None) if self.command == 'HEAD' else \
+                    (200, store.resources[key])
+            if self.command == 'GET' and len(segments) % 2:
+                # a collection: the resources directly under it
+                return 200, {'value': [
+                    resource for resource_key, resource in sorted(store.resources.items())
+                    if resource_key.startswith(key + '/')
+                    and '/' not in resource_key[len(key) + 1:]]}
+            if self.command == 'DELETE':
+                return 204, None
+            raise ArmError(404, 'ResourceNotFound')
+
+def token_response(body):
+    form = urllib.parse.parse_qs(body.decode())
+    expires_on = int(time.time()) + TOKEN_LIFETIME
+    return 200, {'token_type': 'Bearer',
+                 'expires_in': str(TOKEN_LIFETIME),
+                 'expires_on': str(expires_on),
+                 'resource': form.get('resource', [''])[0],
+                 'access_token': 'fake-token-{}'.format(expires_on)}
+
+def provider(segments):
+    """The namespace and resource types of a resource id."""
+    lowered = [segment.lower() for segment in segments]
+    if 'providers' not in lowered:
+        return RESOURCES_PROVIDER, ['resourceGroups']
+    rest = segments[lowered.index('providers') + 1:]
+    return rest[0], rest[1::2]
+
+def new_resource(segments, body):
+    """A resource as ARM returns it after a PUT of body has finished."""
+    request = json.loads(body.decode() or '{}')
+    namespace, types = provider(segments)
+    name = segments[-1]
+    properties = dict(request.get('properties') or {})
+    properties['provisioningState'] = PROVISIONING_SUCCEEDED.get(
+        namespace.lower(), 'Succeeded')
+    if types[-1].lower() == 'storageaccounts':
+        properties.update(
+            primaryEndpoints={service: 'https://{}.{}.core.windows.net/'.format(
+                name, service) for service in ['blob', 'file', 'queue', 'table']},
+            statusOfPrimary='available')
+    elif types[-1].lower() == 'clusters':
+        properties.setdefault('scaleSettings',
+                              {'manual': {'targetNodeCount': 0}})
+        properties.update(allocationState='steady', currentNodeCount=0,
+                          nodeStateCounts={'idleNodeCount': 0,
+                                           'runningNodeCount': 0,
+                                           'preparingNodeCount': 0,
+                                           'unusableNodeCount': 0,
+                                           'leavingNodeCount': 0})
+    elif types[-1].lower() == 'jobs':
+        properties['executionState'] = 'queued'
+    resource = {'id': '/' + '/'.join(segments), 'name': name,
+                'type': '/'.join([namespace] + types),
+                'location': request.get('location', DEFAULT_LOCATION),
+                'properties': properties}
+    for field in ['sku', 'kind', 'tags']:
+        if field in request:
+            resource[field] = request[field]
+    return resource
+
+def post_action(store, segments, body):
+    action = segments[-1].lower()
+    if action == 'checknameavailability':
+        name = json.loads(body.decode() or '{}').get('name', '').lower()
+        # names are global, so one taken in any resource group is unavailable
+        taken = any(resource_key.endswith('/storageaccounts/' + name)
+                    for resource_key in store.resources)
+        return 200, {'nameAvailable': not taken,
+                     'reason': 'AlreadyExists' if taken else None,
+                     'message': 'The storage account name is already taken.'
+                                if taken else None}
+    parent = '/'.join(segments[:-1]).lower()
+    if parent not in store.resources:
+        raise ArmError(404, 'ResourceNotFound')
+    if action == 'listkeys':
+        return 200, {'keys': [{'keyName': 'key1', 'value': ACCOUNT_KEY,
+                               'permissions': 'Full'},
+                              {'keyName': 'key2', 'value': ACCOUNT_KEY,
+                               'permissions': 'Full'}]}
+    if action == 'listoutputfiles':
+        return 200, {'value': []}
+    raise ArmError(400, 'UnsupportedAction')
+
+class FakeArmServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0):
+        super().__init__(address, Handler)
+        self.store = Store(latency)
+
+    @property
+    def address(self):
+        return '{}:{}'.format(*self.server_address[:2])
+
+@contextlib.contextmanager
+def running(address=('127.0.0.1', 0), latency=0.0):
+    """Serve a fresh store on a background thread."""
+    server = FakeArmServer(address, latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def local_url(url, address):
+    """Rewrite an ARM or AAD url to the fake server at address."""
+    parts = urllib.parse.urlsplit(url)
+    if parts.hostname not in PREFIXES:
+        return url
+    return urllib.parse.urlunsplit(
+        ('http', address, PREFIXES[parts.hostname] + parts.path, parts.query, ''))
+
+@contextlib.contextmanager
+def redirect(address):
+    """Send ARM and AAD requests of every requests session to address."""
+    send = requests.adapters.HTTPAdapter.send
+
+    def local_send(adapter, request, **kwargs):
+        request.url = local_url(request.url, address)
+        return send(adapter, request, **kwargs)
+
+    requests.adapters.HTTPAdapter.send = local_send
+    try:
+        yield
+    finally:
+        requests.adapters.HTTPAdapter.send = send
@@ -0,0 +1,481 @@
+"""In-process stand-in for Azure blob and file storage.
+
+A threaded HTTP/1.1 server keeps containers, blobs, shares, directories and
+files in memory and answers the subset of the blob and file REST APIs that
+blobxfer and the azure-storage clients use for uploads, downloads, listings
+and deletes. Shared Key signatures are not checked.
+
+The storage clients always talk https to <account>.<service>.core.windows.net,
+so redirect() rewrites those requests, inside the process that makes them and
+whether sent through requests or cli.async_http, to
+http://<host>:<port>/<service>/... on this server.
+"""
+import collections
+import contextlib
+import email.utils
+import hashlib
+import http.server
+import socketserver
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+
+import requests
+
+STORAGE_SUFFIX = '.core.windows.net'
+BLOB_SERVICE = 'blob'
+FILE_SERVICE = 'file'
+DEFAULT_PAGE_SIZE = 5000
+
+class Entry:
+    """Content and properties of a blob or file."""
+
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+        self.metadata = {}
+        self.content_md5 = None
+        self.content_type = 'application/octet-stream'
+        self.content_encoding = None
+        self.touch()
+
+    def touch(self):
+        self.last_modified = time.time()
+        self.etag = '"0x{}"'.format(hashlib.md5(
+            repr((id(self), self.last_modified)).encode()).hexdigest()[:16].upper())
+
+    def headers(self):
+        return {'ETag': self.etag,
+                'Last-Modified': email.utils.formatdate(self.last_modified,
+                                                        usegmt=True)}
+
+class Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.container_metadata = {}
+        self.blocks = {}
+        self.shares = {}
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.operations = collections.Counter()
+
+    def create_container(self, name):
+        with self.lock:
+            self.containers.setdefault(name, {})
+
+    def create_share(self, name):
+        with self.lock:
+            self.shares.setdefault(name, {'directories': {''}, 'files': {}})
+
+    def counters(self):
+        with self.lock:
+            return {'requests': self.requests,
+                    'bytes_received': self.bytes_received,
+                    'bytes_sent': self.bytes_sent,
+                    'operations': dict(self.operations)}
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = self.bytes_received = self.bytes_sent = 0
+            self.operations.clear()
+
+class StorageError(Exception):
+    def __init__(self, status, code):
+        super().__init__(code)
+        self.status = status
+        self.code = code
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_storage_request()
+
+    def do_GET(self):
+        self.handle_storage_request()
+
+    def do_PUT(self):
+        self.handle_storage_request()
+
+    def do_DELETE(self):
+        self.handle_storage_request()
+
+    def handle_storage_request(self):
+        url = urllib.parse.urlsplit(self.path)
+        self.query = {key: values[0] for key, values
+                      in urllib.parse.parse_qs(url.query).items()}
+        self.body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        service, _, path = urllib.parse.unquote(url.path).lstrip('/').partition('/')
+        store = self.server.store
+        operation = ' '.join(filter(None, [self.command, service,
+                                           self.query.get('restype'),
+                                           self.query.get('comp')]))
+        with store.lock:
+            store.requests += 1
+            store.bytes_received += len(self.body)
+            store.operations[operation] += 1
+        try:
+            if service == BLOB_SERVICE:
+                status, headers, body = self.blob_request(*path.partition('/')[::2])
+            elif service == FILE_SERVICE:
+                status, headers, body = self.file_request(*path.partition('/')[::2])
+            else:
+                raise StorageError(400, 'UnsupportedService')
+        except StorageError as error:
+            status, headers, body = error_response(error)
+        self.respond(status, headers, body)
+
+    def respond(self, status, headers, body):
+        self.send_response(status)
+        headers.setdefault('Content-Length', str(len(body)))
+        headers['x-ms-version'] = self.headers.get('x-ms-version', '')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+            with self.server.store.lock:
+                self.server.store.bytes_sent += len(body)
+
+    def blob_request(self, container_name, blob_name):
+        store = self.server.store
+        restype, comp = self.query.get('restype'), self.query.get('comp')
+        with store.lock:
+            if restype == 'container' and comp == 'list':
+                return list_blobs(lookup(store.containers, container_name,
+                                         'ContainerNotFound'), self.query)
+            if restype == 'container':
+                return self.container_request(store, container_name)
+            if not blob_name:
+                raise StorageError(400, 'InvalidUri')
+            container = lookup(store.containers, container_name, 'ContainerNotFound')
+            if self.command == 'PUT':
+                return self.put_blob(store, container_name, container, blob_name, comp)
+            blob = lookup(container, blob_name, 'BlobNotFound')
+            if self.command == 'DELETE':
+                del container[blob_name]
+                return 202, {}, b''
+            return self.read_entry(blob, {'x-ms-blob-type': 'BlockBlob'})
+
+    def container_request(self, store, container_name):
+        if self.command == 'PUT' and self.query.get('comp') is None:
+            if container_name in store.containers:
+                raise StorageError(409, 'ContainerAlreadyExists')
+            store.containers[container_name] = {}
+            return 201, resource_headers(), b''
+        lookup(store.containers, container_name, 'ContainerNotFound')
+        if self.command == 'DELETE':
+            del store.containers[container_name]
+            store.container_metadata.pop(container_name, None)
+            return 202, {}, b''
+        if self.command == 'PUT' and self.query.get('comp') == 'metadata':
+            store.container_metadata[container_name] = {
+                name[len('x-ms-meta-'):]: value
+                for name, value in self.headers.items()
+                if name.lower().startswith('x-ms-meta-')}
+        headers = resource_headers()
+        headers.update(('x-ms-meta-' + name, value) for name, value
+                       in store.container_metadata.get(container_name, {}).items())
+        return 200, headers, b''
+
+    def put_blob(self, store, container_name, container, blob_name, comp):
+        key = (container_name, blob_name)
+        if comp == 'block':
+            store.blocks.setdefault(key, {})[self.query['blockid']] = self.body
+            return 201, resource_headers(), b''
+        if comp == 'blocklist':
+            blocks = store.blocks.pop(key, {})
+            block_ids = [element.text for element in ElementTree.fromstring(self.body)]
+            try:
+                data = b''.join(blocks[block_id] for block_id in block_ids)
+            except KeyError:
+                raise StorageError(400, 'InvalidBlockList')
+            blob = container[blob_name] = Entry(data)
+            self.set_properties(blob, 'x-ms-blob-content-md5')
+            return 201, blob.headers(), b''
+        if comp in ('metadata', 'properties'):
+            blob = lookup(container, blob_name, 'BlobNotFound')
+            self.set_properties(blob, 'x-ms-blob-content-md5')
+            blob.touch()
+            return 200, blob.headers(), b''
+        if comp is not None or self.headers.get('x-ms-blob-type') != 'BlockBlob':
+            raise StorageError(400, 'UnsupportedOperation')
+        blob = container[blob_name] = Entry(self.body)
+        self.set_properties(blob, 'x-ms-blob-content-md5')
+        return 201, blob.headers(), b''
+
+    def file_request(self, share_name, path):
+        store = self.server.store
+        restype, comp = self.query.get('restype'), self.query.get('comp')
+        path = path.strip('/')
+        with store.lock:
+            if restype == 'share':
+                return self.share_request(store, share_name)
+            share = lookup(store.shares, share_name, 'ShareNotFound')
+            if restype == 'directory':
+                return self.directory_request(share, path, comp)
+            if self.command == 'PUT':
+                return self.put_file(share, path, comp)
+            entry = lookup(share['files'], path, 'ResourceNotFound')
+            if self.command == 'DELETE':
+                del share['files'][path]
+                return 202, {}, b''
+            if comp == 'metadata':
+                headers = entry.headers()
+                headers.update(('x-ms-meta-' + name, value)
+                               for name, value in entry.metadata.items())
+                return 200, headers, b''
+            return self.read_entry(entry, {'x-ms-type': 'File'})
+
+    def share_request(self, store, share_name):
+        if self.command == 'PUT' and self.query.get('comp') is None:
+            if share_name in store.shares:
+                raise StorageError(409, 'ShareAlreadyExists')
+            store.shares[share_name] = {'directories': {''}, 'files': {}}
+            return 201, resource_headers(), b''
+        lookup(store.shares, share_name, 'ShareNotFound')
+        if self.command == 'DELETE':
+            del store.shares[share_name]
+            return 202, {}, b''
+        return 200, resource_headers(), b''
+
+    def directory_request(self, share, path, comp):
+        if comp == 'list':
+            lookup_directory(share, path)
+            return list_directory(share, path, self.query)
+        if self.command == 'PUT' and comp is None:
+            if path in share['directories'] or path in share['files']:
+                raise StorageError(409, 'ResourceAlreadyExists')
+            lookup_directory(share, parent(path), 'ParentNotFound')
+            share['directories'].add(path)
+            return 201, resource_headers(), b''
+        lookup_directory(share, path)
+        if self.command == 'DELETE':
+            share['directories'].discard(path)
+            return 202, {}, b''
+        return 200, resource_headers(), b''
+
+    def put_file(self, share, path, comp):
+        if comp is None:
+            lookup_directory(share, parent(path), 'ParentNotFound')
+            entry = share['files'][path] = Entry(
+                bytes(int(self.headers.get('x-ms-content-length', 0))))
+            self.set_properties(entry, 'x-ms-content-md5')
+            return 201, entry.headers(), b''
+        entry = lookup(share['files'], path, 'ResourceNotFound')
+        if comp == 'range':
+            start, end = parse_range(self.headers.get('x-ms-range')
+                                     or self.headers.get('Range'), len(entry.data))
+            if end >= len(entry.data):
+                raise StorageError(416, 'InvalidRange')
+            if self.headers.get('x-ms-write') == 'clear':
+                entry.data[start:end + 1] = bytes(end - start + 1)
+            else:
+                entry.data[start:end + 1] = self.body
+        elif comp == 'properties':
+            length = self.headers.get('x-ms-content-length')
+            if length is not None:
+                entry.data = entry.data[:int(length)].ljust(int(length), b'\0')
+            self.set_properties(entry, 'x-ms-content-md5')
+        elif comp == 'metadata':
+            self.set_properties(entry, None)
+        else:
+            raise StorageError(400, 'UnsupportedOperation')
+        entry.touch()
+        return 201 if comp == 'range' else 200, entry.headers(), b''
+
+    def set_properties(self, entry, md5_header):
+        metadata = {name[len('x-ms-meta-'):]: value
+                    for name, value in self.headers.items()
+                    if name.lower().startswith('x-ms-meta-')}
+        if metadata or self.query.get('comp') == 'metadata':
+            entry.metadata = metadata
+        if md5_header and self.headers.get(md5_header):
+            entry.content_md5 = self.headers[md5_header]
+        for prefix in ['x-ms-blob-', 'x-ms-']:
+            if self.headers.get(prefix + 'content-type'):
+                entry.content_type = self.headers[prefix + 'content-type']
+            if self.headers.get(prefix + 'content-encoding'):
+                entry.content_encoding = self.headers[prefix + 'content-encoding']
+
+    def read_entry(self, entry, type_headers):
+        headers = dict(type_headers, **entry.headers())
+        headers.update({'Content-Type': entry.content_type,
+                        'Accept-Ranges': 'bytes'})
+        if entry.content_encoding:
+            headers['Content-Encoding'] = entry.content_encoding
+        headers.update(('x-ms-meta-' + name, value)
+                       for name, value in entry.metadata.items())
+        if entry.content_md5:
+            headers['Content-MD5'] = entry.content_md5
+        requested = self.headers.get('x-ms-range') or self.headers.get('Range')
+        size = len(entry.data)
+        if self.command == 'HEAD' or not requested:
+            headers['Content-Length'] = str(size)
+            return 200, headers, b'' if self.command == 'HEAD' else bytes(entry.data)
+        start, end = parse_range(requested, size)
+        if start >= size:
+            raise StorageError(416, 'InvalidRange')
+        end = min(end, size - 1)
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        return 206, headers, bytes(entry.data[start:end + 1])
+
+def resource_headers():
+    """Properties of containers, shares and directories, which hold no content."""
+    return {'ETag': '"0x0"',
+            'Last-Modified': email.utils.formatdate(usegmt=True)}
+
+def lookup(entries, name, code):
+    if name not in entries:
+        raise StorageError(404, code)
+    return entries[name]
+
+def lookup_directory(share, path, code='ResourceNotFound'):
+    if path not in share['directories']:
+        raise StorageError(404, code)
+
+def parent(path):
+    return path.rpartition('/')[0]
+
+def parse_range(value, size):
+    """(start, end) of a bytes=start-end header, end inclusive."""
+    if not value or not value.startswith('bytes='):
+        raise StorageError(400, 'InvalidRange')
+    start, _, end = value[len('bytes='):].partition('-')
+    return int(start), int(end) if end else size - 1
+
+def page(names, query):
+    """Names after the marker, and the marker of the next page."""
+    marker = query.get('marker')
+    names = [name for name in sorted(names) if marker is None or name >= marker]
+    page_size = int(query.get('maxresults', DEFAULT_PAGE_SIZE))
+    return names[:page_size], names[page_size] if len(names) > page_size else ''
+
+def list_blobs(container, query):
+    prefix = query.get('prefix', '')
+    names, next_marker = page([name for name in container
+                               if name.startswith(prefix)], query)
+    root = ElementTree.Element('EnumerationResults')
+    blobs = ElementTree.SubElement(root, 'Blobs')
+    for name in names:
+        blob = container[name]
+        element = ElementTree.SubElement(blobs, 'Blob')
+        ElementTree.SubElement(element, 'Name').text = name
+        properties = ElementTree.SubElement(element, 'Properties')
+        for tag, value in [
+                ('Last-Modified', email.utils.formatdate(blob.last_modified,
+                                                         usegmt=True)),
+                ('Etag', blob.etag),
+                ('Content-Length', str(len(blob.data))),
+                ('Content-Type', blob.content_type),
+                ('Content-Encoding', blob.content_encoding or ''),
+                ('Content-MD5', blob.content_md5 or ''),
+                ('BlobType', 'BlockBlob')]:
+            ElementTree.SubElement(properties, tag).text = value
+        if 'metadata' in query.get('include', ''):
+            metadata = ElementTree.SubElement(element, 'Metadata')
+            for key, value in blob.metadata.items():
+                ElementTree.SubElement(metadata, key).text = value
+    ElementTree.SubElement(root, 'NextMarker').text = next_marker
+    return xml_response(root)
+
+def list_directory(share, path, query):
+    prefix = path + '/' if path else ''
+
+    def children(paths):
+        return {child[len(prefix):] for child in paths
+                if child.startswith(prefix) and child != path
+                and '/' not in child[len(prefix):]}
+
+    files, directories = children(share['files']), children(share['directories'])
+    names, next_marker = page(files | directories, query)
+    root = ElementTree.Element('EnumerationResults')
+    entries = ElementTree.SubElement(root, 'Entries')
+    for name in names:
+        if name in files:
+            element = ElementTree.SubElement(entries, 'File')
+            ElementTree.SubElement(element, 'Name').text = name
+            properties = ElementTree.SubElement(element, 'Properties')
+            ElementTree.SubElement(properties, 'Content-Length').text = str(
+                len(share['files'][prefix + name].data))
+        else:
+            element = ElementTree.SubElement(entries, 'Directory')
+            ElementTree.SubElement(element, 'Name').text = name
+    ElementTree.SubElement(root, 'NextMarker').text = next_marker
+    return xml_response(root)
+
+def xml_response(root):
+    body = b'<?xml version="1.0" encoding="utf-8"?>' + ElementTree.tostring(root)
+    return 200, {'Content-Type': 'application/xml'}, body
+
+def error_response(error):
+    root = ElementTree.Element('Error')
+    ElementTree.SubElement(root, 'Code').text = error.code
+    ElementTree.SubElement(root, 'Message').text = error.code
+    status, headers, body = xml_response(root)
+    headers['x-ms-error-code'] = error.code
+    return error.status, headers, body
+
+class FakeStorageServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        super().__init__(address, Handler)
+        self.store = Store()
+
+    @property
+    def address(self):
+        return '{}:{}'.format(*self.server_address[:2])
+
+@contextlib.contextmanager
+def running(address=('127.0.0.1', 0)):
+    """Serve a fresh store on a background thread."""
+    server = FakeStorageServer(address)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def local_url(url, address):
+    """Rewrite a storage account url to the fake server at address."""
+    parts = urllib.parse.urlsplit(url)
+    if not parts.hostname or not parts.hostname.endswith(STORAGE_SUFFIX):
+        return url
+    service = parts.hostname[:-len(STORAGE_SUFFIX)].rpartition('.')[2]
+    return urllib.parse.urlunsplit(
+        ('http', address, '/' + service + parts.path, parts.query, ''))
+
+@contextlib.contextmanager
+def redirect(address):
+    """Send storage requests of every requests session and every
+    cli.async_http.ConnectionPool to address.
+    """
+    import cli.async_http
+
+    send = requests.adapters.HTTPAdapter.send
+    pool_request = cli.async_http.ConnectionPool.request
+
+    def local_send(adapter, request, **kwargs):
+        request.url = local_url(request.url, address)
+        return send(adapter, request, **kwargs)
+
+    async def local_pool_request(pool, method, url, *args, **kwargs):
+        return await pool_request(pool, method, local_url(url, address), *args,
+                                  **kwargs)
+
+    requests.adapters.HTTPAdapter.send = local_send
+    cli.async_http.ConnectionPool.request = local_pool_request
+    try:
+        yield
+    finally:
+        requests.adapters.HTTPAdapter.send = send
+        cli.async_http.ConnectionPool.request = pool_request
@@ -0,0 +1,149 @@
+"""Import-time benchmark for each pybatchai command.
+
+Every command imports the cli modules and Azure SDKs it needs in its own body
+(and in the bodies of the groups above it). This script reads those import
+statements from the click tree, then times ``import pybatchai`` plus exactly
+those imports in a fresh interpreter with ``python -X importtime``, or with the
+wall clock on Python 3.6, which has no -X importtime.
+
+    python -m benchmarks.startup --output startup.json
+    python -m benchmarks.startup --compare startup.json
+
+With --compare the script exits non-zero when a command got slower than the
+baseline by more than --threshold (relative) and --min-delta-ms (absolute).
+"""
+import argparse
+import ast
+import inspect
+import json
+import os
+import statistics
+import subprocess
+import sys
+import textwrap
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HELP_COMMAND = '--help'
+# -X importtime is Python 3.7+; older interpreters ignore it silently, so they
+# time the imports with the wall clock instead
+IMPORTTIME = sys.version_info >= (3, 7)
+WALL_CLOCK = ('import time; started = time.perf_counter(); {}; '
+              'print((time.perf_counter() - started) * 1000.0)')
+
+def command_imports(root_command, module):
+    """Map each command path to the import statements it runs."""
+    commands = {HELP_COMMAND: []}
+
+    def walk(command, path, imports):
+        imports = imports + callback_imports(command.callback, module)
+        if isinstance(command, click.Group):
+            for name, sub_command in sorted(command.commands.items()):
+                walk(sub_command, path + [name], imports)
+        else:
+            commands[' '.join(path)] = imports
+
+    walk(root_command, [], [])
+    return commands
+
+def callback_imports(callback, module, seen=None):
+    """Import statements in callback, following calls to module-level helpers."""
+    seen = set() if seen is None else seen
+    function = inspect.unwrap(callback)
+    if function in seen:
+        return []
+    seen.add(function)
+    tree = ast.parse(textwrap.dedent(inspect.getsource(function)))
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend('import {}'.format(alias.name) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imports.extend('from {} import {}'.format(node.module, alias.name)
+                           for alias in node.names)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            helper = getattr(module, node.func.id, None)
+            if inspect.isfunction(helper) and helper.__module__ == module.__name__:
+                imports.extend(callback_imports(helper, module, seen))
+    return imports
+
+def time_imports(imports, repeat):
+    """Median total import time in milliseconds for pybatchai plus imports."""
+    code = '; '.join(['import pybatchai'] + imports)
+    samples = []
+    for _ in range(repeat):
+        if IMPORTTIME:
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                    cwd=ROOT, stderr=subprocess.PIPE,
+                                    universal_newlines=True, check=True)
+            samples.append(sum_self_time(result.stderr) / 1000.0)
+        else:
+            result = subprocess.run([sys.executable, '-c', WALL_CLOCK.format(code)],
+                                    cwd=ROOT, stdout=subprocess.PIPE,
+                                    universal_newlines=True, check=True)
+            samples.append(float(result.stdout.split()[-1]))
+    return statistics.median(samples)
+
+def sum_self_time(importtime_output):
+    total = 0
+    timed = False
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line.split('|')
+        try:
+            total += int(fields[0].split(':')[1])
+        except ValueError:
+            # the header line
+            continue
+        timed = True
+    if not timed:
+        raise RuntimeError('python -X importtime reported no imports.')
+    return total
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Print per-command deltas and return the commands that regressed."""
+    regressions = []
+    for command, import_ms in sorted(results.items()):
+        before = baseline.get(command)
+        if before is None:
+            print('{:<40} {:>9.1f} ms  (new)'.format(command, import_ms))
+            continue
+        delta = import_ms - before
+        print('{:<40} {:>9.1f} ms  {:+8.1f} ms'.format(command, import_ms, delta))
+        if delta > min_delta_ms and delta > before * threshold:
+            regressions.append(command)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON written by --output')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--min-delta-ms', type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    import pybatchai
+
+    results = {command: time_imports(imports, args.repeat)
+               for command, imports
+               in command_imports(pybatchai.main, pybatchai).items()}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'python': sys.version.split()[0],
+                       'import_ms': results}, output, indent=2, sort_keys=True)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['import_ms']
+    regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+    if regressions:
+        print('import time regressed for: {}'.format(', '.join(regressions)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
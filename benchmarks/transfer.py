@@ -0,0 +1,311 @@
+"""Offline transfer benchmark for cli.blobxfer_util.
+
+Generates datasets, then uploads and downloads each one through
+start_uploader and start_downloader against benchmarks.fake_storage, once per
+storage mode, concurrency setting and transfer engine:
+
+    tiny   many sub-KB files
+    mixed  file sizes spread log-uniformly from 1 KiB to 16 MiB
+    huge   a few large files
+
+Every transfer runs in a fresh interpreter so peak RSS and CPU time belong to
+that transfer alone; the fake storage runs in this process and counts the
+requests it serves. --scale multiplies file counts (tiny, mixed) or sizes
+(huge). Comparing engines head to head on small files:
+
+    python -m benchmarks.transfer --dataset tiny --engine blobxfer --engine async
+
+    python -m benchmarks.transfer --output transfer.json
+    python -m benchmarks.transfer --compare transfer.json
+
+The script exits non-zero when a configuration failed, and with --compare
+also when the MB/s of a configuration dropped below the baseline by more than
+--threshold (relative).
+"""
+import argparse
+import base64
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MiB = 1024 * 1024
+STORAGE_ACCOUNT = 'benchmark'
+STORAGE_ACCOUNT_KEY = base64.b64encode(b'benchmark' * 8).decode()
+MODES = ['Block', 'File']
+CONCURRENCY = ['fixed', 'auto']
+ENGINES = ['blobxfer', 'async']
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+MEMORY_BUDGET_MB = 1024
+
+def tiny_sizes(rng, scale):
+    return [rng.randint(64, 1023) for _ in range(int(2000 * scale))]
+
+def mixed_sizes(rng, scale):
+    return [int(2 ** rng.uniform(10, 24)) for _ in range(int(200 * scale))]
+
+def huge_sizes(rng, scale):
+    return [int(128 * MiB * scale)] * 2
+
+DATASETS = {'tiny': tiny_sizes, 'mixed': mixed_sizes, 'huge': huge_sizes}
+
+def generate(path, sizes):
+    """Write files of the given sizes, at most 100 per directory."""
+    for number, size in enumerate(sizes):
+        directory = os.path.join(path, 'd{:03d}'.format(number // 100))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'f{:06d}'.format(number)),
+                  'wb') as local_file:
+            for start in range(0, size, MiB):
+                local_file.write(os.urandom(min(MiB, size - start)))
+
+def run_transfer(address, direction, mode, concurrency, engine, local_path,
+                 remote_path, cache_dir, work_dir, timeout):
+    """Time one transfer in a fresh interpreter and return its measurements."""
+    result_path = os.path.join(work_dir, 'result.json')
+    job = {'address': address, 'direction': direction, 'mode': mode,
+           'concurrency': concurrency, 'engine': engine, 'local_path': local_path,
+           'remote_path': remote_path, 'cache_dir': cache_dir,
+           'result_path': result_path}
+    # blobxfer writes a log file and a progress bar to its working directory
+    try:
+        result = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.transfer', '--worker',
+             json.dumps(job)],
+            cwd=work_dir, env=dict(os.environ, PYTHONPATH=ROOT),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError('{} {} did not finish within {} s.'.format(
+            direction, remote_path, timeout))
+    if result.returncode != 0:
+        raise RuntimeError('{} {} failed:\n{}'.format(direction, remote_path,
+                                                      result.stdout[-4000:]))
+    with open(result_path) as result_file:
+        return json.load(result_file)
+
+def worker(job):
+    """Run one transfer against the fake storage and record its cost."""
+    import blobxfer.models.azure as azmodels
+
+    import benchmarks.fake_storage
+    import cli.blobxfer_util
+
+    context = types.SimpleNamespace(obj={
+        'storage_account': STORAGE_ACCOUNT,
+        'storage_account_key': STORAGE_ACCOUNT_KEY,
+        'local_path': job['local_path'],
+        'cache_dir': job['cache_dir'],
+        'transfer_options': {'concurrency': job['concurrency'],
+                             'engine': job['engine'],
+                             'cpu_budget': None,
+                             'memory_budget_mb': MEMORY_BUDGET_MB}})
+    mode = azmodels.StorageModes[job['mode']]
+    with benchmarks.fake_storage.redirect(job['address']):
+        if job['engine'] == 'async' or (job['direction'] == DOWNLOAD
+                                        and job['concurrency'] == 'auto'):
+            set_storage_services(context, job['address'])
+        start = time.monotonic()
+        if job['direction'] == UPLOAD:
+            cli.blobxfer_util.start_uploader(context, mode, job['remote_path'])
+        else:
+            cli.blobxfer_util.start_downloader(context, mode, job['remote_path'])
+        seconds = time.monotonic() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with open(job['result_path'], 'w') as result_file:
+        json.dump({'seconds': seconds,
+                   'cpu_seconds': (usage.ru_utime + usage.ru_stime
+                                   + children.ru_utime + children.ru_stime),
+                   # ru_maxrss is in KiB on Linux
+                   'peak_rss_mb': max(usage.ru_maxrss,
+                                      children.ru_maxrss) / 1024.0},
+                  result_file)
+
+def set_storage_services(context, address):
+    """Clients auto concurrency lists remote sizes with, and the async engine
+    takes its endpoints from.
+
+    The async engine does not go through requests, so redirect() cannot reach
+    it; the clients point at address themselves instead.
+    """
+    from azure.storage.blob import BlockBlobService
+    from azure.storage.file import FileService
+
+    context.obj['blob_storage_service'] = BlockBlobService(
+        account_name=STORAGE_ACCOUNT, account_key=STORAGE_ACCOUNT_KEY,
+        protocol='http', custom_domain=address + '/blob')
+    fileshare_service = FileService(STORAGE_ACCOUNT, STORAGE_ACCOUNT_KEY)
+    fileshare_service.protocol = 'http'
+    fileshare_service.primary_endpoint = address + '/file'
+    context.obj['fileshare_service'] = fileshare_service
+
+def benchmark(datasets, modes, concurrencies, engines, scale, repeat, timeout):
+    import benchmarks.fake_storage
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='pybatchai-benchmark-') as scratch, \
+            benchmarks.fake_storage.running() as server:
+        for dataset in datasets:
+            sizes = DATASETS[dataset](random.Random(dataset), scale)
+            source = os.path.join(scratch, dataset)
+            generate(source, sizes)
+            for mode, concurrency, engine in itertools.product(
+                    modes, concurrencies, engines):
+                server.store.create_share(remote_name(dataset, concurrency, engine))
+                for direction in (UPLOAD, DOWNLOAD):
+                    result = {'dataset': dataset, 'mode': mode,
+                              'concurrency': concurrency, 'engine': engine,
+                              'direction': direction}
+                    try:
+                        result.update(run_configuration(
+                            server, scratch, source, sizes, result, repeat,
+                            timeout))
+                    except RuntimeError as error:
+                        # keep going, a stuck configuration is a result too
+                        result['error'] = str(error)
+                    print(format_result(result))
+                    results.append(result)
+            shutil.rmtree(source)
+    return results
+
+def run_configuration(server, scratch, source, sizes, configuration, repeat,
+                      timeout):
+    remote_path = remote_name(configuration['dataset'],
+                              configuration['concurrency'],
+                              configuration['engine'])
+    runs = []
+    for _ in range(repeat):
+        local_path = source
+        if configuration['direction'] == DOWNLOAD:
+            local_path = os.path.join(scratch, 'download')
+            shutil.rmtree(local_path, ignore_errors=True)
+        server.store.reset_counters()
+        run = run_transfer(server.address, configuration['direction'],
+                           configuration['mode'], configuration['concurrency'],
+                           configuration['engine'], local_path, remote_path,
+                           os.path.join(scratch, 'cache'), scratch, timeout)
+        run.update(server.store.counters())
+        runs.append(run)
+    return summarize(runs, len(sizes), sum(sizes))
+
+def remote_name(dataset, concurrency, engine):
+    return '-'.join([dataset, concurrency, engine])
+
+def summarize(runs, files, total_bytes):
+    """Median measurements over repeated runs of one configuration."""
+    seconds = statistics.median(run['seconds'] for run in runs)
+    requests = statistics.median(run['requests'] for run in runs)
+    return {'files': files,
+            'bytes': total_bytes,
+            'seconds': seconds,
+            'mb_per_s': total_bytes / MiB / seconds if seconds else 0.0,
+            'requests': requests,
+            'requests_per_s': requests / seconds if seconds else 0.0,
+            'cpu_seconds': statistics.median(run['cpu_seconds'] for run in runs),
+            'peak_rss_mb': statistics.median(run['peak_rss_mb'] for run in runs),
+            'operations': runs[-1]['operations']}
+
+def result_key(result):
+    # results from before engines were benchmarked ran blobxfer
+    return '/'.join([result['dataset'], result['mode'], result['concurrency'],
+                     result.get('engine', 'blobxfer'), result['direction']])
+
+def format_result(result):
+    if 'error' in result:
+        return '{:<40} failed: {}'.format(result_key(result), result['error'])
+    return ('{:<40} {:>9.1f} MB/s {:>9.0f} req/s {:>7.1f} s cpu '
+            '{:>7.0f} MB rss').format(result_key(result), result['mb_per_s'],
+                                      result['requests_per_s'],
+                                      result['cpu_seconds'], result['peak_rss_mb'])
+
+def compare(results, baseline, threshold):
+    """Print throughput deltas against baseline and return the configurations
+    that regressed; failed configurations are reported by main.
+    """
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        before = baseline.get(key)
+        if 'error' in result:
+            continue
+        if before is None or 'error' in before:
+            print('{:<40} {:>9.1f} MB/s  (new)'.format(key, result['mb_per_s']))
+            continue
+        change = (result['mb_per_s'] - before['mb_per_s']) / before['mb_per_s'] \
+            if before['mb_per_s'] else math.inf
+        print('{:<40} {:>9.1f} MB/s  {:+7.1%}'.format(key, result['mb_per_s'],
+                                                     change))
+        if change < -threshold:
+            regressions.append(key)
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataset', action='append', choices=sorted(DATASETS),
+                        help='defaults to all datasets')
+    parser.add_argument('--mode', action='append', choices=MODES,
+                        help='defaults to all storage modes')
+    parser.add_argument('--concurrency', action='append', choices=CONCURRENCY,
+                        help='defaults to both concurrency settings')
+    parser.add_argument('--engine', action='append', choices=ENGINES,
+                        help='defaults to both transfer engines')
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--timeout', type=int, default=1800,
+                        help='seconds one transfer may take')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON written by --output')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    if args.worker:
+        worker(json.loads(args.worker))
+        return 0
+    results = benchmark(args.dataset or sorted(DATASETS), args.mode or MODES,
+                        args.concurrency or CONCURRENCY, args.engine or ENGINES,
+                        args.scale, args.repeat, args.timeout)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'python': sys.version.split()[0],
+                       'commit': git_commit(),
+                       'scale': args.scale,
+                       'results': {result_key(result): result
+                                   for result in results}},
+                      output, indent=2, sort_keys=True)
+    failed = [result_key(result) for result in results if 'error' in result]
+    if failed:
+        print('failed: {}'.format(', '.join(failed)))
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = {result_key(result): result for result
+                        in json.load(baseline_file)['results'].values()}
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('throughput regressed for: {}'.format(', '.join(regressions)))
+    return 1 if failed or regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
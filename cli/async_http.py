@@ -0,0 +1,200 @@
+"""Minimal HTTP/1.1 client on asyncio streams, for the async transfer engine.
+
+Requests share a bounded pool of keep-alive connections per host, so
+thousands of concurrent requests from one event loop reuse at most size
+connections instead of opening one each. Only what Azure Storage needs is
+supported: Content-Length or chunked response bodies, no redirects and no
+proxies. A request is retried on a server error, on throttling, when a
+pooled connection turns out to have been closed by the server and when
+connecting or any read of the response takes longer than its timeout.
+"""
+import asyncio
+import collections
+import ssl
+import urllib.parse
+
+READ_BYTES = 1024 * 1024
+RETRIES = 5
+BACKOFF = 0.5
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+NO_BODY_STATUSES = {204, 304}
+CONNECT_TIMEOUT = 30
+# seconds each read of a response, or write of a request, may wait
+READ_TIMEOUT = 60
+
+Response = collections.namedtuple('Response', ['status', 'headers', 'body'])
+
+class HTTPError(Exception):
+    def __init__(self, method, url, response):
+        super(HTTPError, self).__init__('{} {} failed with {}: {}'.format(
+            method, urllib.parse.urlsplit(url).path, response.status,
+            response.body[:200].decode(errors='replace')))
+        self.response = response
+
+class StaleConnection(ConnectionError):
+    pass
+
+class TimedOut(ConnectionError):
+    pass
+
+async def within(timeout, awaitable):
+    """Await awaitable, raising TimedOut, which is retried, after timeout."""
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise TimedOut('No progress for {} seconds.'.format(timeout))
+
+class ConnectionPool:
+    """At most size open connections, kept alive between requests."""
+
+    def __init__(self, size, ssl_context=None):
+        self.semaphore = asyncio.Semaphore(size)
+        self.idle = collections.defaultdict(list)
+        self.ssl_context = ssl_context
+
+    async def request(self, method, url, headers=None, body=b'', sink=None):
+        """Send a request and return its Response.
+
+        A status of 400 or more raises HTTPError. With sink, each piece of a
+        successful body is passed to sink instead of kept in the Response.
+        """
+        parts = urllib.parse.urlsplit(url)
+        target = parts.path + ('?' + parts.query if parts.query else '')
+        request = encode_request(method, parts.netloc, target, headers or {}, body)
+        written = []
+        if sink is not None:
+            def write(piece, sink=sink):
+                written.append(len(piece))
+                sink(piece)
+        else:
+            write = None
+        for attempt in range(RETRIES + 1):
+            try:
+                response = await self.send(parts, method, request, write)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # what sink already received cannot be taken back
+                if attempt == RETRIES or written:
+                    raise
+                response = None
+            if response is not None and (response.status not in RETRY_STATUSES
+                                         or attempt == RETRIES):
+                break
+            await asyncio.sleep(BACKOFF * 2 ** attempt)
+        if response.status >= 400:
+            raise HTTPError(method, url, response)
+        return response
+
+    async def send(self, parts, method, request, sink):
+        key = (parts.scheme, parts.hostname, parts.port)
+        async with self.semaphore:
+            if self.idle[key]:
+                try:
+                    return await self.exchange(key, self.idle[key].pop(), method,
+                                               request, sink)
+                except StaleConnection:
+                    # the server closed the idle connection; use a new one
+                    pass
+            return await self.exchange(key, await self.connect(parts), method,
+                                       request, sink)
+
+    async def exchange(self, key, connection, method, request, sink):
+        reader, writer = connection
+        try:
+            try:
+                writer.write(request)
+                await within(READ_TIMEOUT, writer.drain())
+            except ConnectionError as error:
+                raise StaleConnection(str(error))
+            response, keep_alive = await read_response(reader, method, sink)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            self.idle[key].append(connection)
+        else:
+            writer.close()
+        return response
+
+    async def connect(self, parts):
+        if parts.scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            return await within(CONNECT_TIMEOUT, asyncio.open_connection(
+                parts.hostname, parts.port or 443, ssl=self.ssl_context))
+        return await within(CONNECT_TIMEOUT, asyncio.open_connection(
+            parts.hostname, parts.port or 80))
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+def run(coroutine):
+    """Run coroutine on a new event loop and return its result, as
+    asyncio.run does on Python 3.7+.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def encode_request(method, host, target, headers, body):
+    lines = ['{} {} HTTP/1.1'.format(method, target), 'Host: {}'.format(host),
+             'Content-Length: {}'.format(len(body))]
+    lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + bytes(body)
+
+async def read_response(reader, method, sink):
+    """The Response, and whether the connection can be reused."""
+    try:
+        status_line = await within(READ_TIMEOUT, reader.readuntil(b'\r\n'))
+    except asyncio.IncompleteReadError:
+        raise StaleConnection('Connection closed before a response.')
+    version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+    status = int(status)
+    headers = {}
+    while True:
+        line = await within(READ_TIMEOUT, reader.readuntil(b'\r\n'))
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    keep_alive = version == 'HTTP/1.1' and \
+        headers.get('connection', '').lower() != 'close'
+    pieces = []
+    # error bodies are kept for the error message, whatever sink is
+    write = sink if sink is not None and status < 400 else pieces.append
+    if method == 'HEAD' or status in NO_BODY_STATUSES:
+        pass
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        await read_chunked(reader, write)
+    elif 'content-length' in headers:
+        remaining = int(headers['content-length'])
+        while remaining:
+            piece = await within(READ_TIMEOUT, reader.readexactly(
+                min(remaining, READ_BYTES)))
+            write(piece)
+            remaining -= len(piece)
+    else:
+        while True:
+            piece = await within(READ_TIMEOUT, reader.read(READ_BYTES))
+            if not piece:
+                break
+            write(piece)
+        keep_alive = False
+    return Response(status, headers, b''.join(pieces)), keep_alive
+
+async def read_chunked(reader, write):
+    while True:
+        size = int((await within(READ_TIMEOUT, reader.readuntil(b'\r\n')))
+                   .split(b';')[0], 16)
+        if size == 0:
+            # trailers end with an empty line
+            while await within(READ_TIMEOUT,
+                               reader.readuntil(b'\r\n')) != b'\r\n':
+                pass
+            return
+        write(await within(READ_TIMEOUT, reader.readexactly(size)))
+        await within(READ_TIMEOUT, reader.readexactly(2))
@@ -0,0 +1,324 @@
+"""Uploads and downloads on one asyncio event loop, for --engine async.
+
+blobxfer moves every file through its own threads and queues, which costs far
+more than the transfer itself when the files are small. This engine runs one
+task per file on a single event loop instead, sending requests through a
+cli.async_http.ConnectionPool, so thousands of small files are in flight at
+once over a bounded number of keep-alive connections. Requests are signed
+with a SAS of the container or share.
+
+It follows blobxfer otherwise: the same files are selected, only --prefix is
+listed, remote files are overwritten, --sync downloads skip local files of the
+same size that are at least as new, and --sync --delete downloads remove
+local files missing remotely.
+"""
+import asyncio
+import base64
+import datetime
+import email.utils
+import logging
+import mimetypes
+import os
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+
+from azure.storage.blob import ContainerPermissions
+from azure.storage.file import SharePermissions
+import blobxfer.models.azure as azmodels
+
+import cli.async_http
+import cli.blobxfer_util
+import cli.compress
+import cli.local_files
+import cli.tuning
+
+LOGGER = logging.getLogger(__name__)
+X_MS_VERSION = '2018-03-28'
+SAS_LIFETIME = datetime.timedelta(hours=12)
+# files downloaded at once, well below common open file limits
+FILES_IN_FLIGHT = 256
+# chunks read into memory at once per connection
+BUFFERS_PER_CONNECTION = 2
+LIST_PAGE_SIZE = 5000
+
+class Endpoint:
+    """Signed URLs of the entries of a container or share, and the prefix of
+    remote_path inside it.
+    """
+
+    def __init__(self, mode, service, remote_path):
+        self.mode = mode
+        name, self.prefix = cli.blobxfer_util.split_remote_path(remote_path)
+        self.root = '{}://{}/{}'.format(service.protocol, service.primary_endpoint,
+                                        urllib.parse.quote(name))
+        expiry = datetime.datetime.utcnow() + SAS_LIFETIME
+        if mode == azmodels.StorageModes.File:
+            self.sas = service.generate_share_shared_access_signature(
+                name, permission=SharePermissions(
+                    read=True, write=True, delete=True, list=True),
+                expiry=expiry)
+        else:
+            self.sas = service.generate_container_shared_access_signature(
+                name, permission=ContainerPermissions(
+                    read=True, write=True, delete=True, list=True),
+                expiry=expiry)
+
+    def url(self, name='', **query):
+        path = self.root + ('/' + urllib.parse.quote(name) if name else '')
+        return '{}?{}'.format(path, '&'.join(
+            filter(None, [urllib.parse.urlencode(query), self.sas])))
+
+class Transfer:
+    """State shared by the tasks of one upload or download."""
+
+    def __init__(self, endpoint, connections, chunk_bytes):
+        self.endpoint = endpoint
+        self.pool = cli.async_http.ConnectionPool(connections)
+        self.chunk_bytes = chunk_bytes
+        self.files = asyncio.Semaphore(FILES_IN_FLIGHT)
+        self.buffers = asyncio.Semaphore(BUFFERS_PER_CONNECTION * connections)
+        # remote directory path to the task creating it
+        self.directories = {'': None}
+
+    async def request(self, method, name='', headers=None, body=b'', sink=None,
+                      **query):
+        headers = dict(headers or {}, **{'x-ms-version': X_MS_VERSION})
+        return await self.pool.request(method, self.endpoint.url(name, **query),
+                                       headers, body, sink)
+
+def chunk_size(mode, plan):
+    limit = (cli.tuning.MAX_FILE_RANGE_BYTES if mode == azmodels.StorageModes.File
+             else cli.tuning.MAX_BLOCK_BYTES)
+    return min(plan.chunk_size_bytes or cli.tuning.MAX_FILE_RANGE_BYTES, limit)
+
+def service(context, mode):
+    if mode == azmodels.StorageModes.File:
+        return context.obj['fileshare_service']
+    return context.obj['blob_storage_service']
+
+def upload(context, mode, remote_path, plan):
+    """Upload local_path to remote_path with plan.transfer_threads connections."""
+    local_files = list(cli.blobxfer_util.local_files(context))
+    LOGGER.info('Uploading %d files over at most %d connections.',
+                len(local_files), plan.transfer_threads)
+    # as blobxfer does; a container or share SAS cannot create its own
+    name = cli.blobxfer_util.split_remote_path(remote_path)[0]
+    if mode == azmodels.StorageModes.File:
+        service(context, mode).create_share(name)
+    else:
+        service(context, mode).create_container(name)
+    cli.async_http.run(upload_files(
+        Endpoint(mode, service(context, mode), remote_path),
+        plan.transfer_threads, chunk_size(mode, plan), local_files))
+
+async def upload_files(endpoint, connections, chunk_bytes, local_files):
+    transfer = Transfer(endpoint, connections, chunk_bytes)
+    upload_file = (upload_share_file if endpoint.mode == azmodels.StorageModes.File
+                   else upload_blob)
+    try:
+        await asyncio.gather(*[upload_file(transfer, local_file)
+                               for local_file in local_files])
+    finally:
+        transfer.pool.close()
+
+async def read_range(path, offset, size):
+    def read():
+        with open(path, 'rb') as local_file:
+            local_file.seek(offset)
+            return local_file.read(size)
+    return await asyncio.get_event_loop().run_in_executor(None, read)
+
+def content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+def remote_name(transfer, local_file):
+    return cli.blobxfer_util.remote_name(transfer.endpoint.prefix,
+                                         local_file.relative_path)
+
+async def upload_blob(transfer, local_file):
+    name = remote_name(transfer, local_file)
+    headers = {'x-ms-blob-content-type': content_type(name)}
+    if local_file.size <= transfer.chunk_bytes:
+        async with transfer.buffers:
+            await transfer.request(
+                'PUT', name, dict(headers, **{'x-ms-blob-type': 'BlockBlob'}),
+                await read_range(local_file.path, 0, local_file.size))
+        return
+    block_ids = [block_id(number)
+                 for number in range(-(-local_file.size // transfer.chunk_bytes))]
+    await asyncio.gather(*[upload_block(transfer, local_file, number, block_id)
+                           for number, block_id in enumerate(block_ids)])
+    await transfer.request('PUT', name, headers, block_list(block_ids),
+                           comp='blocklist')
+
+def block_id(number):
+    return base64.b64encode('{:08d}'.format(number).encode()).decode()
+
+def block_list(block_ids):
+    root = ElementTree.Element('BlockList')
+    for block_id in block_ids:
+        ElementTree.SubElement(root, 'Latest').text = block_id
+    return ElementTree.tostring(root)
+
+async def upload_block(transfer, local_file, number, block_id):
+    async with transfer.buffers:
+        data = await read_range(local_file.path, number * transfer.chunk_bytes,
+                                transfer.chunk_bytes)
+        await transfer.request('PUT', remote_name(transfer, local_file), body=data,
+                               comp='block', blockid=block_id)
+
+async def upload_share_file(transfer, local_file):
+    name = remote_name(transfer, local_file)
+    await create_directory(transfer, name.rpartition('/')[0])
+    await transfer.request('PUT', name, {
+        'x-ms-type': 'file',
+        'x-ms-content-length': str(local_file.size),
+        'x-ms-content-type': content_type(name)})
+    await asyncio.gather(*[
+        upload_range(transfer, local_file, offset)
+        for offset in range(0, local_file.size, transfer.chunk_bytes)])
+
+async def upload_range(transfer, local_file, offset):
+    async with transfer.buffers:
+        data = await read_range(local_file.path, offset, transfer.chunk_bytes)
+        await transfer.request('PUT', remote_name(transfer, local_file), {
+            'x-ms-range': 'bytes={}-{}'.format(offset, offset + len(data) - 1),
+            'x-ms-write': 'update'}, data, comp='range')
+
+async def create_directory(transfer, path):
+    """Create path and its parents once, however many files share them."""
+    if path not in transfer.directories:
+        transfer.directories[path] = asyncio.ensure_future(
+            create_new_directory(transfer, path))
+    if transfer.directories[path] is not None:
+        await asyncio.shield(transfer.directories[path])
+
+async def create_new_directory(transfer, path):
+    await create_directory(transfer, path.rpartition('/')[0])
+    try:
+        await transfer.request('PUT', path, restype='directory')
+    except cli.async_http.HTTPError as error:
+        if error.response.status != 409:
+            raise
+
+def download(context, mode, remote_path, plan, excluded=None):
+    """Download remote_path with plan.transfer_threads connections, leaving out
+    the names in excluded as cli.blobxfer_util.start_downloader does.
+    """
+    cli.async_http.run(download_files(
+        Endpoint(mode, service(context, mode), remote_path),
+        plan.transfer_threads, chunk_size(mode, plan), context.obj['local_path'],
+        cli.blobxfer_util.transfer_option(context, 'sync', False),
+        cli.blobxfer_util.transfer_option(context, 'delete', False),
+        frozenset(excluded or ()),
+        cli.blobxfer_util.transfer_option(context, 'include'),
+        cli.blobxfer_util.transfer_option(context, 'exclude')))
+
+async def download_files(endpoint, connections, chunk_bytes, local_path, sync,
+                         delete, excluded, includes=None, excludes=None):
+    transfer = Transfer(endpoint, connections, chunk_bytes)
+    try:
+        if endpoint.mode == azmodels.StorageModes.File:
+            remote = await list_share(transfer, endpoint.prefix)
+        else:
+            remote = await list_container(transfer)
+        # names relative to the prefix, which the local files are named after
+        remote = [entry._replace(name=cli.blobxfer_util.relative_name(
+            endpoint.prefix, entry.name)) for entry in remote]
+        remote = [entry for entry in remote if entry.name is not None
+                  and cli.local_files.selected(entry.name, includes, excludes)]
+        wanted = [entry for entry in remote if cli.blobxfer_util.remote_name(
+            endpoint.prefix, entry.name) not in excluded]
+        if sync:
+            fresh = await asyncio.gather(*[
+                up_to_date(transfer, local_path, entry) for entry in wanted])
+            wanted = [entry for entry, skip in zip(wanted, fresh) if not skip]
+        LOGGER.info('Downloading %d of %d files over at most %d connections.',
+                    len(wanted), len(remote), connections)
+        await asyncio.gather(*[download_file(transfer, local_path, entry.name)
+                               for entry in wanted])
+    finally:
+        transfer.pool.close()
+    if sync and delete and not excluded:
+        cli.compress.delete_extraneous(local_path,
+                                       {entry.name for entry in remote})
+
+async def list_container(transfer):
+    """Every blob below the prefix of the endpoint."""
+    blobs, marker = [], None
+    prefix = cli.blobxfer_util.list_prefix(transfer.endpoint.prefix)
+    while True:
+        query = {'restype': 'container', 'comp': 'list',
+                 'maxresults': LIST_PAGE_SIZE}
+        if prefix:
+            query['prefix'] = prefix
+        if marker:
+            query['marker'] = marker
+        root = ElementTree.fromstring((await transfer.request('GET', **query)).body)
+        for blob in root.iter('Blob'):
+            properties = blob.find('Properties')
+            blobs.append(cli.compress.RemoteBlob(
+                blob.findtext('Name'), int(properties.findtext('Content-Length')),
+                parse_date(properties.findtext('Last-Modified'))))
+        marker = root.findtext('NextMarker')
+        if not marker:
+            return blobs
+
+async def list_share(transfer, path=''):
+    """Every file under path, listing its directories at the same time."""
+    files, directories, marker = [], [], None
+    prefix = path + '/' if path else ''
+    while True:
+        query = {'restype': 'directory', 'comp': 'list',
+                 'maxresults': LIST_PAGE_SIZE}
+        if marker:
+            query['marker'] = marker
+        root = ElementTree.fromstring(
+            (await transfer.request('GET', path, **query)).body)
+        for entry in root.iter('File'):
+            # the listing has no modification times; up_to_date asks for them
+            files.append(cli.compress.RemoteBlob(
+                prefix + entry.findtext('Name'),
+                int(entry.find('Properties').findtext('Content-Length')), None))
+        directories.extend(prefix + entry.findtext('Name')
+                           for entry in root.iter('Directory'))
+        marker = root.findtext('NextMarker')
+        if not marker:
+            break
+    for nested in await asyncio.gather(*[list_share(transfer, directory)
+                                         for directory in directories]):
+        files.extend(nested)
+    return files
+
+def parse_date(value):
+    return email.utils.parsedate_to_datetime(value).timestamp()
+
+async def up_to_date(transfer, local_path, entry):
+    """Whether a --sync download can skip entry."""
+    try:
+        stat = os.stat(cli.compress.local_target(local_path, entry.name))
+    except FileNotFoundError:
+        return False
+    if stat.st_size != entry.size:
+        return False
+    last_modified = entry.last_modified
+    if last_modified is None:
+        response = await transfer.request('HEAD', cli.blobxfer_util.remote_name(
+            transfer.endpoint.prefix, entry.name))
+        last_modified = parse_date(response.headers['last-modified'])
+    return stat.st_mtime >= last_modified
+
+async def download_file(transfer, local_path, name):
+    """Download the entry name, relative to the prefix of the endpoint."""
+    target = cli.compress.local_target(local_path, name)
+    partial = target + cli.compress.PARTIAL_SUFFIX
+    async with transfer.files:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            with open(partial, 'wb') as local_file:
+                await transfer.request('GET', cli.blobxfer_util.remote_name(
+                    transfer.endpoint.prefix, name), sink=local_file.write)
+            os.replace(partial, target)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
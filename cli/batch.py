@@ -0,0 +1,130 @@
+"""Running many pybatchai operations in one process, for `pybatchai run`.
+
+A manifest lists operations, each given as the arguments that would follow
+the global options on a pybatchai command line:
+
+    workers: 8
+    operations:
+      - name: data
+        command: storage --name acct blobstorage --container data upload --local-path data
+      - name: show-gpu
+        command: [cluster, --workspace, ws, --name, gpu, show]
+        depends_on: [data]
+      - cluster --workspace ws status
+
+Every operation runs with the global options given to `run`, so
+authentication, the resource group check, the management clients and their
+pooled connections, resolved storage account keys and existence checks are
+shared by all of them instead of being repeated per command. Operations that
+do not depend on each other run at the same time, and an operation whose
+dependencies did not succeed is skipped. An operation is named after its
+command unless it has a name.
+"""
+import collections
+import functools
+import json
+import logging
+import shlex
+
+import click
+
+import cli.clients
+import cli.dag
+
+LOGGER = logging.getLogger(__name__)
+# commands that cannot run inside another command
+NESTED_COMMANDS = ['run', 'daemon']
+TABLE = 'table'
+JSON = 'json'
+
+Operation = collections.namedtuple('Operation', ['name', 'argv', 'depends_on'])
+
+class OperationFailed(Exception):
+    pass
+
+def operations(manifest, command):
+    """The operations of manifest, checked against the commands of command."""
+    entries = manifest.get('operations')
+    if not isinstance(entries, list) or not entries:
+        raise click.BadParameter('Manifest must list its operations.')
+    planned = []
+    names = set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            entry = {'command': entry}
+        argv = entry.get('command')
+        if isinstance(argv, str):
+            argv = shlex.split(argv)
+        if not isinstance(argv, list) or not argv:
+            raise click.BadParameter('Every operation needs a command.')
+        argv = [str(arg) for arg in argv]
+        if argv[0] not in command.commands or argv[0] in NESTED_COMMANDS:
+            raise click.BadParameter(
+                '{} is not a command run can perform.'.format(argv[0]))
+        name = str(entry.get('name') or ' '.join(argv))
+        if name in names:
+            raise click.BadParameter('Two operations are both named {}.'.format(name))
+        names.add(name)
+        depends_on = entry.get('depends_on') or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        planned.append(Operation(name, argv, [str(dep) for dep in depends_on]))
+    return planned
+
+def share(context):
+    """Create up front what every operation would otherwise create itself."""
+    cli.clients.set_storage_client(context)
+    cli.clients.create_batchai_client(context)
+    context.obj.setdefault('storage_account_keys', {})
+    context.obj.setdefault('known_state', {})
+
+def run(context, command, manifest, workers, output_format=TABLE):
+    """Run every operation of manifest; a cli.dag.Timing per operation name.
+
+    Timings are logged as a table, and with JSON output also printed.
+    """
+    planned = operations(manifest, command)
+    nodes = [cli.dag.node(operation.name,
+                          functools.partial(invoke, context.obj, command,
+                                            operation),
+                          operation.depends_on)
+             for operation in planned]
+    try:
+        cli.dag.check_graph({graph_node.name: graph_node for graph_node in nodes})
+    except (KeyError, cli.dag.CycleError) as error:
+        raise click.BadParameter('Manifest {}.'.format(error.args[0]))
+    LOGGER.info('Running %d operations.', len(nodes))
+    timings = cli.dag.run(nodes, workers)
+    cli.dag.log_report(nodes, timings)
+    if output_format == JSON:
+        print(json.dumps({'operations': result_rows(timings)}, indent=2,
+                         sort_keys=True))
+    return timings
+
+def invoke(obj, command, operation):
+    """Run the operation as pybatchai would, on its own copy of obj."""
+    parent = click.Context(command, info_name='pybatchai', obj=dict(obj))
+    try:
+        with parent:
+            name, sub_command, args = command.resolve_command(parent,
+                                                              list(operation.argv))
+            with sub_command.make_context(name, args, parent=parent) as context:
+                sub_command.invoke(context)
+    except click.exceptions.Exit as error:
+        if error.exit_code:
+            raise OperationFailed('{} exited with {}.'.format(operation.name,
+                                                             error.exit_code))
+    except click.ClickException as error:
+        raise OperationFailed('{}: {}'.format(operation.name,
+                                              error.format_message()))
+    except click.Abort:
+        raise OperationFailed('{} was aborted.'.format(operation.name))
+
+def result_rows(timings):
+    return [{'name': name,
+             'status': timing.status,
+             'start': round(timing.start, 3),
+             'duration': round(timing.end - timing.start, 3),
+             'error': None if timing.result is None else str(timing.result)}
+            for name, timing in sorted(timings.items(),
+                                       key=lambda item: item[1].start)]
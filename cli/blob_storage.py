@@ -1,3 +1,5 @@
+import logging
+
 from azure.storage.blob import (
     BlockBlobService,
     PublicAccess
@@ -5,23 +7,103 @@ from azure.storage.blob import (
 import blobxfer.models.azure as azmodels
 
 import cli.blobxfer_util
+import cli.compress
+import cli.dedup
+import cli.pack
+import cli.remote
+import cli.state
+import cli.storage
+import cli.sync
+import cli.trace
+import cli.tuning
+import cli.utils
+
+LOGGER = logging.getLogger(__name__)
+CONTAINER_TYPE = 'container'
 
 def set_blob_storage_service(context):
     context.obj['blob_storage_service'] = BlockBlobService(
         account_name=context.obj['storage_account'],
         account_key=context.obj['storage_account_key'])
 
+@cli.trace.traced
 def set_container_public_access(context):
     context.obj['blob_storage_service'].set_container_acl(
         context.obj['container_name'], public_access=PublicAccess.Container)
 
+def container_exists(context):
+    container_name = context.obj['container_name']
+    return cli.state.exists(
+        context, CONTAINER_TYPE, container_state_name(context),
+        lambda: context.obj['blob_storage_service'].exists(container_name))
+
+def container_state_name(context):
+    return '{}/{}'.format(context.obj['storage_account'],
+                          context.obj['container_name'])
+
+@cli.trace.traced
+def create_container_if_not_exists(context):
+    container_name = context.obj['container_name']
+    if not container_exists(context):
+        context.obj['blob_storage_service'].create_container(
+            container_name, fail_on_exist=False)
+        cli.state.record(context, CONTAINER_TYPE, container_state_name(context),
+                         True)
+        LOGGER.info(cli.utils.created(CONTAINER_TYPE, container_name))
+    else:
+        LOGGER.info(cli.utils.already_exists(CONTAINER_TYPE, container_name))
+
+@cli.trace.traced
 def upload(context):
-    cli.blobxfer_util.start_uploader(context,
-                                     azmodels.StorageModes.Block,
-                                     context.obj['container_name'])
+    cli.storage.retry_on_auth_error(context, upload_to_container,
+                                    set_blob_storage_service)
+
+def upload_to_container(context):
+    if cli.blobxfer_util.transfer_option(context, 'pack'):
+        create_container_if_not_exists(context)
+        cli.pack.upload(container_remote(context), context.obj['local_path'],
+                        cli.blobxfer_util.transfer_option(context, 'shard_size_mb')
+                        * cli.pack.MiB)
+    elif cli.blobxfer_util.transfer_option(context, 'dedup'):
+        create_container_if_not_exists(context)
+        cli.dedup.upload(container_remote(context),
+                         list(cli.blobxfer_util.local_files(context)),
+                         cli.blobxfer_util.transfer_option(context, 'prefix'),
+                         cli.blobxfer_util.transfer_option(context, 'cpu_budget')
+                         or cli.tuning.default_cpu_budget())
+    else:
+        cli.sync.start_uploader(context,
+                                azmodels.StorageModes.Block,
+                                cli.blobxfer_util.prefixed_remote_path(
+                                    context, context.obj['container_name']))
+    cli.state.record(context, CONTAINER_TYPE, container_state_name(context),
+                     True)
     set_container_public_access(context)
 
+@cli.trace.traced
 def download(context):
-    cli.blobxfer_util.start_downloader(context,
-                                       azmodels.StorageModes.Block,
-                                       context.obj['container_name'])
+    cli.storage.retry_on_auth_error(context, download_from_container,
+                                    set_blob_storage_service)
+
+def download_from_container(context):
+    if not container_exists(context):
+        LOGGER.warning(cli.utils.does_not_exist(CONTAINER_TYPE,
+                                                context.obj['container_name']))
+        return
+    if cli.blobxfer_util.transfer_option(context, 'pack'):
+        cli.pack.download(container_remote(context), context.obj['local_path'],
+                          cli.blobxfer_util.transfer_option(context, 'member'))
+        return
+    if cli.blobxfer_util.transfer_option(context, 'dedup'):
+        cli.dedup.download(container_remote(context), context.obj['local_path'],
+                           cli.blobxfer_util.transfer_option(context, 'prefix'),
+                           cli.blobxfer_util.transfer_option(context, 'include'),
+                           cli.blobxfer_util.transfer_option(context, 'exclude'))
+        return
+    cli.compress.start_downloader(context, azmodels.StorageModes.Block,
+                                  cli.blobxfer_util.prefixed_remote_path(
+                                      context, context.obj['container_name']))
+
+def container_remote(context):
+    return cli.remote.BlobRemote(context.obj['blob_storage_service'],
+                                 context.obj['container_name'])
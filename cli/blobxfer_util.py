@@ -1,9 +1,33 @@
+import functools
+import itertools
+import logging
+import math
+import time
+
 import blobxfer.api
 import blobxfer.models.azure as azmodels
 import blobxfer.models.options as options
 
+import cli.async_transfer
+import cli.local_files
+import cli.trace
+import cli.tuning
+
+LOGGER = logging.getLogger(__name__)
 DOWNLOAD = 1
 UPLOAD = 2
+FIXED = 'fixed'
+AUTO = 'auto'
+BLOBXFER = 'blobxfer'
+ASYNC = 'async'
+FIXED_PLANS = {
+    UPLOAD: cli.tuning.TransferPlan(disk_threads=16, transfer_threads=32,
+                                    chunk_size_bytes=0),
+    DOWNLOAD: cli.tuning.TransferPlan(disk_threads=16, transfer_threads=32,
+                                      chunk_size_bytes=4194304)
+}
+# remote entries sampled to size a download; one listing page
+DOWNLOAD_SAMPLE_SIZE = 5000
 TIMEOUT = blobxfer.api.TimeoutOptions(
     connect=None,
     read=None,
@@ -14,19 +38,43 @@ SKIP_ON_OPTIONS = blobxfer.api.SkipOnOptions(
     lmt_ge=None,
     md5_match=None
 )
+# --sync downloads skip local files that match the remote size and are newer
+SYNC_SKIP_ON_OPTIONS = blobxfer.api.SkipOnOptions(
+    filesize_match=True,
+    lmt_ge=True,
+    md5_match=False
+)
+@cli.trace.traced
 def start_uploader(context, mode, remote_path):
-    concurrency = create_concurrency_options(action=UPLOAD)
+    sizes = None
+    if transfer_option(context, 'concurrency', FIXED) == AUTO:
+        sizes = [local_file.size for local_file in local_files(context)]
+    plan = choose_transfer_plan(context, UPLOAD, mode, sizes)
+    if transfer_option(context, 'engine', BLOBXFER) == ASYNC:
+        start = functools.partial(cli.async_transfer.upload, context, mode,
+                                  remote_path, plan)
+    else:
+        start = blobxfer_uploader(context, mode, remote_path, plan).start
+    if sizes is None:
+        start()
+        return
+    started = time.monotonic()
+    start()
+    cli.tuning.record_run(context.obj['cache_dir'],
+                          tuning_key(context, UPLOAD, mode, sizes), plan,
+                          sum(sizes), time.monotonic() - started)
+
+def blobxfer_uploader(context, mode, remote_path, plan):
+    concurrency = create_concurrency_options(plan, action=UPLOAD)
     general_options = create_general_options(concurrency, TIMEOUT)
-    upload_options = create_upload_options(storage_mode=mode)
+    upload_options = create_upload_options(
+        storage_mode=mode, chunk_size_bytes=plan.chunk_size_bytes)
     local_source_path = create_local_source_path(context)
     specification = blobxfer.api.UploadSpecification(upload_options,
                                                      SKIP_ON_OPTIONS,
                                                      local_source_path)
 
-    credentials = blobxfer.api.AzureStorageCredentials(general_options)
-    credentials.add_storage_account(name=context.obj['storage_account'],
-                                    key=context.obj['storage_account_key'],
-                                    endpoint='core.windows.net')
+    credentials = create_storage_credentials(context, general_options)
 
     azure_dest_path = blobxfer.api.AzureDestinationPath()
     azure_dest_path.add_path_with_storage_account(
@@ -35,45 +83,206 @@ def start_uploader(context, mode, remote_path):
     )
     specification.add_azure_destination_path(azure_dest_path)
 
-    blobxfer.api.Uploader(
+    return blobxfer.api.Uploader(
         general_options,
         credentials,
         specification
-    ).start()
+    )
 
-def start_downloader(context, mode, remote_path):
-    concurrency = create_concurrency_options(action=DOWNLOAD)
+@cli.trace.traced
+def start_downloader(context, mode, remote_path, excluded=None):
+    """Download remote_path with --engine, leaving out the names in excluded.
+
+    remote_path is a container or share, followed by the prefix to download
+    from, if any; files are downloaded relative to that prefix. With excluded,
+    the caller downloads those names itself and so also takes over deleting
+    extraneous local files.
+    """
+    sizes = None
+    if transfer_option(context, 'concurrency', FIXED) == AUTO:
+        sizes = sample_remote_sizes(context, mode, remote_path)
+    plan = choose_transfer_plan(context, DOWNLOAD, mode, sizes)
+    if transfer_option(context, 'engine', BLOBXFER) == ASYNC:
+        start = functools.partial(cli.async_transfer.download, context, mode,
+                                  remote_path, plan, excluded)
+    else:
+        start = blobxfer_downloader(context, mode, remote_path, plan,
+                                    excluded).start
+    if sizes is None:
+        start()
+        return
+    # whole seconds, as file systems may store coarser modification times
+    written_since = math.floor(time.time())
+    started = time.monotonic()
+    start()
+    seconds = time.monotonic() - started
+    total_bytes = downloaded_bytes(context.obj['local_path'], written_since)
+    # a run that skipped every file says nothing about throughput
+    if total_bytes:
+        cli.tuning.record_run(context.obj['cache_dir'],
+                              tuning_key(context, DOWNLOAD, mode, sizes), plan,
+                              total_bytes, seconds)
+
+def blobxfer_downloader(context, mode, remote_path, plan, excluded):
+    concurrency = create_concurrency_options(plan, action=DOWNLOAD)
     general_options = create_general_options(concurrency, TIMEOUT)
-    download_options = create_download_options(storage_mode=mode)
+    sync = transfer_option(context, 'sync', False)
+    prefix = split_remote_path(remote_path)[1]
+    download_options = create_download_options(
+        storage_mode=mode, chunk_size_bytes=plan.chunk_size_bytes,
+        delete_extraneous_destination=(
+            sync and transfer_option(context, 'delete', False) and not excluded),
+        strip_components=len(prefix.split('/')) if prefix else 0)
     local_destination_path = create_local_dest_path(context)
-    specification = blobxfer.api.DownloadSpecification(download_options,
-                                                       SKIP_ON_OPTIONS,
-                                                       local_destination_path)
+    specification = blobxfer.api.DownloadSpecification(
+        download_options,
+        SYNC_SKIP_ON_OPTIONS if sync else SKIP_ON_OPTIONS,
+        local_destination_path)
 
-    credentials = blobxfer.api.AzureStorageCredentials(general_options)
-    credentials.add_storage_account(name=context.obj['storage_account'],
-                                    key=context.obj['storage_account_key'],
-                                    endpoint='core.windows.net')
+    credentials = create_storage_credentials(context, general_options)
 
-    azure_src_path = blobxfer.api.AzureSourcePath()
+    azure_src_path = FilteringSourcePath(
+        prefix, transfer_option(context, 'include'),
+        transfer_option(context, 'exclude'), excluded or ())
     azure_src_path.add_path_with_storage_account(
         remote_path=remote_path,
         storage_account=context.obj['storage_account']
     )
     specification.add_azure_source_path(azure_src_path)
 
-    blobxfer.api.Downloader(
+    return blobxfer.api.Downloader(
         general_options,
         credentials,
         specification
-    ).start()
+    )
+
+class FilteringSourcePath(blobxfer.api.AzureSourcePath):
+    """Source path matching includes and excludes against names relative to
+    prefix, as uploads match them against local relative paths, and skipping
+    exact names in excluded, which blobxfer's patterns would match in time
+    proportional to their number for every remote entry.
+    """
+
+    def __init__(self, prefix, includes, excludes, excluded):
+        super(FilteringSourcePath, self).__init__()
+        self.prefix = prefix
+        self.includes = includes
+        self.excludes = excludes
+        self.excluded = frozenset(excluded)
 
-def create_concurrency_options(action=DOWNLOAD):
+    def _inclusion_check(self, path):
+        name = relative_name(self.prefix, str(path))
+        return name is not None and str(path) not in self.excluded and \
+            cli.local_files.selected(name, self.includes, self.excludes)
+
+def transfer_option(context, name, default=None):
+    return context.obj.get('transfer_options', {}).get(name, default)
+
+def local_files(context):
+    """The files under local_path that --include and --exclude select."""
+    return cli.local_files.scan(context.obj['local_path'],
+                                transfer_option(context, 'include'),
+                                transfer_option(context, 'exclude'))
+
+def prefixed_remote_path(context, name):
+    """The remote_path of container or share name: name/prefix with --prefix,
+    the way blobxfer takes a virtual directory.
+    """
+    prefix = transfer_option(context, 'prefix')
+    return '{}/{}'.format(name, prefix) if prefix else name
+
+def split_remote_path(remote_path):
+    """The container or share of remote_path, and the prefix after it."""
+    name, _, prefix = remote_path.partition('/')
+    return name, prefix
+
+def remote_name(prefix, relative_path):
+    return '{}/{}'.format(prefix, relative_path) if prefix else relative_path
+
+def relative_name(prefix, name):
+    """name relative to prefix, or None when it is not below prefix."""
+    if not prefix:
+        return name
+    if not name.startswith(prefix + '/'):
+        return None
+    return name[len(prefix) + 1:]
+
+def list_prefix(prefix):
+    """The server side listing prefix of the blobs below prefix."""
+    return prefix + '/' if prefix else None
+
+def choose_transfer_plan(context, action, mode, sizes):
+    """The fixed plan, or in auto mode one fitted to sizes and earlier runs."""
+    if sizes is None:
+        return FIXED_PLANS[action]
+    cpu_budget = (transfer_option(context, 'cpu_budget')
+                  or cli.tuning.default_cpu_budget())
+    memory_budget = transfer_option(context, 'memory_budget_mb') * cli.tuning.MiB
+    max_chunk_bytes = (cli.tuning.MAX_FILE_RANGE_BYTES
+                       if mode == azmodels.StorageModes.File
+                       else cli.tuning.MAX_BLOCK_BYTES)
+    plan = cli.tuning.plan_transfer(sizes, cpu_budget, memory_budget,
+                                    max_chunk_bytes)
+    history = cli.tuning.load_history(context.obj['cache_dir'],
+                                      tuning_key(context, action, mode, sizes))
+    plan = cli.tuning.adjust_for_history(plan, history, memory_budget)
+    LOGGER.info('Auto concurrency for %d files (%.1f MB): %d transfer threads, '
+                '%d disk threads, %d MiB chunks.', len(sizes),
+                sum(sizes) / cli.tuning.MiB, plan.transfer_threads,
+                plan.disk_threads, plan.chunk_size_bytes // cli.tuning.MiB)
+    return plan
+
+def tuning_key(context, action, mode, sizes):
+    small = sizes and max(sizes) <= cli.tuning.SMALL_FILE_BYTES
+    parts = [context.obj['storage_account'], mode.name,
+             'upload' if action == UPLOAD else 'download',
+             'small' if small else 'large']
+    # connections of the async engine are not blobxfer threads
+    if transfer_option(context, 'engine', BLOBXFER) == ASYNC:
+        parts.append(ASYNC)
+    return '/'.join(parts)
+
+def sample_remote_sizes(context, mode, remote_path):
+    name, prefix = split_remote_path(remote_path)
+    if mode == azmodels.StorageModes.File:
+        entries = context.obj['fileshare_service'].list_directories_and_files(
+            name, directory_name=prefix or None, num_results=DOWNLOAD_SAMPLE_SIZE)
+    else:
+        entries = context.obj['blob_storage_service'].list_blobs(
+            name, prefix=list_prefix(prefix), num_results=DOWNLOAD_SAMPLE_SIZE)
+    sizes = []
+    for entry in itertools.islice(entries, DOWNLOAD_SAMPLE_SIZE):
+        # directories have no content length
+        size = getattr(entry.properties, 'content_length', None)
+        if size is not None:
+            sizes.append(size)
+    return sizes
+
+def downloaded_bytes(local_path, since):
+    """Size of the files under local_path written at or after since, a
+    time.time(); overwritten files count in full, unlike with a difference of
+    the total size before and after.
+    """
+    try:
+        return sum(local_file.size
+                   for local_file in cli.local_files.scan(local_path)
+                   if local_file.mtime >= since)
+    except FileNotFoundError:
+        return 0
+
+def create_storage_credentials(context, general_options):
+    credentials = blobxfer.api.AzureStorageCredentials(general_options)
+    credentials.add_storage_account(name=context.obj['storage_account'],
+                                    key=context.obj['storage_account_key'],
+                                    endpoint='core.windows.net')
+    return credentials
+
+def create_concurrency_options(plan, action=DOWNLOAD):
     return blobxfer.api.ConcurrencyOptions(
         crypto_processes=0,
         md5_processes=0,
-        disk_threads=16,
-        transfer_threads=32,
+        disk_threads=plan.disk_threads,
+        transfer_threads=plan.transfer_threads,
         action=action
     )
 
@@ -85,10 +294,11 @@ def create_general_options(concurrency, timeout):
         timeout=timeout
     )
 
-def create_upload_options(storage_mode=azmodels.StorageModes.Block):
+def create_upload_options(storage_mode=azmodels.StorageModes.Block,
+                          chunk_size_bytes=0):
     return blobxfer.api.UploadOptions(
         access_tier=None,
-        chunk_size_bytes=0,
+        chunk_size_bytes=chunk_size_bytes,
         delete_extraneous_destination=False,
         mode=storage_mode,
         one_shot_bytes=0,
@@ -108,24 +318,29 @@ def create_upload_options(storage_mode=azmodels.StorageModes.Block):
         )
     )
 
-def create_download_options(storage_mode=azmodels.StorageModes.Block):
+def create_download_options(storage_mode=azmodels.StorageModes.Block,
+                            chunk_size_bytes=4194304,
+                            delete_extraneous_destination=False,
+                            strip_components=0):
     return blobxfer.api.DownloadOptions(
         check_file_md5=False,
-        chunk_size_bytes=4194304,
-        delete_extraneous_destination=False,
+        chunk_size_bytes=chunk_size_bytes,
+        delete_extraneous_destination=delete_extraneous_destination,
         mode=storage_mode,
         overwrite=True,
         recursive=True,
         rename=False,
         restore_file_attributes=False,
         rsa_private_key=None,
-        strip_components=0
+        strip_components=strip_components
     )
 
 def create_local_source_path(context):
     local_source_path = blobxfer.api.LocalSourcePath()
-    local_source_path.add_includes(['*.*'])
-    local_source_path.add_excludes([])
+    # without includes blobxfer uploads every file
+    if transfer_option(context, 'include'):
+        local_source_path.add_includes(list(transfer_option(context, 'include')))
+    local_source_path.add_excludes(list(transfer_option(context, 'exclude') or ()))
     local_source_path.add_paths([context.obj['local_path']])
     return local_source_path
 
@@ -0,0 +1,49 @@
+"""Locked, owner-only JSON files kept in the pybatchai cache directory."""
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+
+DIR_MODE = 0o700
+FILE_MODE = 0o600
+LOCK_SUFFIX = '.lock'
+
+def cache_path(cache_dir, file_name):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, mode=DIR_MODE, exist_ok=True)
+    return os.path.join(cache_dir, file_name)
+
+@contextlib.contextmanager
+def locked(path):
+    """Hold an exclusive lock on path across processes."""
+    lock_fd = os.open(path + LOCK_SUFFIX, os.O_RDWR | os.O_CREAT, FILE_MODE)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+def read(path):
+    """Return the cached dict, or an empty one if missing or unreadable."""
+    try:
+        with open(path) as cache:
+            data = json.load(cache)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def write(path, data):
+    """Atomically replace path with data, readable by the owner only."""
+    temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                          prefix=os.path.basename(path))
+    try:
+        os.fchmod(temp_fd, FILE_MODE)
+        with os.fdopen(temp_fd, 'w') as cache:
+            json.dump(data, cache)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
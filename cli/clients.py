@@ -0,0 +1,102 @@
+"""Azure management clients sharing one pooled, keep-alive HTTP session.
+
+Left to themselves, msrest clients each open their own session per thread
+and close it after every call, so each ARM request of a command pays for a
+new TLS handshake. Every client made here instead sends through the one
+session in context.obj['http_session'], whose connection pool is sized for
+the commands that run operations in parallel and whose adapter retries with
+the msrest retry policy, tuned by --http-retries and --http-backoff.
+"""
+import requests
+from msrest.pipeline import Pipeline
+from msrest.pipeline.requests import (
+    PipelineRequestsHTTPSender,
+    RequestsCredentialsPolicy,
+    RequestsPatchSession
+)
+from msrest.universal_http.requests import (
+    ClientRetryPolicy,
+    RequestsHTTPSender
+)
+from msrestazure.azure_cloud import AZURE_PUBLIC_CLOUD
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.8
+
+def http_session(context):
+    """The session every management client of this command sends through."""
+    if 'http_session' not in context.obj:
+        retry_policy = ClientRetryPolicy()
+        retry_policy.retries = context.obj.get('http_retries', DEFAULT_RETRIES)
+        retry_policy.backoff_factor = context.obj.get('http_backoff',
+                                                      DEFAULT_BACKOFF)
+        pool_size = context.obj.get('http_pool_size', DEFAULT_POOL_SIZE)
+        session = requests.Session()
+        for prefix in ['https://', 'http://']:
+            session.mount(prefix, requests.adapters.HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size,
+                max_retries=retry_policy()))
+        context.obj['http_session'] = session
+    return context.obj['http_session']
+
+def resource_manager_url(context):
+    return context.obj.get('resource_manager_url') or \
+        AZURE_PUBLIC_CLOUD.endpoints.resource_manager
+
+def management_client(context, client_class):
+    """A client_class for the subscription, sending through http_session."""
+    client = client_class(credentials=context.obj['aad_credentials'],
+                          subscription_id=context.obj['subscription_id'],
+                          base_url=resource_manager_url(context))
+    config = client.config
+    config.keep_alive = True
+    config.pipeline = Pipeline(
+        [config.user_agent_policy,
+         RequestsPatchSession(),
+         RequestsCredentialsPolicy(config.credentials),
+         config.http_logger_policy],
+        PipelineRequestsHTTPSender(
+            SharedSessionSender(config, http_session(context))))
+    return client
+
+class SharedSessionSender(RequestsHTTPSender):
+    """msrest sender using one session from every thread, not one per thread."""
+
+    def __init__(self, config, session):
+        super(SharedSessionSender, self).__init__(config)
+        self.shared_session = session
+
+    @property
+    def session(self):
+        return self.shared_session
+
+    @session.setter
+    def session(self, value):
+        self.shared_session = value
+
+    def close(self):
+        # the session outlives any one client
+        pass
+
+def create_batchai_client(context):
+    """Client to create batchai resources."""
+    import azure.mgmt.batchai as training
+
+    if 'batchai_client' not in context.obj:
+        context.obj['batchai_client'] = management_client(
+            context, training.BatchAIManagementClient)
+
+def set_storage_client(context):
+    from azure.mgmt.storage import StorageManagementClient
+
+    if 'storage_client' not in context.obj:
+        context.obj['storage_client'] = management_client(
+            context, StorageManagementClient)
+
+def set_resource_client(context):
+    from azure.mgmt.resource import ResourceManagementClient
+
+    if 'resource_client' not in context.obj:
+        context.obj['resource_client'] = management_client(
+            context, ResourceManagementClient)
@@ -1,25 +1,139 @@
 import logging
 
+from azure.mgmt.batchai.models import (
+    ClusterCreateParameters,
+    ManualScaleSettings,
+    ScaleSettings,
+    UserAccountSettings
+)
 from msrestazure.azure_exceptions import CloudError
 
+import cli.constants
+import cli.lro
+import cli.state
+import cli.trace
 import cli.utils
 
 LOGGER = logging.getLogger(__name__)
 CLUSTER_TYPE = 'cluster'
+WORKSPACE_TYPE = 'workspace'
+NOT_FOUND_STATUS = 404
+PROVISIONING_SUCCEEDED = 'succeeded'
+PROVISIONING_FAILED = 'failed'
 
-def delete_cluster(context):
+@cli.trace.traced
+def create_workspace_if_not_exists(context):
+    workspace = context.obj['workspace']
+    batchai_client = context.obj['batchai_client']
+    if cli.state.exists(context, WORKSPACE_TYPE, workspace,
+                        lambda: fetch_workspace(context)):
+        LOGGER.info(cli.utils.already_exists(WORKSPACE_TYPE, workspace))
+        return
+    batchai_client.workspaces.create(context.obj['resource_group'], workspace,
+                                     context.obj['location'], polling=False)
+    cli.lro.wait(lambda: provisioning_status(
+        WORKSPACE_TYPE, workspace,
+        lambda: batchai_client.workspaces.get(context.obj['resource_group'],
+                                              workspace, raw=True)))
+    cli.state.record(context, WORKSPACE_TYPE, workspace, True)
+    LOGGER.info(cli.utils.created(WORKSPACE_TYPE, workspace))
+
+def fetch_workspace(context):
+    try:
+        return context.obj['batchai_client'].workspaces.get(
+            context.obj['resource_group'],
+            context.obj['workspace'])
+    except CloudError:
+        return None
+
+@cli.trace.traced
+def create_cluster_if_not_exists(context, cluster_spec):
+    """Create a cluster with manual scale settings from a spec entry."""
     cluster_name = context.obj['cluster_name']
+    batchai_client = context.obj['batchai_client']
     if cluster_exists(context):
-        context.obj['batchai_client'].clusters.delete(
+        LOGGER.info(cli.utils.already_exists(CLUSTER_TYPE, cluster_name))
+        return
+    parameters = ClusterCreateParameters(
+        vm_size=cluster_spec['vm_size'],
+        vm_priority=cluster_spec.get('vm_priority', 'dedicated'),
+        scale_settings=ScaleSettings(manual=ManualScaleSettings(
+            target_node_count=cluster_spec.get('target_node_count', 0))),
+        user_account_settings=UserAccountSettings(
+            admin_user_name=cluster_spec['admin_user_name'],
+            admin_user_password=cluster_spec.get('admin_user_password'),
+            admin_user_ssh_public_key=cluster_spec.get(
+                'admin_user_ssh_public_key')))
+    batchai_client.clusters.create(context.obj['resource_group'],
+                                   context.obj['workspace'],
+                                   cluster_name,
+                                   parameters,
+                                   polling=False)
+    cli.lro.wait(lambda: provisioning_status(
+        CLUSTER_TYPE, cluster_name,
+        lambda: batchai_client.clusters.get(context.obj['resource_group'],
+                                            context.obj['workspace'],
+                                            cluster_name, raw=True)))
+    cli.state.record(context, CLUSTER_TYPE, cluster_state_name(context), True)
+    LOGGER.info(cli.utils.created(CLUSTER_TYPE, cluster_name))
+
+def provisioning_status(resource_type, resource_name, get_raw):
+    response = get_raw()
+    provisioning_state = getattr(response.output.provisioning_state, 'value',
+                                 response.output.provisioning_state)
+    if provisioning_state == PROVISIONING_FAILED:
+        raise cli.lro.OperationFailed(cli.utils.create_failed(
+            resource_type, resource_name, provisioning_state))
+    return cli.lro.Status(
+        done=provisioning_state == PROVISIONING_SUCCEEDED,
+        result=response.output,
+        retry_after=cli.lro.retry_after(response.response))
+
+@cli.trace.traced
+def delete_cluster(context, wait=False,
+                   timeout=cli.constants.OPERATION_TIMEOUT):
+    cluster_name = context.obj['cluster_name']
+    if not cluster_exists(context):
+        LOGGER.warning(cli.utils.does_not_exist(CLUSTER_TYPE, cluster_name))
+        return
+    context.obj['batchai_client'].clusters.delete(
+        context.obj['resource_group'],
+        context.obj['workspace'],
+        cluster_name,
+        polling=False)
+    if wait:
+        LOGGER.info('Waiting for %s %s to be deleted...', CLUSTER_TYPE,
+                    cluster_name)
+        cli.lro.wait(lambda: deletion_status(context), timeout=timeout)
+    cli.state.record(context, CLUSTER_TYPE, cluster_state_name(context), False)
+    LOGGER.info(cli.utils.deleted(CLUSTER_TYPE, cluster_name))
+
+def deletion_status(context):
+    try:
+        response = context.obj['batchai_client'].clusters.get(
             context.obj['resource_group'],
             context.obj['workspace'],
-            cluster_name)
-        LOGGER.info(cli.utils.deleted(CLUSTER_TYPE, cluster_name))
+            context.obj['cluster_name'],
+            raw=True)
+    except CloudError as error:
+        if error.status_code != NOT_FOUND_STATUS:
+            raise
+        return cli.lro.Status(done=True, result=None, retry_after=None)
+    return cli.lro.Status(done=False, result=response.output,
+                          retry_after=cli.lro.retry_after(response.response))
 
+@cli.trace.traced
 def show_cluster(context):
-    cluster_details = cluster_exists(context)
+    cluster_details = None
+    # the details are always fetched, so only a cached miss saves a call
+    if cli.state.cached(context, CLUSTER_TYPE,
+                        cluster_state_name(context)) is not False:
+        cluster_details = get_cluster(context)
     if cluster_details:
         print_cluster_status(context, cluster_details)
+    else:
+        LOGGER.warning(cli.utils.does_not_exist(CLUSTER_TYPE,
+                                                context.obj['cluster_name']))
 
 def print_cluster_status(context, cluster):
     """Print the status of your batchai cluster."""
@@ -55,13 +169,23 @@ Leaving:          %d''',
                 LOGGER.error('%s: %s', detail.name, detail.value)
 
 def cluster_exists(context):
-    cluster_name = context.obj['cluster_name']
+    return cli.state.exists(context, CLUSTER_TYPE, cluster_state_name(context),
+                            lambda: fetch_cluster(context))
+
+def get_cluster(context):
+    cluster_details = fetch_cluster(context)
+    cli.state.record(context, CLUSTER_TYPE, cluster_state_name(context),
+                     cluster_details is not None)
+    return cluster_details
+
+def fetch_cluster(context):
     try:
-        cluster_details = context.obj['batchai_client'].clusters.get(
+        return context.obj['batchai_client'].clusters.get(
             context.obj['resource_group'],
             context.obj['workspace'],
-            cluster_name)
-        return cluster_details
+            context.obj['cluster_name'])
     except CloudError:
-        LOGGER.warning(cli.utils.does_not_exist(CLUSTER_TYPE, cluster_name))
-        return False
+        return None
+
+def cluster_state_name(context):
+    return '{}/{}'.format(context.obj['workspace'], context.obj['cluster_name'])
@@ -0,0 +1,123 @@
+"""Status of many clusters at once, for `cluster status`.
+
+Targets are WORKSPACE (every cluster in it) or WORKSPACE/NAME, where NAME may
+be a glob. A workspace asked for by a single exact name costs one get; any
+other workspace costs one list_by_workspace call. Workspaces are fetched
+concurrently over the shared client, so the whole fleet takes about as long
+as its slowest request.
+"""
+import collections
+import concurrent.futures
+import fnmatch
+import json
+
+from msrestazure.azure_exceptions import CloudError
+
+import cli.cluster
+import cli.utils
+
+TABLE = 'table'
+JSON = 'json'
+ALL_CLUSTERS = '*'
+NOT_FOUND = 'not found'
+COLUMNS = ['workspace', 'name', 'allocation_state', 'target', 'current', 'idle',
+           'running', 'preparing', 'leaving', 'unusable', 'errors']
+
+def parse_targets(targets):
+    """Map each workspace to the cluster names or globs asked for in it."""
+    patterns = collections.OrderedDict()
+    for target in targets:
+        workspace, _, name = target.partition('/')
+        patterns.setdefault(workspace, set()).add(name or ALL_CLUSTERS)
+    return patterns
+
+def is_glob(pattern):
+    return any(character in pattern for character in '*?[')
+
+def cluster_status(context, targets, output_format=TABLE, workers=16):
+    """Fetch every targeted cluster and print one table or JSON document."""
+    rows = fetch_rows(context, targets, workers)
+    if output_format == JSON:
+        print(json.dumps({'clusters': rows}, indent=2, sort_keys=True))
+    else:
+        print(format_table(rows))
+    return rows
+
+def fetch_rows(context, targets, workers=16):
+    """Status rows of every targeted cluster, fetched concurrently."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        fetched = list(executor.map(
+            lambda item: fetch_workspace_clusters(context, *item),
+            parse_targets(targets).items()))
+    return [row for workspace_rows in fetched for row in workspace_rows]
+
+def fetch_workspace_clusters(context, workspace, patterns):
+    """Rows for the clusters in workspace matching patterns, in name order."""
+    batchai_client = context.obj['batchai_client']
+    resource_group = context.obj['resource_group']
+    if len(patterns) == 1 and not is_glob(next(iter(patterns))):
+        name = next(iter(patterns))
+        try:
+            clusters = [batchai_client.clusters.get(resource_group, workspace,
+                                                    name)]
+        except CloudError as error:
+            if error.status_code != cli.cluster.NOT_FOUND_STATUS:
+                raise
+            clusters = []
+    else:
+        try:
+            clusters = list(batchai_client.clusters.list_by_workspace(
+                resource_group, workspace))
+        except CloudError as error:
+            if error.status_code != cli.cluster.NOT_FOUND_STATUS:
+                raise
+            clusters = []
+    rows = {}
+    for cluster in clusters:
+        if any(fnmatch.fnmatchcase(cluster.name, pattern) for pattern in patterns):
+            rows[cluster.name] = status_row(workspace, cluster)
+    for pattern in patterns:
+        if not is_glob(pattern) and pattern not in rows:
+            rows[pattern] = missing_row(workspace, pattern)
+    return [rows[name] for name in sorted(rows)]
+
+def status_row(workspace, cluster):
+    counts = cluster.node_state_counts
+    return {
+        'workspace': workspace,
+        'name': cluster.name,
+        'allocation_state': getattr(cluster.allocation_state, 'value',
+                                    cluster.allocation_state),
+        'target': target_node_count(cluster),
+        'current': cluster.current_node_count,
+        'idle': counts.idle_node_count if counts else None,
+        'running': counts.running_node_count if counts else None,
+        'preparing': counts.preparing_node_count if counts else None,
+        'leaving': counts.leaving_node_count if counts else None,
+        'unusable': counts.unusable_node_count if counts else None,
+        'errors': [error.message for error in cluster.errors or []]
+    }
+
+def missing_row(workspace, name):
+    row = dict.fromkeys(COLUMNS)
+    row.update(workspace=workspace, name=name, allocation_state=NOT_FOUND,
+               errors=[])
+    return row
+
+def target_node_count(cluster):
+    scale_settings = cluster.scale_settings
+    if scale_settings is None:
+        return None
+    if scale_settings.manual is not None:
+        return scale_settings.manual.target_node_count
+    return scale_settings.auto_scale.maximum_node_count
+
+def format_table(rows):
+    return cli.utils.format_table(COLUMNS, rows, format_cell)
+
+def format_cell(value):
+    if value is None:
+        return '-'
+    if isinstance(value, list):
+        return str(len(value))
+    return str(value)
@@ -0,0 +1,147 @@
+"""Following one cluster until it reaches a target condition, for `cluster watch`.
+
+One client polls the cluster with If-None-Match set to the last ETag, so an
+unchanged cluster can answer 304 without a body. Polls are fast while nodes
+are being allocated, prepared or removed and back off towards the slow
+interval while the cluster stays the same. Only changed fields are reported:
+as log lines, or as one JSON event per line for machines.
+"""
+import datetime
+import json
+import logging
+import time
+
+from msrestazure.azure_exceptions import CloudError
+
+import cli.cluster
+import cli.cluster_status
+import cli.lro
+import cli.utils
+
+LOGGER = logging.getLogger(__name__)
+TEXT = 'text'
+JSON = 'json'
+FAST_INTERVAL = 2
+SLOW_INTERVAL = 30
+NOT_MODIFIED_STATUS = 304
+WATCHED_FIELDS = ['allocation_state', 'target', 'current', 'idle', 'running',
+                  'preparing', 'leaving', 'unusable']
+RESIZING = 'resizing'
+STEADY = 'steady'
+# conditions --until accepts
+UNTIL_STEADY = 'steady'
+UNTIL_IDLE = 'idle'
+UNTIL_GONE = 'gone'
+UNTIL_CONDITIONS = [UNTIL_STEADY, UNTIL_IDLE, UNTIL_GONE]
+NOT_MODIFIED = object()
+
+def watch(context, until=None, timeout=None, output_format=TEXT, fetch=None,
+          sleep=time.sleep, clock=time.monotonic):
+    """Report cluster changes until `until` holds; False if timeout passed first."""
+    name = cli.cluster.cluster_state_name(context)
+    fetch = fetch or (lambda etag: fetch_cluster(context, etag))
+    deadline = None if timeout is None else clock() + timeout
+    state, etag, unchanged_polls = None, None, 0
+    while True:
+        result, etag, retry_after = fetch(etag)
+        if result is NOT_MODIFIED:
+            unchanged_polls += 1
+        else:
+            current = {} if result is None else snapshot(context, result)
+            if current != state:
+                emit(output_format, name, state, current)
+                unchanged_polls = 0
+            else:
+                unchanged_polls += 1
+            state = current
+        if condition_met(until, state):
+            emit_event(output_format, name, 'condition_met', {'until': until})
+            if output_format == TEXT:
+                LOGGER.info('%s is %s.', name, until)
+            return True
+        interval = next_interval(state, unchanged_polls)
+        if retry_after is not None:
+            interval = max(interval, retry_after)
+        if deadline is not None:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                emit_event(output_format, name, 'timeout', {'until': until})
+                if output_format == TEXT:
+                    LOGGER.warning('%s is not %s after %ds.', name, until, timeout)
+                return False
+            interval = min(interval, remaining)
+        sleep(interval)
+
+def fetch_cluster(context, etag):
+    """(cluster, ETag, Retry-After); NOT_MODIFIED for a 304, None once deleted."""
+    try:
+        response = context.obj['batchai_client'].clusters.get(
+            context.obj['resource_group'],
+            context.obj['workspace'],
+            context.obj['cluster_name'],
+            custom_headers={'If-None-Match': etag} if etag else None,
+            raw=True)
+    except CloudError as error:
+        if error.status_code == NOT_MODIFIED_STATUS:
+            return NOT_MODIFIED, etag, cli.lro.retry_after(error.response)
+        if error.status_code == cli.cluster.NOT_FOUND_STATUS:
+            return None, None, None
+        raise
+    return (response.output, response.response.headers.get('ETag'),
+            cli.lro.retry_after(response.response))
+
+def snapshot(context, cluster):
+    row = cli.cluster_status.status_row(context.obj['workspace'], cluster)
+    return {field: row[field] for field in WATCHED_FIELDS}
+
+def changes(previous, current):
+    """{field: [old, new]} for every watched field that differs."""
+    previous = previous or {}
+    current = current or {}
+    return {field: [previous.get(field), current.get(field)]
+            for field in WATCHED_FIELDS
+            if previous.get(field) != current.get(field)}
+
+def next_interval(state, unchanged_polls):
+    """Poll fast while the cluster is changing, backing off once it settles."""
+    if is_transitioning(state):
+        return FAST_INTERVAL
+    return min(FAST_INTERVAL * 2 ** min(unchanged_polls, 5), SLOW_INTERVAL)
+
+def is_transitioning(state):
+    return bool(state) and (state['allocation_state'] == RESIZING
+                            or bool(state['preparing']) or bool(state['leaving']))
+
+def condition_met(until, state):
+    """Whether state, {} once the cluster is gone, satisfies until."""
+    if until is None or state is None:
+        return False
+    if until == UNTIL_GONE:
+        return state == {}
+    if not state or state['allocation_state'] != STEADY:
+        return False
+    if until == UNTIL_IDLE:
+        return state['idle'] == state['target']
+    return True
+
+def emit(output_format, name, previous, current):
+    if not current:
+        emit_event(output_format, name, 'gone', {})
+        if output_format == TEXT:
+            LOGGER.info(cli.utils.does_not_exist(cli.cluster.CLUSTER_TYPE, name))
+        return
+    delta = changes(previous, current)
+    emit_event(output_format, name, 'changed', {'changes': delta, 'state': current})
+    if output_format == TEXT:
+        LOGGER.info('%s: %s', name, ', '.join(
+            '{} {} -> {}'.format(field, old, new) if previous else
+            '{} {}'.format(field, new)
+            for field, (old, new) in delta.items()))
+
+def emit_event(output_format, name, event, fields):
+    if output_format != JSON:
+        return
+    record = {'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+              'cluster': name, 'event': event}
+    record.update(fields)
+    print(json.dumps(record, sort_keys=True), flush=True)
@@ -0,0 +1,314 @@
+"""Gzip compression of blob uploads, undone transparently on download.
+
+With --compress each file is compressed on its way up when its extension is
+known to compress well, or, for other extensions, when a sample from its
+start shrinks by at least MIN_SAVING. Files that are already compressed or
+that do not shrink are uploaded by blobxfer as they are. A compressed blob
+keeps its name, has Content-Encoding: gzip, so any HTTP client gets the
+original bytes, and records the original size in its metadata. The gzip
+stream is produced while the blob's blocks are sent, so no compressed copy is
+written to disk.
+
+A compressed upload also marks its container with COMPRESSED_METADATA. Blob
+downloads from a marked container list it, or just its --prefix, first: blobs
+with Content-Encoding gzip are each fetched in one streamed GET and
+decompressed into their local file as the bytes arrive, and blobxfer downloads
+the rest as before. Downloads from other containers go straight to blobxfer.
+"""
+import collections
+import concurrent.futures
+import datetime
+import io
+import logging
+import mimetypes
+import os
+import tempfile
+import zlib
+
+import requests
+from azure.storage.blob import BlobPermissions, ContentSettings, Include
+import blobxfer.models.azure as azmodels
+
+import cli.blobxfer_util
+import cli.local_files
+import cli.trace
+import cli.tuning
+import cli.utils
+
+LOGGER = logging.getLogger(__name__)
+GZIP = 'gzip'
+# metadata names must be valid C# identifiers
+SIZE_METADATA = 'pybatchai_size'
+COMPRESSED_METADATA = 'pybatchai_compressed'
+DEFAULT_LEVEL = 1
+SAMPLE_BYTES = 64 * 1024
+# fraction of a sample compression must save for the file to be compressed
+MIN_SAVING = 0.1
+# below this, the gzip header and an extra round trip outweigh any saving
+MIN_COMPRESS_BYTES = 1024
+# files up to this size are compressed in memory and sent in one request
+IN_MEMORY_BYTES = 4 * 1024 * 1024
+READ_BYTES = 1024 * 1024
+SAS_LIFETIME = datetime.timedelta(hours=12)
+PARTIAL_SUFFIX = '.pybatchai-partial'
+COMPRESSIBLE_EXTENSIONS = {
+    '.csv', '.tsv', '.txt', '.log', '.json', '.jsonl', '.ndjson', '.xml',
+    '.html', '.htm', '.md', '.rst', '.yaml', '.yml', '.ini', '.cfg', '.py',
+    '.ipynb', '.sh', '.r', '.c', '.cc', '.cpp', '.h', '.java', '.js', '.ts',
+    '.css', '.sql', '.svg', '.pbtxt'
+}
+COMPRESSED_EXTENSIONS = {
+    '.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.zip', '.7z', '.rar',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.mkv', '.avi',
+    '.mov', '.npz', '.parquet', '.pdf', '.docx', '.xlsx', '.pptx', '.whl',
+    '.jar', '.tfrecord'
+}
+
+def worth_compressing(path, size, level=DEFAULT_LEVEL):
+    """Whether the file at path is likely to shrink noticeably."""
+    if size < MIN_COMPRESS_BYTES:
+        return False
+    extension = os.path.splitext(path)[1].lower()
+    if extension in COMPRESSED_EXTENSIONS:
+        return False
+    if extension in COMPRESSIBLE_EXTENSIONS:
+        return True
+    with open(path, 'rb') as source:
+        sample = source.read(SAMPLE_BYTES)
+    # the fastest level is a good enough predictor, whatever level is used
+    compressed = zlib.compress(sample, min(level, DEFAULT_LEVEL))
+    return len(compressed) <= len(sample) * (1 - MIN_SAVING)
+
+def compressor(level):
+    # wbits 16 + MAX_WBITS writes a gzip header and trailer instead of zlib's
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+class GzipReader(io.RawIOBase):
+    """Read-only stream of the gzip compression of source."""
+
+    def __init__(self, source, level=DEFAULT_LEVEL):
+        super(GzipReader, self).__init__()
+        self.source = source
+        self.compressor = compressor(level)
+        self.pending = b''
+        self.finished = False
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while not self.finished and (size < 0 or len(self.pending) < size):
+            data = self.source.read(READ_BYTES)
+            if data:
+                self.pending += self.compressor.compress(data)
+            else:
+                self.pending += self.compressor.flush()
+                self.finished = True
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        self.size += len(data)
+        return data
+
+def content_settings(name):
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    return ContentSettings(content_type=content_type, content_encoding=GZIP)
+
+def upload_file(service, container, prefix, local_file, level):
+    """Upload local_file compressed below prefix; the size of the blob."""
+    name = cli.blobxfer_util.remote_name(prefix, local_file.relative_path)
+    settings = content_settings(name)
+    metadata = {SIZE_METADATA: str(local_file.size)}
+    with open(local_file.path, 'rb') as source:
+        if local_file.size <= IN_MEMORY_BYTES:
+            data = compressor(level)
+            data = data.compress(source.read()) + data.flush()
+            service.create_blob_from_bytes(container, name, data,
+                                           content_settings=settings,
+                                           metadata=metadata)
+            return len(data)
+        reader = GzipReader(source, level)
+        # blocks are read in order from the compressor, so one connection
+        service.create_blob_from_stream(container, name, reader,
+                                        content_settings=settings,
+                                        metadata=metadata, max_connections=1)
+        return reader.size
+
+@cli.trace.traced
+def start_uploader(context, mode, remote_path):
+    """Upload local_path, compressing what is worth it when --compress is set."""
+    if mode != azmodels.StorageModes.Block or \
+            not cli.blobxfer_util.transfer_option(context, 'compress'):
+        cli.blobxfer_util.start_uploader(context, mode, remote_path)
+        return
+    level = cli.blobxfer_util.transfer_option(context, 'compress_level',
+                                              DEFAULT_LEVEL)
+    local_files = list(cli.blobxfer_util.local_files(context))
+    compressed, plain = [], []
+    for local_file in local_files:
+        if worth_compressing(local_file.path, local_file.size, level):
+            compressed.append(local_file)
+        else:
+            plain.append(local_file)
+    LOGGER.info('Compressing %d of %d files with gzip level %d.',
+                len(compressed), len(local_files), level)
+    if not compressed:
+        cli.blobxfer_util.start_uploader(context, mode, remote_path)
+        return
+    if plain:
+        with tempfile.TemporaryDirectory(prefix='pybatchai-compress-') as staging:
+            cli.local_files.stage(plain, staging)
+            cli.blobxfer_util.start_uploader(
+                cli.utils.child_context(context, local_path=staging),
+                mode, remote_path)
+    service = context.obj['blob_storage_service']
+    container, prefix = cli.blobxfer_util.split_remote_path(remote_path)
+    mark_compressed(service, container)
+    workers = 2 * (cli.blobxfer_util.transfer_option(context, 'cpu_budget')
+                   or cli.tuning.default_cpu_budget())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        sizes = list(executor.map(
+            lambda local_file: upload_file(service, container, prefix,
+                                           local_file, level),
+            compressed))
+    LOGGER.info('Uploaded %.1f MB compressed to %.1f MB.',
+                sum(local_file.size for local_file in compressed) / 1e6,
+                sum(sizes) / 1e6)
+
+def mark_compressed(service, container):
+    """Mark container as holding gzip encoded blobs, before any is uploaded so
+    that a download never misses them.
+    """
+    metadata = service.get_container_metadata(container)
+    if COMPRESSED_METADATA not in metadata:
+        metadata[COMPRESSED_METADATA] = 'true'
+        service.set_container_metadata(container, metadata)
+
+def has_compressed(service, container):
+    return COMPRESSED_METADATA in service.get_container_metadata(container)
+
+RemoteBlob = collections.namedtuple('RemoteBlob',
+                                    ['name', 'size', 'last_modified'])
+
+def list_compressed(service, container, prefix='', includes=None, excludes=None):
+    """Names relative to prefix of the blobs below it that includes and
+    excludes select, and the gzip encoded ones among them.
+    """
+    names, compressed = set(), []
+    for blob in service.list_blobs(container,
+                                   prefix=cli.blobxfer_util.list_prefix(prefix),
+                                   include=Include.METADATA):
+        name = cli.blobxfer_util.relative_name(prefix, blob.name)
+        if not cli.local_files.selected(name, includes, excludes):
+            continue
+        names.add(name)
+        if blob.properties.content_settings.content_encoding == GZIP:
+            size = (blob.metadata or {}).get(SIZE_METADATA)
+            compressed.append(RemoteBlob(
+                name, None if size is None else int(size),
+                blob.properties.last_modified.timestamp()))
+    return names, compressed
+
+@cli.trace.traced
+def start_downloader(context, mode, remote_path):
+    """Download remote_path, decompressing gzip encoded blobs on the way."""
+    if mode != azmodels.StorageModes.Block:
+        cli.blobxfer_util.start_downloader(context, mode, remote_path)
+        return
+    service = context.obj['blob_storage_service']
+    container, prefix = cli.blobxfer_util.split_remote_path(remote_path)
+    # one metadata request spares a listing of containers never compressed into
+    if not has_compressed(service, container):
+        cli.blobxfer_util.start_downloader(context, mode, remote_path)
+        return
+    names, compressed = list_compressed(
+        service, container, prefix,
+        cli.blobxfer_util.transfer_option(context, 'include'),
+        cli.blobxfer_util.transfer_option(context, 'exclude'))
+    if not compressed:
+        cli.blobxfer_util.start_downloader(context, mode, remote_path)
+        return
+    local_path = context.obj['local_path']
+    sync = cli.blobxfer_util.transfer_option(context, 'sync', False)
+    if len(compressed) < len(names):
+        cli.blobxfer_util.start_downloader(
+            context, mode, remote_path,
+            excluded={cli.blobxfer_util.remote_name(prefix, blob.name)
+                      for blob in compressed})
+    if sync:
+        compressed = [blob for blob in compressed
+                      if not up_to_date(local_path, blob)]
+    LOGGER.info('Decompressing %d gzip encoded blobs.', len(compressed))
+    session = requests.Session()
+    workers = 2 * (cli.blobxfer_util.transfer_option(context, 'cpu_budget')
+                   or cli.tuning.default_cpu_budget())
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(
+                lambda blob: download_file(
+                    session, service, container,
+                    cli.blobxfer_util.remote_name(prefix, blob.name), local_path,
+                    blob.name),
+                compressed))
+    finally:
+        session.close()
+    if sync and cli.blobxfer_util.transfer_option(context, 'delete', False):
+        delete_extraneous(local_path, names)
+
+def up_to_date(local_path, blob):
+    """Whether a --sync download can skip blob, as blobxfer would."""
+    try:
+        stat = os.stat(local_target(local_path, blob.name))
+    except FileNotFoundError:
+        return False
+    return stat.st_size == blob.size and stat.st_mtime >= blob.last_modified
+
+def local_target(local_path, name):
+    """Local path of a blob, refusing names that leave local_path."""
+    parts = name.split('/')
+    if name.startswith('/') or '..' in parts:
+        raise ValueError('Refusing to download {}.'.format(name))
+    return os.path.join(local_path, *parts)
+
+def blob_url(service, container, name):
+    token = service.generate_blob_shared_access_signature(
+        container, name, permission=BlobPermissions.READ,
+        expiry=datetime.datetime.utcnow() + SAS_LIFETIME)
+    return service.make_blob_url(container, name, sas_token=token)
+
+def download_file(session, service, container, name, local_path,
+                  relative_path=None):
+    """Stream one gzip encoded blob into its local file, decompressing it.
+    The file is local_path/relative_path, or local_path/name without it.
+    """
+    target = local_target(local_path, relative_path or name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = target + PARTIAL_SUFFIX
+    with session.get(blob_url(service, container, name), stream=True) as response:
+        response.raise_for_status()
+        decompressing = decompressor()
+        try:
+            with open(partial, 'wb') as local_file:
+                # the raw bytes, as requests would otherwise decode gzip itself
+                for chunk in response.raw.stream(READ_BYTES, decode_content=False):
+                    local_file.write(decompressing.decompress(chunk))
+                local_file.write(decompressing.flush())
+            if not decompressing.eof:
+                raise ValueError('{} ended before its gzip stream.'.format(name))
+            os.replace(partial, target)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+def delete_extraneous(local_path, names):
+    """Delete local files that no longer exist in the container."""
+    deleted = 0
+    for local_file in cli.local_files.scan(local_path):
+        if local_file.relative_path not in names:
+            os.remove(local_file.path)
+            deleted += 1
+    LOGGER.info('Deleted %d local files missing remotely.', deleted)
@@ -1,3 +1,9 @@
+import os
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.pybatchai')
+# seconds to wait for a long-running operation before giving up
+OPERATION_TIMEOUT = 30 * 60
+
 AVAILABLE_REGIONS = [
     'eastus',
     'eastus2',
@@ -0,0 +1,242 @@
+"""Resident process serving pybatchai commands over a Unix socket, for
+`pybatchai daemon`.
+
+The daemon runs the same click commands as the pybatchai script, with the
+arguments pybatchai-client forwards, one command at a time. Everything a
+command would otherwise rebuild stays warm between commands run with the same
+global options: the SDK imports, AAD credentials, the resource group check,
+the management clients and their pooled connections, and resolved storage
+account keys. The output of each command, from print, click and logging
+alike, is relayed to the client that sent it as cli.daemon_client frames.
+
+The socket is created owner-only in the cache directory, so only the user
+who started the daemon can send it commands.
+"""
+import contextlib
+import io
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+import traceback
+
+import click
+
+import cli.daemon_client
+from cli.daemon_client import EXIT, FRAME, STDERR, STDOUT
+
+LOGGER = logging.getLogger(__name__)
+# objects a command may create that later commands reuse
+WARM_KEYS = ['resource_client', 'storage_client', 'batchai_client',
+             'http_session', 'storage_account_keys']
+SOCKET_UMASK = 0o177
+
+class WarmObjects:
+    """context.obj of every set of global options the daemon has run with."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def lookup(self, settings):
+        """A copy of the warm context.obj for settings, or None."""
+        obj = self.objects.get(settings_key(settings))
+        return None if obj is None else dict(obj)
+
+    def keep(self, obj):
+        """Keep obj, made by a full start, and return a copy for the command."""
+        self.objects[settings_key(obj['settings'])] = dict(obj, in_daemon=True)
+        return self.lookup(obj['settings'])
+
+    def absorb(self, obj):
+        """Keep the clients and caches a command made for later commands."""
+        if not obj or 'settings' not in obj:
+            return
+        warm = self.objects.get(settings_key(obj['settings']))
+        if warm is None:
+            return
+        for key in WARM_KEYS:
+            if key in obj:
+                warm[key] = obj[key]
+
+def settings_key(settings):
+    return json.dumps(settings, sort_keys=True)
+
+class Output:
+    """The connection of the running command, shared by both relays."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def send(self, channel, data):
+        """Send a frame; False once there is no client to send it to."""
+        with self.lock:
+            if self.connection is None:
+                return False
+            try:
+                self.connection.sendall(FRAME.pack(channel, len(data)) + data)
+            except OSError:
+                # the client went away; the command finishes without it
+                self.connection = None
+            return True
+
+class Relay(io.TextIOBase):
+    """Text stream writing to the client of the running command, if any."""
+
+    def __init__(self, output, channel, fallback):
+        super(Relay, self).__init__()
+        self.output = output
+        self.channel = channel
+        self.fallback = fallback
+        self.buffer = RelayBuffer(self)
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def write(self, text):
+        self.write_bytes(text.encode())
+        return len(text)
+
+    def write_bytes(self, data):
+        if data and not self.output.send(self.channel, data):
+            self.fallback.buffer.write(data)
+            self.fallback.flush()
+
+    def isatty(self):
+        return False
+
+class RelayBuffer(io.RawIOBase):
+    def __init__(self, relay):
+        super(RelayBuffer, self).__init__()
+        self.relay = relay
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.relay.write_bytes(bytes(data))
+        return len(data)
+
+@contextlib.contextmanager
+def relayed_output(output):
+    """Route stdout, stderr and log handlers writing to them through output."""
+    streams = sys.stdout, sys.stderr
+    sys.stdout = Relay(output, STDOUT, streams[0])
+    sys.stderr = Relay(output, STDERR, streams[1])
+    handlers = [handler for handler in logging.getLogger().handlers
+                if getattr(handler, 'stream', None) in streams]
+    for handler in handlers:
+        handler.setStream(sys.stdout if handler.stream is streams[0] else sys.stderr)
+    try:
+        yield
+    finally:
+        for handler in handlers:
+            handler.setStream(streams[0] if handler.stream is sys.stdout
+                              else streams[1])
+        sys.stdout, sys.stderr = streams
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode())
+            argv, cwd = request['argv'], request['cwd']
+        except (ValueError, KeyError, TypeError) as error:
+            # not from pybatchai-client; answer it without running anything
+            message = 'Malformed pybatchai daemon request: {}\n'.format(error)
+            LOGGER.warning(message.strip())
+            try:
+                self.connection.sendall(
+                    FRAME.pack(STDERR, len(message.encode())) + message.encode()
+                    + FRAME.pack(EXIT, 1) + b'2')
+            except OSError:
+                pass
+            return
+        output = self.server.output
+        with output.lock:
+            output.connection = self.connection
+        try:
+            code = self.server.run_command(argv, cwd)
+            output.send(EXIT, str(code).encode())
+        finally:
+            with output.lock:
+                output.connection = None
+
+class DaemonServer(socketserver.UnixStreamServer):
+    """Serves one command at a time, so output relaying stays per command."""
+
+    def __init__(self, path, command, warm, idle_timeout=None):
+        self.command = command
+        self.warm = warm
+        self.output = Output()
+        self.timeout = idle_timeout
+        self.idle = False
+        old_umask = os.umask(SOCKET_UMASK)
+        try:
+            super(DaemonServer, self).__init__(path, CommandHandler)
+        finally:
+            os.umask(old_umask)
+
+    def handle_timeout(self):
+        self.idle = True
+
+    def run_command(self, argv, cwd):
+        os.chdir(cwd)
+        return invoke(self.command, argv, self.warm)
+
+def invoke(command, argv, warm):
+    """Run the click command with argv as pybatchai would; its exit code."""
+    try:
+        with command.make_context('pybatchai', list(argv), obj=warm) as context:
+            try:
+                command.invoke(context)
+            finally:
+                warm.absorb(context.obj if context.obj is not warm else None)
+        return 0
+    except click.ClickException as error:
+        error.show()
+        return error.exit_code
+    except click.exceptions.Exit as error:
+        return error.exit_code
+    except click.Abort:
+        click.echo('Aborted!', err=True)
+        return 1
+    except SystemExit as error:
+        return error.code if isinstance(error.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+def serve(context, command, path, idle_timeout=None):
+    """Serve command on path until interrupted or idle_timeout passes."""
+    remove_stale_socket(path)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    warm = WarmObjects()
+    warm.keep(context.obj)
+    server = DaemonServer(path, command, warm, idle_timeout)
+    LOGGER.info('Serving pybatchai commands on %s.', path)
+    try:
+        with relayed_output(server.output):
+            while not server.idle:
+                server.handle_request()
+        LOGGER.info('No commands for %ds, stopping.', idle_timeout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    try:
+        cli.daemon_client.connect(path).close()
+    except ConnectionRefusedError:
+        os.remove(path)
+        return
+    except OSError as error:
+        raise click.UsageError('Cannot use the daemon socket {}: {}'.format(
+            path, error))
+    raise click.UsageError('A pybatchai daemon is already serving {}.'.format(path))
@@ -0,0 +1,74 @@
+"""Thin client of `pybatchai daemon`, installed as pybatchai-client.
+
+It forwards its arguments and working directory over the daemon's Unix socket
+and copies the output frames the daemon sends back to stdout and stderr, then
+exits with the command's exit code. Only the standard library is imported, so
+a command costs an interpreter start plus one round trip to the daemon. When
+no daemon is listening, the command runs in this process instead.
+
+Each frame is a channel byte, a big-endian payload length and the payload:
+'o' for stdout, 'e' for stderr and 'x' for the exit code, which ends the
+response.
+"""
+import json
+import os
+import socket
+import struct
+import sys
+
+import cli.constants
+
+SOCKET_ENV = 'PYBATCHAI_SOCKET'
+SOCKET_FILE = 'daemon.sock'
+FRAME = struct.Struct('>cI')
+STDOUT = b'o'
+STDERR = b'e'
+EXIT = b'x'
+
+def socket_path():
+    return os.environ.get(SOCKET_ENV) or os.path.join(cli.constants.CACHE_DIR,
+                                                      SOCKET_FILE)
+
+def read_exactly(connection, size):
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('pybatchai daemon closed the connection.')
+        data += chunk
+    return data
+
+def connect(path=None):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path or socket_path())
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+def run(connection, argv, stdout=None, stderr=None):
+    """Run argv in the daemon connected to and return its exit code."""
+    stdout = stdout or sys.stdout.buffer
+    stderr = stderr or sys.stderr.buffer
+    with connection:
+        connection.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode()
+                           + b'\n')
+        while True:
+            channel, size = FRAME.unpack(read_exactly(connection, FRAME.size))
+            payload = read_exactly(connection, size)
+            if channel == EXIT:
+                return int(payload)
+            stream = stdout if channel == STDOUT else stderr
+            stream.write(payload)
+            stream.flush()
+
+def main():
+    argv = sys.argv[1:]
+    try:
+        connection = connect()
+    except (FileNotFoundError, ConnectionRefusedError):
+        import pybatchai
+        pybatchai.main(args=argv, prog_name='pybatchai')
+        return
+    sys.exit(run(connection, argv))
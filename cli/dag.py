@@ -0,0 +1,116 @@
+"""Run interdependent actions concurrently as a dependency graph."""
+import collections
+import concurrent.futures
+import logging
+import time
+
+import cli.trace
+
+LOGGER = logging.getLogger(__name__)
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+# trace category of the span of each node
+STEP = 'step'
+
+Node = collections.namedtuple('Node', ['name', 'action', 'depends_on'])
+Timing = collections.namedtuple('Timing', ['status', 'start', 'end', 'result'])
+
+class CycleError(Exception):
+    pass
+
+def node(name, action, depends_on=()):
+    return Node(name, action, tuple(depends_on))
+
+def run(nodes, max_workers=8, clock=time.monotonic):
+    """Run every node once all of its dependencies have succeeded.
+
+    Nodes whose dependencies failed or were skipped are skipped. Returns a
+    Timing per node name, with start and end in seconds since the run began.
+    """
+    nodes = {graph_node.name: graph_node for graph_node in nodes}
+    check_graph(nodes)
+    timings = {}
+    started = clock()
+    running = {}
+
+    def start_ready(executor):
+        for name, graph_node in nodes.items():
+            if name in timings or name in running.values():
+                continue
+            dependencies = [timings.get(dep) for dep in graph_node.depends_on]
+            if any(timing is not None and timing.status != SUCCEEDED
+                   for timing in dependencies):
+                now = clock() - started
+                timings[name] = Timing(SKIPPED, now, now, None)
+                LOGGER.warning('Skipping %s, a dependency did not succeed.', name)
+            elif all(timing is not None for timing in dependencies):
+                running[executor.submit(timed, name, graph_node.action, clock,
+                                        started)] = name
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        start_ready(executor)
+        while running:
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                timings[running.pop(future)] = future.result()
+            start_ready(executor)
+        # skipping a node can make its own dependents skippable
+        while len(timings) < len(nodes):
+            start_ready(executor)
+    return timings
+
+def timed(name, action, clock, started):
+    start = clock() - started
+    try:
+        with cli.trace.span(name, STEP):
+            result = action()
+    except Exception as error:  # pylint: disable=broad-except
+        LOGGER.error('%s', error)
+        return Timing(FAILED, start, clock() - started, error)
+    return Timing(SUCCEEDED, start, clock() - started, result)
+
+def check_graph(nodes):
+    for graph_node in nodes.values():
+        for dependency in graph_node.depends_on:
+            if dependency not in nodes:
+                raise KeyError('{} depends on unknown {}'.format(graph_node.name,
+                                                                dependency))
+    visiting, visited = set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise CycleError('dependency cycle through {}'.format(name))
+        visiting.add(name)
+        for dependency in nodes[name].depends_on:
+            visit(dependency)
+        visiting.discard(name)
+        visited.add(name)
+
+    for name in nodes:
+        visit(name)
+
+def critical_path(nodes, timings):
+    """The chain of nodes that determined when the run finished."""
+    nodes = {graph_node.name: graph_node for graph_node in nodes}
+    if not timings:
+        return []
+    name = max(timings, key=lambda key: timings[key].end)
+    path = [name]
+    while nodes[name].depends_on:
+        name = max(nodes[name].depends_on, key=lambda key: timings[key].end)
+        path.append(name)
+    return list(reversed(path))
+
+def log_report(nodes, timings):
+    LOGGER.info('%-40s %-10s %9s %9s', 'step', 'status', 'start', 'duration')
+    for name, timing in sorted(timings.items(), key=lambda item: item[1].start):
+        LOGGER.info('%-40s %-10s %8.1fs %8.1fs', name, timing.status,
+                    timing.start, timing.end - timing.start)
+    path = critical_path(nodes, timings)
+    if path:
+        LOGGER.info('critical path (%.1fs): %s', timings[path[-1]].end,
+                    ' -> '.join(path))
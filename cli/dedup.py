@@ -0,0 +1,139 @@
+"""Content-addressed uploads, storing each distinct file once.
+
+With --dedup, files are hashed in parallel and each distinct content is stored
+once under its SHA-256 digest, at the root of the container or share so that
+every upload to it shares the same objects. Each upload then writes an index
+below its --prefix mapping relative paths to digests:
+
+    pybatchai-cas/sha256/<digest>
+    <prefix>/pybatchai-cas-index.json
+
+Digests already stored are not sent again. A download reads the index and
+fetches each digest once, checking it as it arrives, then copies it to the
+other paths with the same content.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import cli.blobxfer_util
+import cli.local_files
+import cli.pack
+import cli.trace
+
+LOGGER = logging.getLogger(__name__)
+OBJECT_NAME = 'pybatchai-cas/sha256/{}'
+INDEX_NAME = 'pybatchai-cas-index.json'
+INDEX_VERSION = 1
+TRANSFER_WORKERS = 8
+READ_BYTES = 1024 * 1024
+PARTIAL_SUFFIX = '.pybatchai-partial'
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as local_file:
+        # hashlib releases the GIL on large buffers, so threads hash in parallel
+        for data in iter(lambda: local_file.read(READ_BYTES), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+def index_name(prefix):
+    return cli.blobxfer_util.remote_name(prefix, INDEX_NAME)
+
+@cli.trace.traced
+def upload(remote, local_files, prefix, hash_workers, workers=TRANSFER_WORKERS):
+    """Store the distinct contents of local_files on remote and write the index
+    of this upload below prefix; the index.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=hash_workers) as executor:
+        digests = list(executor.map(lambda local_file: file_digest(local_file.path),
+                                    local_files))
+    distinct = {}
+    for local_file, digest in zip(local_files, digests):
+        distinct.setdefault(digest, local_file)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        stored = list(executor.map(
+            lambda digest: remote.exists(OBJECT_NAME.format(digest)), distinct))
+        missing = [digest for digest, present in zip(distinct, stored)
+                   if not present]
+        list(executor.map(
+            lambda digest: remote.put_file(OBJECT_NAME.format(digest),
+                                           distinct[digest].path),
+            missing))
+    index = {'version': INDEX_VERSION,
+             'files': {local_file.relative_path: [digest, local_file.size,
+                                                  local_file.mtime]
+                       for local_file, digest in zip(local_files, digests)}}
+    # the index goes last, so it only names digests that are stored
+    remote.put(index_name(prefix), json.dumps(index).encode())
+    LOGGER.info('%d files, %d distinct, %d already stored; sent %d (%.1f MB).',
+                len(local_files), len(distinct), len(distinct) - len(missing),
+                len(missing),
+                sum(distinct[digest].size for digest in missing) / 1e6)
+    return index
+
+def load_index(remote, prefix):
+    index = json.loads(remote.get(index_name(prefix)).decode())
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError('Unsupported dedup index version {}.'.format(
+            index.get('version')))
+    return index
+
+class DigestWriter:
+    """Write-only stream hashing what passes through it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.stream.write(data)
+
+@cli.trace.traced
+def download(remote, local_path, prefix, includes=None, excludes=None,
+             workers=TRANSFER_WORKERS):
+    """Rebuild the tree indexed below prefix in local_path, fetching each
+    digest once.
+    """
+    index = load_index(remote, prefix)
+    paths = collections.defaultdict(list)
+    for relative_path, (digest, _, _) in sorted(index['files'].items()):
+        if cli.local_files.selected(relative_path, includes, excludes):
+            paths[digest].append(relative_path)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(
+            lambda digest: fetch(remote, local_path, digest, paths[digest]),
+            paths))
+    for relative_paths in paths.values():
+        for relative_path in relative_paths:
+            cli.pack.set_mtime(local_path, relative_path,
+                               index['files'][relative_path][2])
+    LOGGER.info('Rebuilt %d files from %d distinct contents.',
+                sum(len(relative_paths) for relative_paths in paths.values()),
+                len(paths))
+
+def fetch(remote, local_path, digest, relative_paths):
+    """Download digest to the first of relative_paths and copy it to the rest."""
+    first = cli.pack.target_path(local_path, relative_paths[0])
+    os.makedirs(os.path.dirname(first), exist_ok=True)
+    partial = first + PARTIAL_SUFFIX
+    try:
+        with open(partial, 'wb') as local_file:
+            writer = DigestWriter(local_file)
+            remote.get_to_stream(OBJECT_NAME.format(digest), writer)
+        if writer.digest.hexdigest() != digest:
+            raise ValueError('Content of {} does not match its digest.'.format(
+                OBJECT_NAME.format(digest)))
+        os.replace(partial, first)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    for relative_path in relative_paths[1:]:
+        with open(first, 'rb') as source, \
+                cli.pack.open_target(local_path, relative_path) as target:
+            shutil.copyfileobj(source, target, READ_BYTES)
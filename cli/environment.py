@@ -0,0 +1,116 @@
+"""Provision a whole environment from a spec, creating independent resources
+concurrently.
+
+A spec lists storage accounts with their fileshares and containers, and
+clusters with their workspaces:
+
+    storage_accounts:
+      - name: mystorage
+        fileshares: [scripts]
+        containers: [data]
+    clusters:
+      - name: gpu
+        workspace: research
+        vm_size: STANDARD_NC6
+        target_node_count: 2
+        admin_user_name: batchai
+        admin_user_ssh_public_key: ssh-rsa AAAA...
+
+The resource group already exists by the time the graph runs, so every
+storage account and workspace starts at once; fileshares and containers wait
+for their account, clusters for their workspace.
+"""
+import functools
+
+import cli.blob_storage
+import cli.clients
+import cli.cluster
+import cli.dag
+import cli.fileshare
+import cli.storage
+import cli.utils
+import cli.validation
+
+def up(context, spec, max_workers):
+    """Provision everything in spec and return the per-step timings."""
+    nodes = plan(context, spec)
+    timings = cli.dag.run(nodes, max_workers=max_workers)
+    cli.dag.log_report(nodes, timings)
+    return timings
+
+def plan(context, spec):
+    validate_spec(spec)
+    cli.clients.set_storage_client(context)
+    nodes = []
+    for account in spec.get('storage_accounts', []):
+        account_context = cli.utils.child_context(
+            context, storage_account=account['name'])
+        account_step = step_name(cli.storage.STORAGE_ACCOUNT_TYPE,
+                                 account['name'])
+        nodes.append(cli.dag.node(
+            account_step,
+            functools.partial(provision_storage_account, account_context)))
+        for fileshare in account.get('fileshares', []):
+            nodes.append(cli.dag.node(
+                step_name(cli.fileshare.FILESHARE_TYPE, account['name'], fileshare),
+                functools.partial(provision_fileshare, account_context, fileshare),
+                depends_on=[account_step]))
+        for container in account.get('containers', []):
+            nodes.append(cli.dag.node(
+                step_name(cli.blob_storage.CONTAINER_TYPE, account['name'],
+                          container),
+                functools.partial(provision_container, account_context, container),
+                depends_on=[account_step]))
+
+    workspaces = set(spec.get('workspaces', []))
+    workspaces.update(cluster['workspace'] for cluster in spec.get('clusters', []))
+    for workspace in sorted(workspaces):
+        nodes.append(cli.dag.node(
+            step_name(cli.cluster.WORKSPACE_TYPE, workspace),
+            functools.partial(cli.cluster.create_workspace_if_not_exists,
+                              cli.utils.child_context(context,
+                                                      workspace=workspace))))
+    for cluster in spec.get('clusters', []):
+        cluster_context = cli.utils.child_context(
+            context, workspace=cluster['workspace'], cluster_name=cluster['name'])
+        nodes.append(cli.dag.node(
+            step_name(cli.cluster.CLUSTER_TYPE, cluster['workspace'],
+                      cluster['name']),
+            functools.partial(cli.cluster.create_cluster_if_not_exists,
+                              cluster_context, cluster),
+            depends_on=[step_name(cli.cluster.WORKSPACE_TYPE,
+                                  cluster['workspace'])]))
+    return nodes
+
+def provision_storage_account(context):
+    if not cli.storage.create_acct_if_not_exists(context):
+        raise RuntimeError(cli.utils.create_failed(
+            cli.storage.STORAGE_ACCOUNT_TYPE, context.obj['storage_account'],
+            'the name is not available'))
+    cli.storage.set_storage_account_key(context)
+
+def provision_fileshare(account_context, fileshare):
+    context = cli.utils.child_context(account_context, fileshare=fileshare)
+    cli.fileshare.set_fileshare_service(context)
+    cli.fileshare.create_fileshare_if_not_exists(context)
+
+def provision_container(account_context, container):
+    context = cli.utils.child_context(account_context, container_name=container)
+    cli.blob_storage.set_blob_storage_service(context)
+    cli.blob_storage.create_container_if_not_exists(context)
+
+def step_name(resource_type, *names):
+    return '{} {}'.format(resource_type, '/'.join(names))
+
+def validate_spec(spec):
+    for account in spec.get('storage_accounts', []):
+        cli.validation.validate_storage_name(None, None, account['name'])
+        for fileshare in account.get('fileshares', []):
+            cli.validation.validate_fileshare_name(None, None, fileshare)
+        for container in account.get('containers', []):
+            cli.validation.validate_container_name(None, None, container)
+    for workspace in spec.get('workspaces', []):
+        cli.validation.validate_workspace_name(None, None, workspace)
+    for cluster in spec.get('clusters', []):
+        cli.validation.validate_cluster_name(None, None, cluster['name'])
+        cli.validation.validate_workspace_name(None, None, cluster['workspace'])
@@ -0,0 +1,250 @@
+"""One upload to several containers and fileshares, possibly in different
+storage accounts.
+
+Each destination gets its account key and its container or share once, then
+everything runs on one event loop, as with --engine async: every local chunk
+is read from disk once and sent to all destinations at the same time, each
+over its own cli.async_http.ConnectionPool. A destination that fails is left
+out of the rest of the upload while the others carry on, as is one that
+stalls for STEP_TIMEOUT, and progress is logged per destination.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import time
+
+import blobxfer.models.azure as azmodels
+
+import cli.async_http
+import cli.async_transfer
+import cli.blob_storage
+import cli.blobxfer_util
+import cli.clients
+import cli.fileshare
+import cli.storage
+import cli.trace
+import cli.tuning
+import cli.utils
+
+LOGGER = logging.getLogger(__name__)
+# a valid range for file shares and block for blob containers alike
+CHUNK_BYTES = cli.tuning.MAX_FILE_RANGE_BYTES
+PROGRESS_INTERVAL = 10
+PREPARE_WORKERS = 8
+# seconds one destination may take to start a file, take a chunk or finish a
+# file before it is left out, so that it cannot hold up the others
+STEP_TIMEOUT = 300
+
+class Destination:
+    """A container or share, the prefix inside it, and how its upload went."""
+
+    def __init__(self, mode, storage_account, remote_path):
+        self.mode = mode
+        self.storage_account = storage_account
+        self.remote_path = remote_path
+        self.service = None
+        self.transfer = None
+        self.error = None
+        self.files = 0
+        self.bytes = 0
+
+    def __str__(self):
+        kind = 'fileshare' if self.mode == azmodels.StorageModes.File else 'blob'
+        return '{} {}/{}'.format(kind, self.storage_account, self.remote_path)
+
+    def failed(self, error):
+        if self.error is None:
+            self.error = error
+            LOGGER.error('Upload to %s failed, continuing without it: %s',
+                         self, error)
+
+def destination(mode, value):
+    """Destination of an ACCOUNT/NAME[/PREFIX] value."""
+    storage_account, _, remote_path = value.partition('/')
+    return Destination(mode, storage_account, remote_path)
+
+@cli.trace.traced
+def upload(context, destinations, connections):
+    """Upload the selected files under local_path to every destination; the
+    destinations that failed.
+    """
+    local_files = list(cli.blobxfer_util.local_files(context))
+    cli.clients.set_storage_client(context)
+    context.obj.setdefault('storage_account_keys', {})
+    by_account = collections.defaultdict(list)
+    for target in destinations:
+        by_account[target.storage_account].append(target)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(PREPARE_WORKERS, len(by_account))) as executor:
+        list(executor.map(lambda targets: prepare(context, targets),
+                          by_account.values()))
+    ready = [target for target in destinations if target.error is None]
+    LOGGER.info('Uploading %d files (%.1f MB) to %d destinations.',
+                len(local_files),
+                sum(local_file.size for local_file in local_files) / 1e6,
+                len(ready))
+    if ready:
+        cli.async_http.run(upload_files(ready, connections, CHUNK_BYTES,
+                                        local_files))
+    for target in destinations:
+        if target.error is None and target.mode == azmodels.StorageModes.Block:
+            # as blobstorage upload does
+            try:
+                cli.blob_storage.set_container_public_access(
+                    target_context(context, target))
+            except Exception as error:
+                target.failed(error)
+        if target.error is None:
+            LOGGER.info('%s: uploaded %d files, %.1f MB.', target, target.files,
+                        target.bytes / 1e6)
+        else:
+            LOGGER.error('%s: failed: %s', target, target.error)
+    return [target for target in destinations if target.error is not None]
+
+def target_context(context, target):
+    name = cli.blobxfer_util.split_remote_path(target.remote_path)[0]
+    values = ({'fileshare': name, 'fileshare_service': target.service}
+              if target.mode == azmodels.StorageModes.File
+              else {'container_name': name, 'blob_storage_service': target.service})
+    return cli.utils.child_context(context, storage_account=target.storage_account,
+                                   **values)
+
+def prepare(context, targets):
+    """Resolve the key of the account of targets, then create their containers
+    and shares; the account is created as the storage command would.
+    """
+    account_context = cli.utils.child_context(
+        context, storage_account=targets[0].storage_account)
+    try:
+        if not cli.storage.create_acct_if_not_exists(account_context):
+            raise RuntimeError('storage account {} is not available.'.format(
+                targets[0].storage_account))
+        cli.storage.set_storage_account_key(account_context)
+    except Exception as error:
+        for target in targets:
+            target.failed(error)
+        return
+    for target in targets:
+        resource_context = target_context(account_context, target)
+        try:
+            if target.mode == azmodels.StorageModes.File:
+                cli.fileshare.set_fileshare_service(resource_context)
+                cli.fileshare.create_fileshare_if_not_exists(resource_context)
+                target.service = resource_context.obj['fileshare_service']
+            else:
+                cli.blob_storage.set_blob_storage_service(resource_context)
+                cli.blob_storage.create_container_if_not_exists(resource_context)
+                target.service = resource_context.obj['blob_storage_service']
+        except Exception as error:
+            target.failed(error)
+
+async def upload_files(destinations, connections, chunk_bytes, local_files):
+    for target in destinations:
+        target.transfer = cli.async_transfer.Transfer(
+            cli.async_transfer.Endpoint(target.mode, target.service,
+                                        target.remote_path),
+            connections, chunk_bytes)
+    # chunks in memory, each shared by every destination
+    buffers = asyncio.Semaphore(cli.async_transfer.BUFFERS_PER_CONNECTION
+                                * connections)
+    files = asyncio.Semaphore(cli.async_transfer.FILES_IN_FLIGHT)
+    reporter = asyncio.ensure_future(report_progress(destinations, local_files))
+    try:
+        await asyncio.gather(*[
+            upload_file(destinations, local_file, buffers, files)
+            for local_file in local_files])
+    finally:
+        reporter.cancel()
+        for target in destinations:
+            target.transfer.pool.close()
+
+async def report_progress(destinations, local_files):
+    total_bytes = sum(local_file.size for local_file in local_files)
+    started = time.monotonic()
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        for target in destinations:
+            if target.error is None:
+                LOGGER.info('%s: %d of %d files, %.1f of %.1f MB, %.1f MB/s.',
+                            target, target.files, len(local_files),
+                            target.bytes / 1e6, total_bytes / 1e6,
+                            target.bytes / 1e6 / (time.monotonic() - started))
+
+async def attempt(target, step, *args):
+    """Run step for target unless target has already failed."""
+    if target.error is not None:
+        return
+    try:
+        await asyncio.wait_for(step(target, *args), STEP_TIMEOUT)
+    except asyncio.TimeoutError:
+        target.failed(cli.async_http.TimedOut('{} took over {} seconds.'.format(
+            step.__name__, STEP_TIMEOUT)))
+    except Exception as error:
+        target.failed(error)
+
+async def upload_file(destinations, local_file, buffers, files):
+    chunk_bytes = destinations[0].transfer.chunk_bytes
+    # an empty file still takes one empty chunk, sent as an empty blob
+    chunks = max(1, -(-local_file.size // chunk_bytes))
+    async with files:
+        await asyncio.gather(*[attempt(target, begin_file, local_file)
+                               for target in destinations])
+        await asyncio.gather(*[
+            send_chunk(destinations, local_file, number, buffers)
+            for number in range(chunks)])
+        await asyncio.gather(*[attempt(target, finish_file, local_file, chunks)
+                               for target in destinations])
+
+async def send_chunk(destinations, local_file, number, buffers):
+    async with buffers:
+        if all(target.error is not None for target in destinations):
+            return
+        chunk_bytes = destinations[0].transfer.chunk_bytes
+        data = await cli.async_transfer.read_range(
+            local_file.path, number * chunk_bytes, chunk_bytes)
+        await asyncio.gather(*[attempt(target, put_chunk, local_file, number, data)
+                               for target in destinations])
+
+def remote_name(target, local_file):
+    return cli.async_transfer.remote_name(target.transfer, local_file)
+
+async def begin_file(target, local_file):
+    if target.mode != azmodels.StorageModes.File:
+        return
+    name = remote_name(target, local_file)
+    await cli.async_transfer.create_directory(target.transfer,
+                                              name.rpartition('/')[0])
+    await target.transfer.request('PUT', name, {
+        'x-ms-type': 'file',
+        'x-ms-content-length': str(local_file.size),
+        'x-ms-content-type': cli.async_transfer.content_type(name)})
+
+async def put_chunk(target, local_file, number, data):
+    name = remote_name(target, local_file)
+    if target.mode == azmodels.StorageModes.File:
+        if data:
+            offset = number * target.transfer.chunk_bytes
+            await target.transfer.request('PUT', name, {
+                'x-ms-range': 'bytes={}-{}'.format(offset, offset + len(data) - 1),
+                'x-ms-write': 'update'}, data, comp='range')
+    elif local_file.size <= target.transfer.chunk_bytes:
+        await target.transfer.request('PUT', name, {
+            'x-ms-blob-type': 'BlockBlob',
+            'x-ms-blob-content-type': cli.async_transfer.content_type(name)}, data)
+    else:
+        await target.transfer.request('PUT', name, body=data, comp='block',
+                                      blockid=cli.async_transfer.block_id(number))
+    target.bytes += len(data)
+
+async def finish_file(target, local_file, chunks):
+    if target.mode == azmodels.StorageModes.Block and \
+            local_file.size > target.transfer.chunk_bytes:
+        name = remote_name(target, local_file)
+        await target.transfer.request(
+            'PUT', name,
+            {'x-ms-blob-content-type': cli.async_transfer.content_type(name)},
+            cli.async_transfer.block_list([cli.async_transfer.block_id(number)
+                                           for number in range(chunks)]),
+            comp='blocklist')
+    target.files += 1
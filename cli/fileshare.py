@@ -3,6 +3,14 @@ import logging
 from azure.storage.file import FileService
 import blobxfer.models.azure as azmodels
 
+import cli.dedup
+import cli.pack
+import cli.remote
+import cli.state
+import cli.storage
+import cli.sync
+import cli.trace
+import cli.tuning
 import cli.utils
 import cli.blobxfer_util
 
@@ -16,24 +24,77 @@ def set_fileshare_service(context):
     )
 
 def created_fileshare(context):
-    shares = list(context.obj['fileshare_service'].list_shares(include_snapshots=True))
-    return any(context.obj['fileshare'] == share.name for share in shares)
+    fileshare = context.obj['fileshare']
+    return cli.state.exists(
+        context, FILESHARE_TYPE, fileshare_state_name(context),
+        lambda: context.obj['fileshare_service'].exists(fileshare))
+
+def fileshare_state_name(context):
+    return '{}/{}'.format(context.obj['storage_account'],
+                          context.obj['fileshare'])
 
+@cli.trace.traced
 def create_fileshare_if_not_exists(context):
     fileshare = context.obj['fileshare']
     if not created_fileshare(context):
         context.obj['fileshare_service'].create_share(fileshare,
                                                       fail_on_exist=False)
+        cli.state.record(context, FILESHARE_TYPE,
+                         fileshare_state_name(context), True)
         LOGGER.info(cli.utils.created(FILESHARE_TYPE, fileshare))
     else:
         LOGGER.info(cli.utils.already_exists(FILESHARE_TYPE, fileshare))
 
+@cli.trace.traced
 def upload(context):
-    cli.blobxfer_util.start_uploader(context,
-                                     azmodels.StorageModes.File,
-                                     context.obj['fileshare'])
+    cli.storage.retry_on_auth_error(context, upload_to_fileshare,
+                                    set_fileshare_service)
+
+def upload_to_fileshare(context):
+    if cli.blobxfer_util.transfer_option(context, 'pack'):
+        create_fileshare_if_not_exists(context)
+        cli.pack.upload(fileshare_remote(context), context.obj['local_path'],
+                        cli.blobxfer_util.transfer_option(context, 'shard_size_mb')
+                        * cli.pack.MiB)
+        return
+    if cli.blobxfer_util.transfer_option(context, 'dedup'):
+        create_fileshare_if_not_exists(context)
+        cli.dedup.upload(fileshare_remote(context),
+                         list(cli.blobxfer_util.local_files(context)),
+                         cli.blobxfer_util.transfer_option(context, 'prefix'),
+                         cli.blobxfer_util.transfer_option(context, 'cpu_budget')
+                         or cli.tuning.default_cpu_budget())
+        return
+    cli.sync.start_uploader(context,
+                            azmodels.StorageModes.File,
+                            cli.blobxfer_util.prefixed_remote_path(
+                                context, context.obj['fileshare']))
 
+@cli.trace.traced
 def download(context):
+    cli.storage.retry_on_auth_error(context, download_from_fileshare,
+                                    set_fileshare_service)
+
+def download_from_fileshare(context):
+    if not created_fileshare(context):
+        LOGGER.warning(cli.utils.does_not_exist(FILESHARE_TYPE,
+                                                context.obj['fileshare']))
+        return
+    if cli.blobxfer_util.transfer_option(context, 'pack'):
+        cli.pack.download(fileshare_remote(context), context.obj['local_path'],
+                          cli.blobxfer_util.transfer_option(context, 'member'))
+        return
+    if cli.blobxfer_util.transfer_option(context, 'dedup'):
+        cli.dedup.download(fileshare_remote(context), context.obj['local_path'],
+                           cli.blobxfer_util.transfer_option(context, 'prefix'),
+                           cli.blobxfer_util.transfer_option(context, 'include'),
+                           cli.blobxfer_util.transfer_option(context, 'exclude'))
+        return
     cli.blobxfer_util.start_downloader(context,
                                        azmodels.StorageModes.File,
-                                       context.obj['fileshare'])
+                                       cli.blobxfer_util.prefixed_remote_path(
+                                           context, context.obj['fileshare']))
+
+def fileshare_remote(context):
+    return cli.remote.FileRemote(context.obj['fileshare_service'],
+                                 context.obj['fileshare'])
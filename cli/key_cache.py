@@ -0,0 +1,68 @@
+"""Encrypted on-disk cache of storage account keys.
+
+Keys are stored per (subscription, resource group, storage account) with an
+expiry, encrypted with a key derived from the AAD app secret. Anyone able to
+decrypt the cache can already call list_keys with that secret.
+"""
+import base64
+import logging
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+import cli.cache_file
+
+LOGGER = logging.getLogger(__name__)
+KEY_CACHE_FILE = 'storage_keys.json'
+KEY_DERIVATION_INFO = b'pybatchai storage key cache'
+
+def load(context):
+    """The cached key for the current storage account, or None."""
+    entry = cli.cache_file.read(key_cache_path(context)).get(cache_id(context))
+    if not entry or entry['expires_at'] <= time.time():
+        return None
+    try:
+        return create_fernet(context).decrypt(entry['key'].encode()).decode()
+    except InvalidToken:
+        # written with a different AAD secret
+        return None
+
+def store(context, storage_account_key):
+    path = key_cache_path(context)
+    now = time.time()
+    encrypted_key = create_fernet(context).encrypt(storage_account_key.encode())
+    with cli.cache_file.locked(path):
+        entries = {k: v for k, v in cli.cache_file.read(path).items()
+                   if v['expires_at'] > now}
+        entries[cache_id(context)] = {
+            'key': encrypted_key.decode(),
+            'expires_at': now + context.obj['key_cache_ttl']
+        }
+        cli.cache_file.write(path, entries)
+
+def invalidate(context):
+    path = key_cache_path(context)
+    with cli.cache_file.locked(path):
+        entries = cli.cache_file.read(path)
+        if entries.pop(cache_id(context), None) is not None:
+            cli.cache_file.write(path, entries)
+
+def cache_id(context):
+    return '/'.join([context.obj['subscription_id'],
+                     context.obj['resource_group'],
+                     context.obj['storage_account']])
+
+def create_fernet(context):
+    hkdf = HKDF(algorithm=hashes.SHA256(),
+                length=32,
+                salt=context.obj['aad_app_id'].encode(),
+                info=KEY_DERIVATION_INFO,
+                backend=default_backend())
+    derived_key = hkdf.derive(context.obj['aad_key'].encode())
+    return Fernet(base64.urlsafe_b64encode(derived_key))
+
+def key_cache_path(context):
+    return cli.cache_file.cache_path(context.obj['cache_dir'], KEY_CACHE_FILE)
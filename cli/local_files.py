@@ -0,0 +1,55 @@
+"""Walking of local upload sources."""
+import collections
+import fnmatch
+import os
+
+LocalFile = collections.namedtuple('LocalFile',
+                                   ['path', 'relative_path', 'size', 'mtime'])
+
+def selected(relative_path, includes=None, excludes=None):
+    """Whether relative_path matches one of includes, if any, and none of
+    excludes. Patterns are fnmatch patterns of the whole path, so * also
+    matches /.
+    """
+    if includes and not any(fnmatch.fnmatch(relative_path, pattern)
+                            for pattern in includes):
+        return False
+    return not any(fnmatch.fnmatch(relative_path, pattern)
+                   for pattern in excludes or ())
+
+def scan(local_path, includes=None, excludes=None):
+    """Yield every regular file under local_path that is selected by includes
+    and excludes.
+
+    relative_path is the name the file gets remotely: relative to local_path
+    for a directory, the base name for a single file, always with '/'.
+    """
+    if os.path.isfile(local_path):
+        stat = os.stat(local_path)
+        relative_path = os.path.basename(local_path)
+        if selected(relative_path, includes, excludes):
+            yield LocalFile(local_path, relative_path, stat.st_size,
+                            stat.st_mtime)
+        return
+    directories = [local_path]
+    while directories:
+        directory = directories.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=True):
+                    directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=True):
+                    relative_path = os.path.relpath(
+                        entry.path, local_path).replace(os.sep, '/')
+                    if not selected(relative_path, includes, excludes):
+                        continue
+                    stat = entry.stat()
+                    yield LocalFile(entry.path, relative_path, stat.st_size,
+                                    stat.st_mtime)
+
+def stage(local_files, staging):
+    """Mirror local_files under staging as symlinks so blobxfer sends only them."""
+    for local_file in local_files:
+        link = os.path.join(staging, *local_file.relative_path.split('/'))
+        os.makedirs(os.path.dirname(link), exist_ok=True)
+        os.symlink(os.path.abspath(local_file.path), link)
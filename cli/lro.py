@@ -0,0 +1,82 @@
+"""Polling of long-running Azure operations.
+
+A check is a callable returning a Status. wait() and wait_async() call it until
+the operation is done, sleeping between polls with exponential backoff and
+jitter, never sooner than the Retry-After the service asked for, and give up
+once the overall timeout has passed.
+"""
+import asyncio
+import collections
+import email.utils
+import logging
+import random
+import time
+
+import cli.constants
+
+LOGGER = logging.getLogger(__name__)
+INITIAL_DELAY = 2
+MAX_DELAY = 60
+BACKOFF_FACTOR = 2
+
+Status = collections.namedtuple('Status', ['done', 'result', 'retry_after'])
+
+class OperationTimeout(Exception):
+    pass
+
+class OperationFailed(Exception):
+    pass
+
+def backoff_delays(initial_delay=INITIAL_DELAY, max_delay=MAX_DELAY,
+                   factor=BACKOFF_FACTOR):
+    """Yield exponentially growing delays with equal jitter."""
+    ceiling = initial_delay
+    while True:
+        yield ceiling / 2 + random.uniform(0, ceiling / 2)
+        ceiling = min(ceiling * factor, max_delay)
+
+def wait(check, timeout=cli.constants.OPERATION_TIMEOUT, delays=None,
+         sleep=time.sleep, clock=time.monotonic):
+    """Poll check until it reports done and return its result."""
+    deadline = clock() + timeout
+    delays = backoff_delays() if delays is None else delays
+    while True:
+        status = check()
+        if status.done:
+            return status.result
+        sleep(next_delay(status, delays, deadline - clock()))
+
+async def wait_async(check, timeout=cli.constants.OPERATION_TIMEOUT,
+                     delays=None):
+    """Like wait, running the blocking check in the default executor."""
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    delays = backoff_delays() if delays is None else delays
+    while True:
+        status = await loop.run_in_executor(None, check)
+        if status.done:
+            return status.result
+        await asyncio.sleep(next_delay(status, delays, deadline - loop.time()))
+
+def next_delay(status, delays, remaining):
+    if remaining <= 0:
+        raise OperationTimeout('Operation did not finish in time.')
+    delay = next(delays)
+    if status.retry_after is not None:
+        delay = max(delay, status.retry_after)
+    LOGGER.debug('Operation still running, polling again in %.1fs.', delay)
+    return min(delay, remaining)
+
+def retry_after(response):
+    """Seconds from a response's Retry-After header, or None."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    retry_at = email.utils.parsedate_tz(value)
+    if retry_at is None:
+        return None
+    return max(email.utils.mktime_tz(retry_at) - time.time(), 0)
@@ -0,0 +1,83 @@
+"""SQLite index of the files an incremental upload last sent to a remote target.
+
+Each row holds the remote name, size, mtime and MD5 of a local file as of its
+last successful upload. Files whose size and mtime match their row are
+unchanged without reading them; files whose mtime moved but whose size and MD5
+match are only touched. The remote side is never listed, so the manifest
+assumes nothing else writes to the target.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+
+import cli.cache_file
+
+MANIFEST_DIR = 'manifests'
+HASH_BLOCK_BYTES = 1024 * 1024
+HASH_WORKERS = 8
+
+Changes = collections.namedtuple('Changes', ['changed', 'touched', 'deleted'])
+
+def manifest_path(cache_dir, storage_account, mode_name, remote_path, local_path):
+    target = '\n'.join([storage_account, mode_name, remote_path,
+                        os.path.abspath(local_path)])
+    file_name = hashlib.sha1(target.encode()).hexdigest() + '.sqlite'
+    return cli.cache_file.cache_path(os.path.join(cache_dir, MANIFEST_DIR),
+                                     file_name)
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    os.chmod(path, cli.cache_file.FILE_MODE)
+    connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                       'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, md5 TEXT)')
+    return connection
+
+def compare(connection, local_files):
+    """Split local files into changed and touched ones, plus deleted paths.
+
+    touched holds (local file, md5) pairs for files whose content is unchanged.
+    """
+    rows = {path: (size, mtime, md5) for path, size, mtime, md5
+            in connection.execute('SELECT path, size, mtime, md5 FROM files')}
+    changed, maybe_touched = [], []
+    for local_file in local_files:
+        row = rows.pop(local_file.relative_path, None)
+        if row is None or row[0] != local_file.size:
+            changed.append(local_file)
+        elif row[1] != local_file.mtime:
+            maybe_touched.append((local_file, row[2]))
+    touched = []
+    for (local_file, md5), digest in zip(
+            maybe_touched, hash_files(local_file for local_file, _ in maybe_touched)):
+        if digest == md5:
+            touched.append((local_file, digest))
+        else:
+            changed.append(local_file)
+    return Changes(changed, touched, sorted(rows))
+
+def record(connection, uploaded, touched, deleted):
+    """Store the state of uploaded, touched and remotely deleted files."""
+    uploaded = list(uploaded)
+    rows = [(local_file.relative_path, local_file.size, local_file.mtime, digest)
+            for local_file, digest in zip(uploaded, hash_files(uploaded))]
+    rows.extend((local_file.relative_path, local_file.size, local_file.mtime, digest)
+                for local_file, digest in touched)
+    with connection:
+        connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                               rows)
+        connection.executemany('DELETE FROM files WHERE path = ?',
+                               [(path,) for path in deleted])
+
+def hash_files(local_files):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        return list(executor.map(lambda local_file: md5_of(local_file.path),
+                                 local_files))
+
+def md5_of(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as local_file:
+        for block in iter(lambda: local_file.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
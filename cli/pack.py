@@ -0,0 +1,197 @@
+"""Packed transfers of trees with many small files.
+
+Uploading one object per file is bound by per-request latency when files are
+tiny. With --pack the local tree is streamed into tar shards of about the
+shard size, which are uploaded while the next shard is built, followed by an
+index:
+
+    pybatchai-pack/shard-00000.tar
+    pybatchai-pack/shard-00001.tar
+    pybatchai-pack/index.json
+
+The index maps each relative path to its shard and the offset and size of its
+data inside the shard. A download streams every shard through a tar reader as
+it arrives, writing files without keeping a copy of the shard; downloading
+single members fetches just their byte range.
+"""
+import concurrent.futures
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+
+import cli.local_files
+import cli.trace
+import cli.utils
+
+LOGGER = logging.getLogger(__name__)
+PACK_DIR = 'pybatchai-pack'
+INDEX_NAME = PACK_DIR + '/index.json'
+SHARD_NAME = PACK_DIR + '/shard-{:05d}.tar'
+INDEX_VERSION = 1
+MEMBER_TYPE = 'packed file'
+TRANSFER_WORKERS = 4
+MiB = 1024 * 1024
+COPY_BUFFER_BYTES = MiB
+
+@cli.trace.traced
+def upload(remote, local_path, shard_size_bytes, workers=TRANSFER_WORKERS):
+    """Pack local_path into shards on remote and return the index."""
+    local_files = sorted(cli.local_files.scan(local_path),
+                         key=lambda local_file: local_file.relative_path)
+    index = {'version': INDEX_VERSION, 'shards': [], 'files': {}}
+    pending = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for number, (shard, entries) in enumerate(
+                build_shards(local_files, shard_size_bytes)):
+            name = SHARD_NAME.format(number)
+            index['shards'].append(name)
+            for relative_path, offset, size, mtime in entries:
+                index['files'][relative_path] = [number, offset, size, mtime]
+            # at most workers shards are held at once
+            if len(pending) >= workers:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(put_shard, remote, name, shard))
+        for future in pending:
+            future.result()
+    # the index goes last, so a pack without one is incomplete
+    remote.put(INDEX_NAME, json.dumps(index).encode())
+    LOGGER.info('Packed %d files into %d shards.', len(index['files']),
+                len(index['shards']))
+    return index
+
+def put_shard(remote, name, shard):
+    with shard:
+        # the archive leaves shard at its end
+        size = shard.tell()
+        shard.seek(0)
+        remote.put_stream(name, shard, size)
+
+def build_shards(local_files, shard_size_bytes):
+    """Yield (tar file, entries) per shard of about shard_size_bytes.
+
+    A shard is kept in memory up to shard_size_bytes and spills to a temporary
+    file beyond that, so a large file is never read whole into memory. Each
+    entry is (relative path, data offset, size, mtime).
+    """
+    shard, archive, entries = None, None, []
+    for local_file in local_files:
+        if archive is None:
+            shard = tempfile.SpooledTemporaryFile(max_size=shard_size_bytes)
+            archive = tarfile.open(fileobj=shard, mode='w',
+                                   format=tarfile.PAX_FORMAT)
+        info = tarfile.TarInfo(local_file.relative_path)
+        info.size = local_file.size
+        info.mtime = local_file.mtime
+        with open(local_file.path, 'rb') as source:
+            archive.addfile(info, source)
+        # data ends at the current offset, padded to a whole block
+        padded_size = -(-local_file.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        entries.append((local_file.relative_path, archive.offset - padded_size,
+                        local_file.size, local_file.mtime))
+        if archive.offset >= shard_size_bytes:
+            archive.close()
+            yield shard, entries
+            shard, archive, entries = None, None, []
+    if archive is not None:
+        archive.close()
+        yield shard, entries
+
+def load_index(remote):
+    index = json.loads(remote.get(INDEX_NAME).decode())
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError('Unsupported pack index version {}.'.format(
+            index.get('version')))
+    return index
+
+@cli.trace.traced
+def download(remote, local_path, members=None, workers=TRANSFER_WORKERS):
+    """Extract the pack on remote into local_path.
+
+    With members only those files are fetched, through ranged reads.
+    """
+    index = load_index(remote)
+    if members:
+        extract_members(remote, index, local_path, members, workers)
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        counts = list(executor.map(
+            lambda shard: extract_shard(remote, shard, local_path, index['files']),
+            index['shards']))
+    LOGGER.info('Extracted %d files from %d shards.', sum(counts),
+                len(index['shards']))
+
+def extract_shard(remote, shard, local_path, files):
+    """Stream shard from remote through a pipe into a tar reader."""
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(read_fd, 'rb') as reader, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        writer = os.fdopen(write_fd, 'wb')
+
+        def fetch():
+            with writer:
+                remote.get_to_stream(shard, writer)
+
+        fetched = executor.submit(fetch)
+        try:
+            count = extract_stream(reader, local_path, files)
+            # drain the end of archive padding so the writer can finish
+            while reader.read(COPY_BUFFER_BYTES):
+                pass
+        finally:
+            reader.close()
+        fetched.result()
+    return count
+
+def extract_stream(stream, local_path, files):
+    """Write the regular files in the tar stream that files lists."""
+    count = 0
+    with tarfile.open(fileobj=stream, mode='r|') as archive:
+        for info in archive:
+            if not info.isfile() or info.name not in files:
+                continue
+            with archive.extractfile(info) as source, \
+                    open_target(local_path, info.name) as target:
+                shutil.copyfileobj(source, target, COPY_BUFFER_BYTES)
+            set_mtime(local_path, info.name, files[info.name][3])
+            count += 1
+    return count
+
+def extract_members(remote, index, local_path, members, workers):
+    def extract(member):
+        shard, offset, size, mtime = index['files'][member]
+        with open_target(local_path, member) as target:
+            if size:
+                target.write(remote.get_range(index['shards'][shard], offset,
+                                              offset + size - 1))
+        set_mtime(local_path, member, mtime)
+
+    found = []
+    for member in members:
+        if member in index['files']:
+            found.append(member)
+        else:
+            LOGGER.warning(cli.utils.does_not_exist(MEMBER_TYPE, member))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(extract, found))
+    LOGGER.info('Extracted %d packed files.', len(found))
+
+def target_path(local_path, relative_path):
+    """Local path of a packed file, refusing names that leave local_path."""
+    parts = relative_path.split('/')
+    if relative_path.startswith('/') or '..' in parts:
+        raise ValueError('Refusing to extract {}.'.format(relative_path))
+    return os.path.join(local_path, *parts)
+
+def open_target(local_path, relative_path):
+    path = target_path(local_path, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, 'wb')
+
+def set_mtime(local_path, relative_path, mtime):
+    os.utime(target_path(local_path, relative_path), (mtime, mtime))
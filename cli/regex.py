@@ -12,6 +12,8 @@ SHARE_OR_CONTAINER_PATTERN = '^{}{}{}$'.format(DOES_NOT_CONTAIN_TWO_DASH,
                                                APPROVED_SHARE_CONTAINER_LETTERS)
 CLUSTER_NAME_PATTERN = '^[\w-]{1,64}$'
 WORKSPACE_NAME_PATTERN = '^[\w-]{1,64}$'
+EXPERIMENT_NAME_PATTERN = '^[\w-]{1,64}$'
+JOB_NAME_PATTERN = '^[\w-]{1,64}$'
 
 REGEX_DICT = {
     'resource_group_name': RG_NAME_PATTERN,
@@ -19,5 +21,7 @@ REGEX_DICT = {
     'fileshare_name': SHARE_OR_CONTAINER_PATTERN,
     'container_name': SHARE_OR_CONTAINER_PATTERN,
     'cluster_name': CLUSTER_NAME_PATTERN,
-    'workspace': WORKSPACE_NAME_PATTERN
+    'workspace': WORKSPACE_NAME_PATTERN,
+    'experiment': EXPERIMENT_NAME_PATTERN,
+    'job_name': JOB_NAME_PATTERN
 }
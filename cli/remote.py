@@ -0,0 +1,117 @@
+"""Whole-object and ranged access to a blob container or a file share.
+
+Used by transfers that manage their own remote layout instead of mirroring a
+local tree through blobxfer.
+
+A file is created at its full size before its ranges are written, so an
+interrupted upload to a share leaves a file of zeros behind. FileRemote marks
+a file complete in its metadata once every range is written, and exists only
+counts marked files. A blob is only visible once its upload commits.
+"""
+import posixpath
+
+from azure.common import AzureMissingResourceHttpError
+
+# metadata names must be valid C# identifiers
+COMPLETE_METADATA = 'pybatchai_complete'
+
+class BlobRemote:
+    def __init__(self, service, container):
+        self.service = service
+        self.container = container
+
+    def put(self, name, data):
+        self.service.create_blob_from_bytes(self.container, name, data)
+
+    def put_file(self, name, path):
+        self.service.create_blob_from_path(self.container, name, path)
+
+    def put_stream(self, name, stream, size):
+        """Upload size bytes read from the seekable stream."""
+        self.service.create_blob_from_stream(self.container, name, stream,
+                                             count=size)
+
+    def exists(self, name):
+        return self.service.exists(self.container, name)
+
+    def get(self, name):
+        return self.service.get_blob_to_bytes(self.container, name).content
+
+    def get_range(self, name, start, end):
+        """Bytes start to end of name, both inclusive."""
+        return self.service.get_blob_to_bytes(self.container, name,
+                                              start_range=start,
+                                              end_range=end).content
+
+    def get_to_stream(self, name, stream):
+        # a single connection writes in order, so stream need not be seekable
+        self.service.get_blob_to_stream(self.container, name, stream,
+                                        max_connections=1)
+
+class FileRemote:
+    def __init__(self, service, share):
+        self.service = service
+        self.share = share
+        self.directories = set()
+
+    def put(self, name, data):
+        directory, file_name = posixpath.split(name)
+        self.create_directories(directory)
+        self.service.create_file_from_bytes(self.share, directory or None,
+                                            file_name, data)
+        self.mark_complete(directory, file_name)
+
+    def put_file(self, name, path):
+        directory, file_name = posixpath.split(name)
+        self.create_directories(directory)
+        self.service.create_file_from_path(self.share, directory or None,
+                                           file_name, path)
+        self.mark_complete(directory, file_name)
+
+    def put_stream(self, name, stream, size):
+        """Upload size bytes read from the seekable stream."""
+        directory, file_name = posixpath.split(name)
+        self.create_directories(directory)
+        self.service.create_file_from_stream(self.share, directory or None,
+                                             file_name, stream, size)
+        self.mark_complete(directory, file_name)
+
+    def mark_complete(self, directory, file_name):
+        self.service.set_file_metadata(self.share, directory or None, file_name,
+                                       {COMPLETE_METADATA: 'true'})
+
+    def exists(self, name):
+        """Whether name was written completely."""
+        directory, file_name = posixpath.split(name)
+        try:
+            metadata = self.service.get_file_metadata(self.share,
+                                                      directory or None, file_name)
+        except AzureMissingResourceHttpError:
+            return False
+        return COMPLETE_METADATA in metadata
+
+    def get(self, name):
+        directory, file_name = posixpath.split(name)
+        return self.service.get_file_to_bytes(self.share, directory or None,
+                                              file_name).content
+
+    def get_range(self, name, start, end):
+        """Bytes start to end of name, both inclusive."""
+        directory, file_name = posixpath.split(name)
+        return self.service.get_file_to_bytes(self.share, directory or None,
+                                              file_name, start_range=start,
+                                              end_range=end).content
+
+    def get_to_stream(self, name, stream):
+        directory, file_name = posixpath.split(name)
+        self.service.get_file_to_stream(self.share, directory or None,
+                                        file_name, stream, max_connections=1)
+
+    def create_directories(self, directory):
+        """Create directory and its parents, once per process."""
+        parts = [part for part in directory.split('/') if part]
+        for depth in range(1, len(parts) + 1):
+            path = '/'.join(parts[:depth])
+            if path not in self.directories:
+                self.service.create_directory(self.share, path)
+                self.directories.add(path)
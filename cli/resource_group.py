@@ -1,30 +1,44 @@
 import logging
 
-from azure.mgmt.resource import ResourceManagementClient
-from msrestazure.azure_cloud import AZURE_PUBLIC_CLOUD
+import cli.clients
+import cli.lro
+import cli.state
+import cli.trace
 import cli.utils
 
 LOGGER = logging.getLogger(__name__)
 RG_TYPE = 'resource group'
+PROVISIONING_SUCCEEDED = 'Succeeded'
 
+@cli.trace.traced
 def create_rg_if_not_exists(context):
     """Create a new resource group."""
     resource_group = context.obj['resource_group']
     location = context.obj['location']
-    context.obj['resource_client'] = ResourceManagementClient(
-        credentials=context.obj['aad_credentials'],
-        subscription_id=context.obj['subscription_id'],
-        base_url=AZURE_PUBLIC_CLOUD.endpoints.resource_manager)
+    cli.clients.set_resource_client(context)
 
-    if not resource_group_exists:
+    if not resource_group_exists(context):
         context.obj['resource_client'].resource_groups.create_or_update(
             resource_group,
             {'location': location}
         )
+        cli.lro.wait(lambda: provisioning_status(context))
+        cli.state.record(context, RG_TYPE, resource_group, True)
         LOGGER.info(cli.utils.created(RG_TYPE, resource_group))
     else:
         LOGGER.info(cli.utils.already_exists(RG_TYPE, resource_group))
 
 def resource_group_exists(context):
-    return any(context.obj['resource_group'] == rg.name
-               for rg in context.obj['resource_client'].resource_groups.list())
+    resource_group = context.obj['resource_group']
+    return cli.state.exists(
+        context, RG_TYPE, resource_group,
+        lambda: context.obj['resource_client'].resource_groups.check_existence(
+            resource_group))
+
+def provisioning_status(context):
+    response = context.obj['resource_client'].resource_groups.get(
+        context.obj['resource_group'], raw=True)
+    return cli.lro.Status(
+        done=response.output.properties.provisioning_state == PROVISIONING_SUCCEEDED,
+        result=response.output,
+        retry_after=cli.lro.retry_after(response.response))
@@ -0,0 +1,17 @@
+"""Loading of declarative JSON or YAML spec files."""
+import json
+
+import click
+
+YAML_EXTENSIONS = ('.yaml', '.yml')
+
+def load_spec(path):
+    with open(path) as spec_file:
+        if path.endswith(YAML_EXTENSIONS):
+            import yaml
+            spec = yaml.safe_load(spec_file)
+        else:
+            spec = json.load(spec_file)
+    if not isinstance(spec, dict):
+        raise click.BadParameter('{} must contain a mapping.'.format(path))
+    return spec
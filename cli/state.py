@@ -0,0 +1,69 @@
+"""Resource existence checks backed by a small on-disk cache with a TTL.
+
+Each check is a single point lookup (GET or HEAD) against Azure. With a
+positive --state-ttl the result, positive or negative, is kept in the cache
+directory and reused for that many seconds, so repeated commands against the
+same resources skip the lookup entirely. Commands sharing a process through
+`pybatchai run` also share the results in context.obj['known_state'].
+"""
+import logging
+import time
+
+import cli.cache_file
+
+LOGGER = logging.getLogger(__name__)
+STATE_CACHE_FILE = 'resource_state.json'
+# entries older than this are dropped whenever the cache is written
+MAX_ENTRY_AGE = 24 * 60 * 60
+
+def exists(context, resource_type, name, check):
+    """Whether the resource exists, calling check() only on a cache miss."""
+    found = cached(context, resource_type, name)
+    if found is None:
+        found = bool(check())
+        record(context, resource_type, name, found)
+    return found
+
+def cached(context, resource_type, name):
+    """The cached existence of a resource, or None if unknown or expired."""
+    known = context.obj.get('known_state')
+    if known is not None:
+        found = known.get(state_key(context, resource_type, name))
+        if found is not None:
+            return found
+    ttl = context.obj.get('state_ttl', 0)
+    if ttl <= 0:
+        return None
+    entry = cli.cache_file.read(state_path(context)).get(
+        state_key(context, resource_type, name))
+    if not entry or entry['checked_at'] + ttl <= time.time():
+        return None
+    LOGGER.debug('Using cached state of %s %s.', resource_type, name)
+    return entry['exists']
+
+def record(context, resource_type, name, found):
+    """Remember that a resource was found, created or deleted."""
+    known = context.obj.get('known_state')
+    if known is not None:
+        known[state_key(context, resource_type, name)] = found
+    if context.obj.get('state_ttl', 0) <= 0:
+        return
+    path = state_path(context)
+    now = time.time()
+    with cli.cache_file.locked(path):
+        entries = {k: v for k, v in cli.cache_file.read(path).items()
+                   if v['checked_at'] + MAX_ENTRY_AGE > now}
+        entries[state_key(context, resource_type, name)] = {
+            'exists': found,
+            'checked_at': now
+        }
+        cli.cache_file.write(path, entries)
+
+def state_key(context, resource_type, name):
+    return '/'.join([context.obj['subscription_id'],
+                     context.obj['resource_group'],
+                     resource_type,
+                     name])
+
+def state_path(context):
+    return cli.cache_file.cache_path(context.obj['cache_dir'], STATE_CACHE_FILE)
@@ -1,74 +1,130 @@
+import collections
 import logging
-import time
+import threading
 
-from azure.mgmt.storage import StorageManagementClient
 from azure.mgmt.storage.models import (
     StorageAccountCreateParameters,
     Sku,
     SkuName,
     Kind
 )
+from azure.common import AzureHttpError
+from msrestazure.azure_exceptions import CloudError
 
+import cli.key_cache
+import cli.lro
+import cli.state
+import cli.trace
 import cli.utils
 
 LOGGER = logging.getLogger(__name__)
 STORAGE_ACCOUNT_TYPE = 'storage account'
-ONE_SECOND = 1
+PROVISIONING_SUCCEEDED = 'Succeeded'
+AUTH_FAILED_STATUS = 403
+# one lock per account, so operations run together resolve its key once
+KEY_LOCKS = collections.defaultdict(threading.Lock)
+KEY_LOCKS_GUARD = threading.Lock()
 
-def set_storage_client(context):
-    if 'storage_client' not in context.obj:
-        context.obj['storage_client'] = StorageManagementClient(
-            credentials=context.obj['aad_credentials'],
-            subscription_id=context.obj['subscription_id']
-        )
+@cli.trace.traced
+def set_storage_account_key(context, refresh=False):
+    """Resolve the account key once per account, from the key cache if enabled."""
+    resolved_keys = context.obj.setdefault('storage_account_keys', {})
+    account_id = cli.key_cache.cache_id(context)
+    use_key_cache = context.obj.get('key_cache_ttl', 0) > 0
+    with KEY_LOCKS_GUARD:
+        key_lock = KEY_LOCKS[account_id]
+    with key_lock:
+        if refresh:
+            resolved_keys.pop(account_id, None)
+            if use_key_cache:
+                cli.key_cache.invalidate(context)
+        if account_id not in resolved_keys and use_key_cache:
+            resolved_keys[account_id] = cli.key_cache.load(context)
+        if not resolved_keys.get(account_id):
+            resolved_keys[account_id] = list_storage_account_key(context)
+            if use_key_cache:
+                cli.key_cache.store(context, resolved_keys[account_id])
+        context.obj['storage_account_key'] = resolved_keys[account_id]
 
-def set_storage_account_key(context):
+def list_storage_account_key(context):
     storage_keys = context.obj['storage_client'].storage_accounts.list_keys(
         context.obj['resource_group'],
         context.obj['storage_account']
     )
     storage_keys = {v.key_name: v.value for v in storage_keys.keys}
-    storage_account_key = storage_keys['key1']
-    context.obj['storage_account_key'] = storage_account_key
+    return storage_keys['key1']
 
+def retry_on_auth_error(context, action, reconnect=None):
+    """Run action(context), retrying once with a fresh key if the key is rejected.
+
+    A rejected key has usually been rotated since it was cached. reconnect, if
+    given, is called after the refresh to rebuild clients holding the old key.
+    """
+    try:
+        return action(context)
+    except AzureHttpError as error:
+        if error.status_code != AUTH_FAILED_STATUS:
+            raise
+        LOGGER.warning('Key for %s %s was rejected, fetching it again.',
+                       STORAGE_ACCOUNT_TYPE, context.obj['storage_account'])
+    set_storage_account_key(context, refresh=True)
+    if reconnect is not None:
+        reconnect(context)
+    return action(context)
+
+@cli.trace.traced
 def create_acct_if_not_exists(context):
     storage_acct_name = context.obj['storage_account']
     storage_client = context.obj['storage_client']
+    if storage_account_exists(context):
+        LOGGER.info(cli.utils.already_exists(STORAGE_ACCOUNT_TYPE,
+                                             storage_acct_name))
+        return True
     availability = storage_client.storage_accounts.check_name_availability(
         storage_acct_name)
     if not availability.name_available:
-        if availability.reason.value == 'AlreadyExists':
-            LOGGER.info(cli.utils.already_exists(STORAGE_ACCOUNT_TYPE,
-                                                 storage_acct_name))
-            set_storage_account_key(context)
-        else:
-            LOGGER.warning(cli.utils.create_failed(STORAGE_ACCOUNT_TYPE,
-                                                   storage_acct_name,
-                                                   availability.message))
-            return False
-    else:
-        storage_client.storage_accounts.create(
-            context.obj['resource_group'],
-            storage_acct_name,
-            StorageAccountCreateParameters(
-                sku=Sku(SkuName.standard_ragrs),
-                kind=Kind.storage,
-                location=context.obj['location']
-            )
-        )
-        LOGGER.info(cli.utils.created(STORAGE_ACCOUNT_TYPE, storage_acct_name))
-
-        # wait for storage account to be provisioning state 'Succeeded'
-        print('Storage account is being allocated...')
-        provisioning_state = get_storage_account_state(context)
-        while provisioning_state != 'Succeeded':
-            time.sleep(ONE_SECOND)
-            print('Waiting on storage account allocation...')
-            provisioning_state = get_storage_account_state(context)
-        set_storage_account_key(context)
+        # the name is taken outside of this resource group
+        LOGGER.warning(cli.utils.create_failed(STORAGE_ACCOUNT_TYPE,
+                                               storage_acct_name,
+                                               availability.message))
+        return False
+    # the SDK poller would poll every few seconds; cli.lro backs off instead
+    storage_client.storage_accounts.create(
+        context.obj['resource_group'],
+        storage_acct_name,
+        StorageAccountCreateParameters(
+            sku=Sku(name=SkuName.standard_ragrs),
+            kind=Kind.storage,
+            location=context.obj['location']
+        ),
+        polling=False
+    )
+    LOGGER.info('Waiting for %s %s to be provisioned...',
+                STORAGE_ACCOUNT_TYPE, storage_acct_name)
+    cli.lro.wait(lambda: provisioning_status(context))
+    LOGGER.info(cli.utils.created(STORAGE_ACCOUNT_TYPE, storage_acct_name))
+    cli.state.record(context, STORAGE_ACCOUNT_TYPE, storage_acct_name, True)
     return True
 
-def get_storage_account_state(context):
-    return context.obj['storage_client'].storage_accounts.get_properties(
+def storage_account_exists(context):
+    return cli.state.exists(context, STORAGE_ACCOUNT_TYPE,
+                            context.obj['storage_account'],
+                            lambda: get_storage_account(context))
+
+def get_storage_account(context):
+    try:
+        return context.obj['storage_client'].storage_accounts.get_properties(
+            context.obj['resource_group'],
+            context.obj['storage_account'])
+    except CloudError:
+        return None
+
+def provisioning_status(context):
+    response = context.obj['storage_client'].storage_accounts.get_properties(
         context.obj['resource_group'],
-        context.obj['storage_account']).provisioning_state.value
+        context.obj['storage_account'],
+        raw=True)
+    return cli.lro.Status(
+        done=response.output.provisioning_state.value == PROVISIONING_SUCCEEDED,
+        result=response.output,
+        retry_after=cli.lro.retry_after(response.response))
@@ -0,0 +1,283 @@
+"""Submission of parameter sweeps as many Batch AI jobs, for `job sweep`.
+
+A sweep spec describes one job with {placeholders} and the values to fill in:
+
+    experiment: lr-sweep
+    node_count: 1
+    std_out_err_path_prefix: $AZ_BATCHAI_MOUNT_ROOT/logs
+    command_line: python train.py --lr {lr} --batch-size {batch}
+    environment_variables: {SEED: '{seed}'}
+    grid: {lr: [0.1, 0.01, 0.001], batch: [32, 64]}
+    parameters: [{seed: 1}, {seed: 2}]
+
+Every entry of parameters is combined with every point of the grid; either
+may be left out. Each job is named after the experiment and a digest of its
+parameters, or after the job_name template, so the same spec always yields
+the same names.
+
+Jobs are created concurrently by a bounded pool without waiting for them to
+be scheduled. Each submitted name is appended to a checkpoint in the cache
+directory, and names already there are skipped, so an interrupted sweep
+resumes where it stopped. A job created just before an interruption keeps its
+name, so creating it again cannot duplicate it, and a conflict counts as
+already submitted. When ARM throttles, every worker pauses for at least the
+Retry-After it asked for.
+"""
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import click
+from azure.mgmt.batchai.models import (
+    CustomToolkitSettings,
+    EnvironmentVariable,
+    JobCreateParameters,
+    ResourceId
+)
+from msrest.exceptions import ClientRequestError
+from msrestazure.azure_exceptions import CloudError
+import requests
+
+import cli.cache_file
+import cli.cluster
+import cli.lro
+import cli.state
+import cli.trace
+import cli.utils
+from cli.regex import REGEX_DICT
+
+LOGGER = logging.getLogger(__name__)
+EXPERIMENT_TYPE = 'experiment'
+JOB_TYPE = 'job'
+SWEEP_DIR = 'sweeps'
+CONFLICT_STATUS = 409
+THROTTLED_STATUS = 429
+# throttled attempts of one job before the sweep gives up on it
+MAX_THROTTLED_ATTEMPTS = 10
+DIGEST_LENGTH = 12
+# job template keys formatted with each job's parameters
+TEMPLATE_KEYS = ['command_line', 'std_out_err_path_prefix']
+SUBMITTED = 'submitted'
+ALREADY_SUBMITTED = 'already submitted'
+FAILED = 'failed'
+
+def expand(spec):
+    """The parameters of every job, the last grid key varying fastest."""
+    grid = spec.get('grid') or {}
+    keys = list(grid)
+    points = [dict(zip(keys, values))
+              for values in itertools.product(*(grid[key] for key in keys))]
+    return [dict(entry, **point)
+            for entry in spec.get('parameters') or [{}] for point in points]
+
+def job_name(spec, parameters):
+    template = spec.get('job_name')
+    if template:
+        name = template.format(**parameters)
+    else:
+        digest = hashlib.sha1(json.dumps(parameters, sort_keys=True).encode())
+        name = '{}-{}'.format(spec['experiment'][:64 - DIGEST_LENGTH - 1],
+                              digest.hexdigest()[:DIGEST_LENGTH])
+    if not re.match(REGEX_DICT['job_name'], name):
+        raise click.BadParameter(
+            'Job name {} must be 1-64 alphanumeric characters, dashes or '
+            'underscores.'.format(name))
+    return name
+
+def job_definitions(spec):
+    """(name, parameters) of every job, checking that names are unique."""
+    for key in ['experiment', 'command_line', 'std_out_err_path_prefix']:
+        if key not in spec:
+            raise click.BadParameter('Sweep spec is missing {}.'.format(key))
+    if not re.match(REGEX_DICT['experiment'], spec['experiment']):
+        raise click.BadParameter(
+            'Experiment {} must be 1-64 alphanumeric characters, dashes or '
+            'underscores.'.format(spec['experiment']))
+    definitions = []
+    names = set()
+    for parameters in expand(spec):
+        name = job_name(spec, parameters)
+        if name in names:
+            raise click.BadParameter(
+                'Two jobs of the sweep are both named {}.'.format(name))
+        names.add(name)
+        render(spec, parameters)
+        definitions.append((name, parameters))
+    return definitions
+
+def render(spec, parameters):
+    """The job's templated fields with its parameters filled in."""
+    try:
+        values = {key: spec[key].format(**parameters) for key in TEMPLATE_KEYS}
+        values['environment_variables'] = [
+            EnvironmentVariable(name=name, value=str(value).format(**parameters))
+            for name, value in sorted(
+                (spec.get('environment_variables') or {}).items())]
+    except KeyError as error:
+        raise click.BadParameter(
+            'Sweep spec uses {{{}}}, which is not a parameter.'.format(
+                error.args[0]))
+    return values
+
+def job_parameters(spec, cluster_id, parameters):
+    values = render(spec, parameters)
+    return JobCreateParameters(
+        cluster=ResourceId(id=cluster_id),
+        node_count=spec.get('node_count', 1),
+        std_out_err_path_prefix=values['std_out_err_path_prefix'],
+        custom_toolkit_settings=CustomToolkitSettings(
+            command_line=values['command_line']),
+        environment_variables=values['environment_variables'] or None)
+
+@cli.trace.traced
+def sweep(context, spec, workers, dry_run=False):
+    """Submit every job of spec not yet submitted; return counts by outcome."""
+    definitions = job_definitions(spec)
+    experiment = spec['experiment']
+    path = checkpoint_path(context, experiment)
+    done = read_checkpoint(path)
+    remaining = [(name, parameters) for name, parameters in definitions
+                 if name not in done]
+    LOGGER.info('Sweep %s has %d jobs, %d of them already submitted.',
+                experiment, len(definitions), len(definitions) - len(remaining))
+    if dry_run:
+        for name, parameters in remaining:
+            print(json.dumps({'name': name, 'parameters': parameters},
+                             sort_keys=True))
+        return {}
+    cluster = cli.cluster.get_cluster(context)
+    if cluster is None:
+        raise click.UsageError(cli.utils.does_not_exist(
+            cli.cluster.CLUSTER_TYPE, context.obj['cluster_name']))
+    create_experiment_if_not_exists(context, experiment)
+    counts = dict.fromkeys([SUBMITTED, ALREADY_SUBMITTED, FAILED], 0)
+    throttle = Throttle()
+    with open_checkpoint(path) as checkpoint, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        jobs = iter(remaining)
+        while True:
+            # jobs are built as workers free up, so memory does not grow with the sweep
+            for name, parameters in itertools.islice(jobs, 2 * workers - len(pending)):
+                pending[executor.submit(
+                    submit_job, context, experiment, name,
+                    job_parameters(spec, cluster.id, parameters), throttle)] = name
+            if not pending:
+                break
+            finished, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = pending.pop(future)
+                outcome = job_outcome(name, future)
+                counts[outcome] += 1
+                if outcome != FAILED:
+                    checkpoint.write(name + '\n')
+                    checkpoint.flush()
+    LOGGER.info('Submitted %d jobs of sweep %s, %d were already submitted and '
+                '%d failed.', counts[SUBMITTED], experiment,
+                counts[ALREADY_SUBMITTED], counts[FAILED])
+    return counts
+
+def job_outcome(name, future):
+    try:
+        return future.result()
+    # one failed submission must not abort the jobs still in flight
+    except (CloudError, ClientRequestError, requests.RequestException,
+            cli.lro.OperationFailed) as error:
+        LOGGER.error(cli.utils.create_failed(JOB_TYPE, name, error))
+        return FAILED
+
+def submit_job(context, experiment, name, parameters, throttle):
+    """Create one job without waiting for it, backing off while throttled."""
+    delays = cli.lro.backoff_delays()
+    for _ in range(MAX_THROTTLED_ATTEMPTS):
+        throttle.wait()
+        try:
+            context.obj['batchai_client'].jobs.create(
+                context.obj['resource_group'], context.obj['workspace'],
+                experiment, name, parameters, polling=False)
+            return SUBMITTED
+        except CloudError as error:
+            if error.status_code == CONFLICT_STATUS:
+                return ALREADY_SUBMITTED
+            if error.status_code != THROTTLED_STATUS:
+                raise
+            delay = max(next(delays), cli.lro.retry_after(error.response) or 0)
+            LOGGER.debug('Throttled submitting %s, pausing %.1fs.', name, delay)
+            throttle.pause(delay)
+    raise cli.lro.OperationFailed('Still throttled after {} attempts.'.format(
+        MAX_THROTTLED_ATTEMPTS))
+
+class Throttle:
+    """Pause shared by all workers, so one throttled call slows every one."""
+
+    def __init__(self, sleep=time.sleep, clock=time.monotonic):
+        self.sleep = sleep
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.resume_at = 0
+
+    def pause(self, seconds):
+        with self.lock:
+            self.resume_at = max(self.resume_at, self.clock() + seconds)
+
+    def wait(self):
+        while True:
+            with self.lock:
+                remaining = self.resume_at - self.clock()
+            if remaining <= 0:
+                return
+            self.sleep(remaining)
+
+def create_experiment_if_not_exists(context, experiment):
+    batchai_client = context.obj['batchai_client']
+    resource_group = context.obj['resource_group']
+    workspace = context.obj['workspace']
+    state_name = '{}/{}'.format(workspace, experiment)
+    if cli.state.exists(context, EXPERIMENT_TYPE, state_name,
+                        lambda: fetch_experiment(context, experiment)):
+        return
+    batchai_client.experiments.create(resource_group, workspace, experiment,
+                                      polling=False)
+    cli.lro.wait(lambda: cli.cluster.provisioning_status(
+        EXPERIMENT_TYPE, experiment,
+        lambda: batchai_client.experiments.get(resource_group, workspace,
+                                               experiment, raw=True)))
+    cli.state.record(context, EXPERIMENT_TYPE, state_name, True)
+    LOGGER.info(cli.utils.created(EXPERIMENT_TYPE, experiment))
+
+def fetch_experiment(context, experiment):
+    try:
+        return context.obj['batchai_client'].experiments.get(
+            context.obj['resource_group'], context.obj['workspace'], experiment)
+    except CloudError:
+        return None
+
+def checkpoint_path(context, experiment):
+    file_name = '{}.jsonl'.format('-'.join([
+        context.obj['resource_group'], context.obj['workspace'], experiment]))
+    return cli.cache_file.cache_path(
+        os.path.join(context.obj['cache_dir'], SWEEP_DIR), file_name)
+
+def read_checkpoint(path):
+    """Names of the jobs already submitted; a line cut short is ignored."""
+    try:
+        with open(path) as checkpoint:
+            return {line[:-1] for line in checkpoint if line.endswith('\n')}
+    except FileNotFoundError:
+        return set()
+
+def open_checkpoint(path):
+    """Open the checkpoint for appending, ending any line cut short first."""
+    checkpoint = open(path, 'a+')
+    if checkpoint.tell():
+        checkpoint.seek(checkpoint.tell() - 1)
+        if checkpoint.read(1) != '\n':
+            checkpoint.write('\n')
+    return checkpoint
@@ -0,0 +1,75 @@
+"""Incremental uploads: only files that changed since the last --sync upload of
+the same local path to the same target are sent, see cli.manifest. Every
+upload goes through here, and on to cli.compress.
+"""
+import concurrent.futures
+import logging
+import posixpath
+import tempfile
+
+from azure.common import AzureMissingResourceHttpError
+import blobxfer.models.azure as azmodels
+
+import cli.blobxfer_util
+import cli.compress
+import cli.local_files
+import cli.manifest
+import cli.utils
+
+LOGGER = logging.getLogger(__name__)
+DELETE_WORKERS = 16
+
+def start_uploader(context, mode, remote_path):
+    """Upload local_path, skipping unchanged files when --sync is set."""
+    if not cli.blobxfer_util.transfer_option(context, 'sync'):
+        cli.compress.start_uploader(context, mode, remote_path)
+        return
+    local_path = context.obj['local_path']
+    connection = cli.manifest.connect(cli.manifest.manifest_path(
+        context.obj['cache_dir'], context.obj['storage_account'], mode.name,
+        remote_path, local_path))
+    try:
+        local_files = list(cli.blobxfer_util.local_files(context))
+        changes = cli.manifest.compare(connection, local_files)
+        LOGGER.info('%d of %d files changed since the last sync, %d deleted.',
+                    len(changes.changed), len(local_files), len(changes.deleted))
+        if len(changes.changed) == len(local_files):
+            cli.compress.start_uploader(context, mode, remote_path)
+        elif changes.changed:
+            with tempfile.TemporaryDirectory(prefix='pybatchai-sync-') as staging:
+                cli.local_files.stage(changes.changed, staging)
+                cli.compress.start_uploader(
+                    cli.utils.child_context(context, local_path=staging),
+                    mode, remote_path)
+        deleted = []
+        if cli.blobxfer_util.transfer_option(context, 'delete') and changes.deleted:
+            delete_remote(context, mode, remote_path, changes.deleted)
+            deleted = changes.deleted
+        cli.manifest.record(connection, changes.changed, changes.touched, deleted)
+    finally:
+        connection.close()
+
+def delete_remote(context, mode, remote_path, names):
+    """Delete remote copies of files that no longer exist locally."""
+    remote, prefix = cli.blobxfer_util.split_remote_path(remote_path)
+    if mode == azmodels.StorageModes.File:
+        service = context.obj['fileshare_service']
+
+        def delete(name):
+            directory, file_name = posixpath.split(name)
+            service.delete_file(remote, directory or None, file_name)
+    else:
+        service = context.obj['blob_storage_service']
+
+        def delete(name):
+            service.delete_blob(remote, name)
+
+    def delete_if_present(name):
+        try:
+            delete(cli.blobxfer_util.remote_name(prefix, name))
+        except AzureMissingResourceHttpError:
+            pass
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+        list(executor.map(delete_if_present, names))
+    LOGGER.info('Deleted %d remote files missing locally.', len(names))
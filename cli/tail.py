@@ -0,0 +1,200 @@
+"""Following log files in a file share or a job's output, for `fileshare tail`
+and `job logs`.
+
+Each poll lists the followed files with their sizes, one listing per
+directory rather than one request per file, and then reads only the bytes
+past the offset already shown, with ranged GETs of at most CHUNK_BYTES. A
+multi-GB log therefore costs a few KB per poll once followed, and nothing when
+it did not grow. Files that appear later, such as stderr once a job writes to
+it, are picked up by the next listing and shown from their start.
+
+With resume, offsets are kept in the cache directory, so the next invocation
+shows only what was written since.
+"""
+import logging
+import posixpath
+import sys
+import time
+
+import requests
+from azure.mgmt.batchai.models import FileType, JobsListOutputFilesOptions
+from azure.storage.file.models import Directory
+
+import cli.cache_file
+
+LOGGER = logging.getLogger(__name__)
+CHUNK_BYTES = 4 * 1024 * 1024
+# how far from the end of a file --lines looks for line breaks
+LINE_PROBE_BYTES = 64 * 1024
+FAST_INTERVAL = 2
+SLOW_INTERVAL = 30
+OFFSETS_CACHE_FILE = 'tail_offsets.json'
+STDOUTERR = 'stdouterr'
+FINISHED_STATES = ['succeeded', 'failed']
+
+class FileshareFiles:
+    """Files in a share, given as file or directory paths."""
+
+    def __init__(self, service, share, paths):
+        self.service = service
+        self.share = share
+        self.paths = [path.strip('/') for path in paths]
+        self.key = 'fileshare/{}/{}'.format(service.account_name, share)
+
+    def sizes(self):
+        listings = {}
+        sizes = {}
+        for path in self.paths:
+            parent, name = posixpath.split(path)
+            if not name:
+                sizes.update(self.list_tree(''))
+                continue
+            if parent not in listings:
+                listings[parent] = self.list_directory(parent)
+            entry = listings[parent].get(name)
+            if isinstance(entry, Directory):
+                sizes.update(self.list_tree(path))
+            elif entry is not None:
+                sizes[path] = entry.properties.content_length
+        return sizes
+
+    def list_directory(self, directory):
+        return {entry.name: entry for entry in self.service.list_directories_and_files(
+            self.share, directory or None)}
+
+    def list_tree(self, directory):
+        sizes = {}
+        for name, entry in self.list_directory(directory).items():
+            path = posixpath.join(directory, name)
+            if isinstance(entry, Directory):
+                sizes.update(self.list_tree(path))
+            else:
+                sizes[path] = entry.properties.content_length
+        return sizes
+
+    def read(self, name, start, end):
+        """Bytes start to end of name, both inclusive."""
+        directory, file_name = posixpath.split(name)
+        return self.service.get_file_to_bytes(self.share, directory or None,
+                                              file_name, start_range=start,
+                                              end_range=end).content
+
+class JobOutputFiles:
+    """Files of one output directory of a job, read through their download URLs."""
+
+    def __init__(self, context, experiment, job, directory=STDOUTERR):
+        self.context = context
+        self.experiment = experiment
+        self.job = job
+        self.directory = directory
+        self.urls = {}
+        # one session, so every ranged read reuses the same pooled connection
+        self.session = requests.Session()
+        self.key = 'job/{}/{}/{}/{}/{}'.format(
+            context.obj['resource_group'], context.obj['workspace'], experiment,
+            job, directory)
+
+    def sizes(self):
+        files = self.context.obj['batchai_client'].jobs.list_output_files(
+            self.context.obj['resource_group'], self.context.obj['workspace'],
+            self.experiment, self.job,
+            JobsListOutputFilesOptions(outputdirectoryid=self.directory))
+        sizes = {}
+        for output_file in files:
+            if getattr(output_file.file_type, 'value',
+                       output_file.file_type) != FileType.file.value:
+                continue
+            # download URLs are signed for a limited time, so each listing renews them
+            self.urls[output_file.name] = output_file.download_url
+            sizes[output_file.name] = output_file.content_length
+        return sizes
+
+    def read(self, name, start, end):
+        response = self.session.get(
+            self.urls[name], headers={'Range': 'bytes={}-{}'.format(start, end)})
+        response.raise_for_status()
+        return response.content
+
+    def finished(self):
+        job = self.context.obj['batchai_client'].jobs.get(
+            self.context.obj['resource_group'], self.context.obj['workspace'],
+            self.experiment, self.job)
+        return getattr(job.execution_state, 'value',
+                       job.execution_state) in FINISHED_STATES
+
+def tail(files, offsets, lines=10, follow=False, finished=None, out=None,
+         sleep=time.sleep):
+    """Show the output of files past offsets, updating offsets as it goes.
+
+    Files without an offset start with their last lines. With follow, keep
+    polling until interrupted or until finished() is true, after which the
+    output written meanwhile is shown once more.
+    """
+    out = out or sys.stdout.buffer
+    writer = {'last_name': None}
+    first_poll = True
+    unchanged_polls = 0
+    while True:
+        done = finished is not None and finished()
+        changed = poll(files, offsets, lines if first_poll else None, out, writer)
+        first_poll = False
+        if not follow or done:
+            return
+        unchanged_polls = 0 if changed else unchanged_polls + 1
+        sleep(min(FAST_INTERVAL * 2 ** min(unchanged_polls, 5), SLOW_INTERVAL))
+
+def poll(files, offsets, lines, out, writer):
+    """Show new bytes of every file; whether any were shown."""
+    changed = False
+    sizes = files.sizes()
+    headers = len(sizes) > 1
+    for name, size in sorted(sizes.items()):
+        offset = offsets.get(name)
+        if offset is None:
+            offset = 0 if lines is None else last_lines_offset(files, name, size,
+                                                               lines)
+        elif size < offset:
+            LOGGER.warning('%s was truncated, showing it from the start.', name)
+            offset = 0
+        while offset < size:
+            data = files.read(name, offset, min(offset + CHUNK_BYTES, size) - 1)
+            if not data:
+                break
+            write(out, writer, name if headers else None, data)
+            offset += len(data)
+            changed = True
+        offsets[name] = offset
+    return changed
+
+def last_lines_offset(files, name, size, lines):
+    """Offset of the start of the last lines lines of name."""
+    if lines <= 0 or size == 0:
+        return size
+    start = max(size - LINE_PROBE_BYTES, 0)
+    data = files.read(name, start, size - 1)
+    # a trailing line break ends the last line rather than starting a new one
+    position = len(data) - 1 if data.endswith(b'\n') else len(data)
+    for _ in range(lines):
+        position = data.rfind(b'\n', 0, position)
+        if position < 0:
+            return start
+    return start + position + 1
+
+def write(out, writer, name, data):
+    if name is not None and name != writer['last_name']:
+        out.write('{}==> {} <==\n'.format(
+            '' if writer['last_name'] is None else '\n', name).encode())
+        writer['last_name'] = name
+    out.write(data)
+    out.flush()
+
+def load_offsets(cache_dir, key):
+    path = cli.cache_file.cache_path(cache_dir, OFFSETS_CACHE_FILE)
+    return dict(cli.cache_file.read(path).get(key, {}))
+
+def save_offsets(cache_dir, key, offsets):
+    path = cli.cache_file.cache_path(cache_dir, OFFSETS_CACHE_FILE)
+    with cli.cache_file.locked(path):
+        entries = cli.cache_file.read(path)
+        entries[key] = offsets
+        cli.cache_file.write(path, entries)
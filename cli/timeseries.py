@@ -0,0 +1,98 @@
+"""Append-only files of fixed-size node count samples.
+
+A file is a header followed by one packed record per sample, oldest first:
+
+    header  magic, format version, record size, sampling interval (s)
+    record  time (s since the epoch, float64), then target, current, idle,
+            running, preparing, leaving and unusable node counts (uint32)
+
+Records never move, so appending is one write and readers map the file and
+reach any record by offset: a window is found by binary search on time and
+then read one record at a time, whatever the size of the file. A record cut
+short by a crash is ignored and overwritten by the next append.
+"""
+import bisect
+import collections
+import mmap
+import os
+import struct
+
+MAGIC = b'PBTS'
+VERSION = 1
+HEADER = struct.Struct('<4sHHd')
+RECORD = struct.Struct('<d7I')
+TIME = struct.Struct('<d')
+
+Sample = collections.namedtuple('Sample', [
+    'time', 'target', 'current', 'idle', 'running', 'preparing', 'leaving',
+    'unusable'])
+
+class FormatError(Exception):
+    pass
+
+def append(path, sample, interval):
+    """Add sample to the series at path, creating it if needed."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as series_file:
+        size = series_file.tell()
+        if size == 0:
+            series_file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, interval))
+        elif (size - HEADER.size) % RECORD.size:
+            series_file.truncate(size - (size - HEADER.size) % RECORD.size)
+        series_file.write(RECORD.pack(*sample))
+
+class Series:
+    """Read-only, memory-mapped view of a series file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as series_file:
+            if os.fstat(series_file.fileno()).st_size < HEADER.size:
+                raise FormatError('{} has no header.'.format(path))
+            self.map = mmap.mmap(series_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.interval = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.map.close()
+            raise FormatError('{} is not a version {} series.'.format(path,
+                                                                      VERSION))
+        self.count = (len(self.map) - HEADER.size) // RECORD.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.map.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return Sample(*RECORD.unpack_from(self.map,
+                                          HEADER.size + index * RECORD.size))
+
+    def time_at(self, index):
+        return TIME.unpack_from(self.map, HEADER.size + index * RECORD.size)[0]
+
+    def index_at(self, time):
+        """Index of the first sample taken at or after time."""
+        return bisect.bisect_left(SampleTimes(self), time)
+
+    def samples(self, start_index=0):
+        for index in range(start_index, self.count):
+            yield self[index]
+
+class SampleTimes:
+    """Sequence of sample times for bisect, read from the map on demand."""
+
+    def __init__(self, series):
+        self.series = series
+
+    def __len__(self):
+        return len(self.series)
+
+    def __getitem__(self, index):
+        return self.series.time_at(index)
@@ -0,0 +1,91 @@
+"""Opt-in on-disk cache of AAD access tokens.
+
+Tokens are keyed by (directory id, app id, resource) and kept in an owner-only
+file in the cache directory. A cached token that is not about to expire is used
+as-is, so a cache hit makes no call to login.microsoftonline.com.
+"""
+import logging
+import time
+
+from azure.common.credentials import ServicePrincipalCredentials
+from msrest.authentication import BasicTokenAuthentication
+
+import cli.cache_file
+import cli.trace
+
+LOGGER = logging.getLogger(__name__)
+TOKEN_CACHE_FILE = 'aad_tokens.json'
+MANAGEMENT_RESOURCE = 'https://management.core.windows.net/'
+# refresh tokens this many seconds before they expire
+REFRESH_MARGIN = 300
+
+class CachedTokenCredentials(BasicTokenAuthentication):
+    """Bearer token credentials that go back to the cache once the token nears expiry."""
+
+    def __init__(self, token, refresh):
+        super(CachedTokenCredentials, self).__init__(token)
+        self._refresh = refresh
+
+    def signed_session(self, session=None):
+        if not token_is_fresh(self.token):
+            self.token = self._refresh()
+        return super(CachedTokenCredentials, self).signed_session(session)
+
+@cli.trace.traced
+def get_credentials(aad_directory_id, aad_app_id, aad_key, cache_dir=None,
+                    resource=MANAGEMENT_RESOURCE):
+    """Credentials for the AAD app, served from the token cache if cache_dir is set."""
+    if cache_dir is None:
+        return create_service_principal(aad_directory_id, aad_app_id, aad_key,
+                                        resource)
+    path = cli.cache_file.cache_path(cache_dir, TOKEN_CACHE_FILE)
+
+    def refresh():
+        return cached_token(path, aad_directory_id, aad_app_id, aad_key,
+                            resource)
+    return CachedTokenCredentials(refresh(), refresh)
+
+def cached_token(path, aad_directory_id, aad_app_id, aad_key, resource):
+    """Return a fresh token from path, fetching and storing one on a miss.
+
+    The cache lock is held across the fetch so concurrent processes that miss
+    at the same time fetch the token once.
+    """
+    key = cache_key(aad_directory_id, aad_app_id, resource)
+    with cli.cache_file.locked(path):
+        tokens = cli.cache_file.read(path)
+        token = tokens.get(key)
+        if token and token_is_fresh(token):
+            LOGGER.debug('Using cached AAD token for app %s.', aad_app_id)
+            return token
+        token = fetch_token(aad_directory_id, aad_app_id, aad_key, resource)
+        tokens = {k: v for k, v in tokens.items() if token_is_fresh(v, margin=0)}
+        tokens[key] = token
+        cli.cache_file.write(path, tokens)
+    return token
+
+def fetch_token(aad_directory_id, aad_app_id, aad_key, resource):
+    credentials = create_service_principal(aad_directory_id, aad_app_id,
+                                           aad_key, resource)
+    return {
+        'access_token': credentials.token['access_token'],
+        'expires_on': float(credentials.token['expires_on'])
+    }
+
+def create_service_principal(aad_directory_id, aad_app_id, aad_key, resource):
+    aad_token_uri = 'https://login.microsoftonline.com/{0}/oauth2/token'.format(
+        aad_directory_id)
+    return ServicePrincipalCredentials(client_id=aad_app_id,
+                                       secret=aad_key,
+                                       token_uri=aad_token_uri,
+                                       resource=resource)
+
+def cache_key(aad_directory_id, aad_app_id, resource):
+    return '{}|{}|{}'.format(aad_directory_id, aad_app_id, resource)
+
+def token_is_fresh(token, margin=REFRESH_MARGIN, now=None):
+    now = time.time() if now is None else now
+    try:
+        return float(token['expires_on']) - margin > now
+    except (KeyError, TypeError, ValueError):
+        return False
@@ -0,0 +1,212 @@
+"""Spans of command phases and Azure calls, for --profile and --trace-file.
+
+Functions decorated with traced record a phase span each time they run, and
+every HTTP request sent through requests, from the management clients, the
+storage SDK and blobxfer alike, records a span with its status, retries and
+bytes moved. Spans are written as Chrome trace events, which chrome://tracing
+and Perfetto open, and --profile logs them summed up by name.
+
+Tracing is off unless started: traced functions then cost one global lookup
+per call, and requests is only patched while a trace is running.
+"""
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+
+LOGGER = logging.getLogger(__name__)
+PHASE = 'phase'
+HTTP = 'http'
+# storage hosts end with this; anything else is Azure Resource Manager or AAD
+STORAGE_SUFFIX = '.core.windows.net'
+PROFILE_ROWS = 25
+TRACER = None
+# requests.Session.send as it was before tracing started
+UNTRACED_SEND = None
+
+class Tracer:
+    """Chrome trace events of one command."""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.pid = os.getpid()
+        self.events = []
+        self.thread_names = {}
+
+    @contextlib.contextmanager
+    def span(self, name, category, args):
+        start = self.clock()
+        try:
+            yield args
+        except Exception as error:
+            args['error'] = type(error).__name__
+            raise
+        finally:
+            self.add(name, category, start, self.clock(), args)
+
+    def add(self, name, category, start, end, args):
+        thread = threading.current_thread()
+        self.thread_names[thread.ident] = thread.name
+        # list.append is atomic, so spans from worker threads need no lock
+        self.events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self.started) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1),
+            'pid': self.pid,
+            'tid': thread.ident,
+            'args': args
+        })
+
+    def trace(self):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                     'tid': tid, 'args': {'name': name}}
+                    for tid, name in self.thread_names.items()]
+        return {'traceEvents': metadata + sorted(self.events,
+                                                 key=lambda event: event['ts']),
+                'displayTimeUnit': 'ms'}
+
+@contextlib.contextmanager
+def untraced(args):
+    # contextlib.nullcontext is Python 3.7+
+    yield args
+
+def span(name, category=PHASE, **args):
+    """Record the block as a span of the running trace, if there is one."""
+    tracer = TRACER
+    if tracer is None:
+        return untraced(args)
+    return tracer.span(name, category, args)
+
+def traced(function):
+    """Record every call of function as a phase named after it."""
+    name = '{}.{}'.format(function.__module__, function.__name__)
+
+    @functools.wraps(function)
+    def traced_function(*args, **kwargs):
+        tracer = TRACER
+        if tracer is None:
+            return function(*args, **kwargs)
+        with tracer.span(name, PHASE, {}):
+            return function(*args, **kwargs)
+
+    return traced_function
+
+def start(clock=time.perf_counter):
+    global TRACER, UNTRACED_SEND
+    TRACER = Tracer(clock)
+    if requests.Session.send is not traced_send:
+        UNTRACED_SEND = requests.Session.send
+        requests.Session.send = traced_send
+    return TRACER
+
+def stop():
+    """Stop tracing and return the tracer that ran."""
+    global TRACER
+    tracer, TRACER = TRACER, None
+    if requests.Session.send is traced_send:
+        requests.Session.send = UNTRACED_SEND
+    return tracer
+
+def traced_send(session, request, **kwargs):
+    """Session.send, recording a span that includes reading unstreamed bodies."""
+    tracer = TRACER
+    if tracer is None:
+        return UNTRACED_SEND(session, request, **kwargs)
+    # query strings can carry SAS signatures, so only the path is kept
+    url = urllib.parse.urlsplit(request.url)
+    args = {'method': request.method, 'host': url.hostname, 'path': url.path,
+            'bytes_sent': body_size(request.body)}
+    with tracer.span(operation_name(request.method, url), HTTP, args):
+        response = UNTRACED_SEND(session, request, **kwargs)
+        args['status'] = response.status_code
+        args['retries'] = retry_count(response)
+        args['bytes_received'] = received_size(request.method, response)
+    return response
+
+def body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    return None
+
+def received_size(method, response):
+    if method == 'HEAD':
+        return 0
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+def retry_count(response):
+    retries = getattr(response.raw, 'retries', None)
+    return len(getattr(retries, 'history', ()) or ())
+
+def operation_name(method, url):
+    """A name shared by every call of the same API, without resource names.
+
+    ARM calls are named after the resource types and action in their path,
+    such as POST Microsoft.Storage/storageAccounts/listKeys, and storage calls
+    after their service and comp, such as PUT blob block.
+    """
+    hostname = url.hostname or ''
+    query = urllib.parse.parse_qs(url.query)
+    if hostname.endswith(STORAGE_SUFFIX):
+        service = hostname[:-len(STORAGE_SUFFIX)].rpartition('.')[2]
+        return ' '.join([method, service] + query.get('restype', [])
+                        + query.get('comp', []))
+    segments = [segment for segment in url.path.split('/') if segment]
+    lowered = [segment.lower() for segment in segments]
+    if 'providers' in lowered:
+        # a namespace, then type and name pairs, then maybe an action
+        provider = segments[lowered.index('providers') + 1:]
+        return '{} {}'.format(method, '/'.join(provider[:1] + provider[1::2]))
+    if lowered[:1] == ['subscriptions']:
+        return '{} {}'.format(method, '/'.join(segments[::2]))
+    # AAD token requests and anything else
+    return '{} {}'.format(method, hostname)
+
+def summarize(tracer):
+    """Count, seconds, retries and bytes per span name, slowest first."""
+    rows = {}
+    for event in tracer.events:
+        row = rows.setdefault((event['cat'], event['name']), {
+            'category': event['cat'], 'name': event['name'], 'count': 0,
+            'seconds': 0.0, 'retries': 0, 'bytes_sent': 0,
+            'bytes_received': 0})
+        row['count'] += 1
+        row['seconds'] += event['dur'] / 1e6
+        for key in ['retries', 'bytes_sent', 'bytes_received']:
+            row[key] += event['args'].get(key) or 0
+    return sorted(rows.values(), key=lambda row: -row['seconds'])
+
+def log_profile(tracer):
+    LOGGER.info('%-6s %-52s %6s %9s %7s %10s %10s', 'kind', 'span', 'count',
+                'seconds', 'retries', 'MB sent', 'MB recv')
+    for row in summarize(tracer)[:PROFILE_ROWS]:
+        LOGGER.info('%-6s %-52s %6d %9.3f %7d %10.2f %10.2f', row['category'],
+                    row['name'][:52], row['count'], row['seconds'],
+                    row['retries'], row['bytes_sent'] / 1e6,
+                    row['bytes_received'] / 1e6)
+
+def finish(command, trace_file=None, profile=False):
+    """Stop tracing, closing the span of the whole command, and report."""
+    tracer = TRACER
+    if tracer is None:
+        return
+    tracer.add(command, PHASE, tracer.started, tracer.clock(), {})
+    stop()
+    if profile:
+        log_profile(tracer)
+    if trace_file:
+        with open(trace_file, 'w') as trace:
+            json.dump(tracer.trace(), trace)
+        LOGGER.info('Wrote trace of %d spans to %s.', len(tracer.events),
+                    trace_file)
@@ -0,0 +1,113 @@
+"""Choice of blobxfer thread counts and chunk sizes for a transfer.
+
+In auto mode the plan starts from the file count and size distribution of the
+transfer, kept within a CPU and memory budget:
+
+* many small files are bound by per-request latency, so they get many
+  transfer threads and the smallest chunks;
+* few large files are bound by bandwidth, so they get larger chunks and only
+  as many threads as the memory budget allows.
+
+blobxfer fixes its thread pools when a transfer starts, so throughput is
+probed across runs instead of during one: the achieved MB/s of each run is
+kept in the cache directory, and the next run of the same kind steps the
+transfer threads up while that improves throughput and back once it stops.
+"""
+import collections
+import logging
+import math
+import os
+import statistics
+
+import cli.cache_file
+
+LOGGER = logging.getLogger(__name__)
+TUNING_CACHE_FILE = 'transfer_tuning.json'
+MiB = 1024 * 1024
+SMALL_FILE_BYTES = 256 * 1024
+# Azure Files caps a single range write at 4 MiB
+MAX_FILE_RANGE_BYTES = 4 * MiB
+MAX_BLOCK_BYTES = 100 * MiB
+MIN_CHUNK_BYTES = 4 * MiB
+MAX_TRANSFER_THREADS = 512
+# relative MB/s change that counts as better or worse than the last run
+THROUGHPUT_TOLERANCE = 0.05
+THREAD_STEP = 1.5
+
+TransferPlan = collections.namedtuple(
+    'TransferPlan', ['disk_threads', 'transfer_threads', 'chunk_size_bytes'])
+
+def default_cpu_budget():
+    return os.cpu_count() or 1
+
+def plan_transfer(sizes, cpu_budget, memory_budget_bytes, max_chunk_bytes):
+    """Pick thread counts and a chunk size for files of the given sizes."""
+    if not sizes:
+        return TransferPlan(cpu_budget, cpu_budget * 4, MIN_CHUNK_BYTES)
+    median_size = statistics.median(sizes)
+    largest = max(sizes)
+    if median_size <= SMALL_FILE_BYTES:
+        chunk_size = MIN_CHUNK_BYTES
+        transfer_threads = cpu_budget * 32
+        disk_threads = cpu_budget * 4
+    else:
+        # aim for roughly eight chunks of the largest file in flight at once
+        chunk_size = clamp(round_up(largest / 8, MiB), MIN_CHUNK_BYTES,
+                           max_chunk_bytes)
+        transfer_threads = cpu_budget * 4
+        disk_threads = cpu_budget
+    chunk_size = min(chunk_size, max_chunk_bytes)
+    # every transfer and disk thread can hold one chunk in memory
+    memory_threads = max(memory_budget_bytes // chunk_size, 2)
+    transfer_threads = clamp(transfer_threads, 1,
+                             min(len(sizes) * max(largest // chunk_size, 1),
+                                 memory_threads - 1, MAX_TRANSFER_THREADS))
+    disk_threads = clamp(disk_threads, 1,
+                         max(memory_threads - transfer_threads, 1))
+    return TransferPlan(int(disk_threads), int(transfer_threads), int(chunk_size))
+
+def adjust_for_history(plan, history, memory_budget_bytes):
+    """Step transfer threads based on the throughput of earlier runs."""
+    if not history:
+        return plan
+    last, previous = history[-1], history[-2] if len(history) > 1 else None
+    transfer_threads = last['transfer_threads']
+    if previous is None:
+        transfer_threads = transfer_threads * THREAD_STEP
+    elif last['mbps'] > previous['mbps'] * (1 + THROUGHPUT_TOLERANCE):
+        # the last change helped, keep going in the same direction
+        if last['transfer_threads'] >= previous['transfer_threads']:
+            transfer_threads = transfer_threads * THREAD_STEP
+        else:
+            transfer_threads = transfer_threads / THREAD_STEP
+    elif last['mbps'] < previous['mbps'] * (1 - THROUGHPUT_TOLERANCE):
+        transfer_threads = previous['transfer_threads']
+    max_threads = min(max(memory_budget_bytes // plan.chunk_size_bytes - 1, 1),
+                      MAX_TRANSFER_THREADS)
+    return plan._replace(
+        transfer_threads=int(clamp(math.ceil(transfer_threads), 1, max_threads)))
+
+def load_history(cache_dir, tuning_key):
+    path = cli.cache_file.cache_path(cache_dir, TUNING_CACHE_FILE)
+    return cli.cache_file.read(path).get(tuning_key, [])
+
+def record_run(cache_dir, tuning_key, plan, total_bytes, seconds):
+    """Log and remember the throughput a plan achieved."""
+    mbps = total_bytes / MiB / seconds if seconds > 0 else 0.0
+    LOGGER.info('Transferred %.1f MB in %.1fs (%.1f MB/s) with %d transfer '
+                'threads, %d disk threads and %d MiB chunks.',
+                total_bytes / MiB, seconds, mbps, plan.transfer_threads,
+                plan.disk_threads, plan.chunk_size_bytes // MiB)
+    path = cli.cache_file.cache_path(cache_dir, TUNING_CACHE_FILE)
+    with cli.cache_file.locked(path):
+        history = cli.cache_file.read(path)
+        runs = history.get(tuning_key, [])[-1:]
+        runs.append({'transfer_threads': plan.transfer_threads, 'mbps': mbps})
+        history[tuning_key] = runs
+        cli.cache_file.write(path, history)
+
+def clamp(value, lowest, highest):
+    return max(lowest, min(value, highest))
+
+def round_up(value, multiple):
+    return int(math.ceil(value / multiple) * multiple)
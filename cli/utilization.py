@@ -0,0 +1,171 @@
+"""Recording node counts of clusters and reporting how they were used.
+
+`cluster record` appends one cli.timeseries sample per cluster and interval to
+<data dir>/<resource group>/<workspace>/<cluster>.series. `cluster report`
+treats each sample as holding until the next one and integrates over a time
+window, reading only the samples inside it:
+
+* node-hours per state (allocated, idle, running, preparing, leaving,
+  unusable) and utilization, running over allocated node-hours;
+* scale-up latency, from a sample where the target grew to the first sample
+  where idle plus running nodes reached the target.
+
+A sample holds for at most two sampling intervals, so time the recorder was
+not running counts as unobserved rather than as the last known state.
+"""
+import datetime
+import fnmatch
+import json
+import logging
+import os
+import re
+import statistics
+import time
+
+import cli.cluster_status
+import cli.timeseries
+import cli.utils
+
+LOGGER = logging.getLogger(__name__)
+TIMESERIES_DIR = 'timeseries'
+SERIES_SUFFIX = '.series'
+SECONDS_PER_HOUR = 3600.0
+# how many sampling intervals a sample may hold for
+MAX_GAP_INTERVALS = 2
+STATES = ['current', 'idle', 'running', 'preparing', 'leaving', 'unusable']
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+REPORT_COLUMNS = ['cluster', 'observed_hours', 'allocated_node_hours',
+                  'idle_node_hours', 'running_node_hours', 'utilization',
+                  'scale_ups', 'scale_up_median_s', 'scale_up_max_s']
+
+def series_path(data_dir, resource_group, workspace, cluster_name):
+    return os.path.join(data_dir, resource_group, workspace,
+                        cluster_name + SERIES_SUFFIX)
+
+def sample_from_row(now, row):
+    return cli.timeseries.Sample(now, *(row[field] or 0 for field in
+                                        ['target'] + STATES))
+
+def record(context, targets, data_dir, interval, samples=None,
+           sleep=time.sleep, clock=time.time):
+    """Sample the targeted clusters every interval seconds."""
+    taken = 0
+    while samples is None or taken < samples:
+        started = clock()
+        rows = cli.cluster_status.fetch_rows(context, targets)
+        recorded = 0
+        for row in rows:
+            if row['allocation_state'] == cli.cluster_status.NOT_FOUND:
+                continue
+            cli.timeseries.append(
+                series_path(data_dir, context.obj['resource_group'],
+                            row['workspace'], row['name']),
+                sample_from_row(started, row), interval)
+            recorded += 1
+        taken += 1
+        LOGGER.info('Recorded node counts of %d clusters.', recorded)
+        if samples is None or taken < samples:
+            sleep(max(interval - (clock() - started), 0))
+
+def recorded_clusters(data_dir, resource_group, targets):
+    """(workspace/cluster, path) of recorded series matching targets."""
+    patterns = cli.cluster_status.parse_targets(targets) if targets else None
+    root = os.path.join(data_dir, resource_group)
+    if not os.path.isdir(root):
+        return []
+    found = []
+    for workspace in sorted(os.listdir(root)):
+        directory = os.path.join(root, workspace)
+        if patterns is not None and workspace not in patterns:
+            continue
+        for file_name in sorted(os.listdir(directory)):
+            if not file_name.endswith(SERIES_SUFFIX):
+                continue
+            name = file_name[:-len(SERIES_SUFFIX)]
+            if patterns is None or any(fnmatch.fnmatchcase(name, pattern)
+                                       for pattern in patterns[workspace]):
+                found.append(('{}/{}'.format(workspace, name),
+                              os.path.join(directory, file_name)))
+    return found
+
+def report(context, targets, data_dir, start, end,
+           output_format=cli.cluster_status.TABLE):
+    """Print utilization of the recorded clusters between start and end."""
+    rows = []
+    for name, path in recorded_clusters(data_dir, context.obj['resource_group'],
+                                        targets):
+        with cli.timeseries.Series(path) as series:
+            usage = summarize(series, start, end)
+        usage['cluster'] = name
+        rows.append(usage)
+    if output_format == cli.cluster_status.JSON:
+        print(json.dumps({'start': start, 'end': end, 'clusters': rows},
+                         indent=2, sort_keys=True))
+    else:
+        print(format_report(rows))
+    return rows
+
+def summarize(series, start, end):
+    """Node-hours per state, utilization and scale-up latency in [start, end)."""
+    max_gap = series.interval * MAX_GAP_INTERVALS
+    node_seconds = dict.fromkeys(STATES, 0.0)
+    observed = 0.0
+    latencies = []
+    previous, scaling_since = None, None
+    # the sample before the window gives the state at its start
+    for sample in series.samples(max(series.index_at(start) - 1, 0)):
+        if sample.time >= end:
+            break
+        if previous is not None:
+            observed += accumulate(node_seconds, previous, sample.time, start,
+                                   end, max_gap)
+            if sample.target > previous.target and sample.time >= start:
+                scaling_since = scaling_since or sample.time
+        if scaling_since is not None and \
+                sample.idle + sample.running >= sample.target:
+            latencies.append(sample.time - scaling_since)
+            scaling_since = None
+        previous = sample
+    if previous is not None:
+        observed += accumulate(node_seconds, previous, end, start, end, max_gap)
+    allocated = node_seconds['current']
+    usage = {'observed_hours': observed / SECONDS_PER_HOUR,
+             'utilization': node_seconds['running'] / allocated if allocated else None,
+             'scale_ups': len(latencies),
+             'scale_up_median_s': statistics.median(latencies) if latencies else None,
+             'scale_up_max_s': max(latencies) if latencies else None}
+    for state in STATES:
+        key = 'allocated' if state == 'current' else state
+        usage[key + '_node_hours'] = node_seconds[state] / SECONDS_PER_HOUR
+    return usage
+
+def accumulate(node_seconds, sample, next_time, start, end, max_gap):
+    """Add sample's node counts held until next_time, clipped to the window."""
+    held_until = min(next_time, sample.time + max_gap, end)
+    seconds = held_until - max(sample.time, start)
+    if seconds <= 0:
+        return 0.0
+    for state in STATES:
+        node_seconds[state] += getattr(sample, state) * seconds
+    return seconds
+
+def parse_time(value, now=None):
+    """Seconds since the epoch from ISO 8601, 'now', or a duration ago (24h)."""
+    now = time.time() if now is None else now
+    if value == 'now':
+        return now
+    duration = re.match(r'^(\d+(?:\.\d+)?)([smhd])$', value)
+    if duration:
+        return now - float(duration.group(1)) * DURATION_UNITS[duration.group(2)]
+    parsed = datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+    return parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def format_report(rows):
+    return cli.utils.format_table(REPORT_COLUMNS, rows, format_value)
+
+def format_value(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return str(value)
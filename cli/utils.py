@@ -1,3 +1,5 @@
+import types
+
 def already_exists(resource_type, resource_name):
     return '{} {} already exists.'.format(resource_type, resource_name)
 
@@ -13,3 +15,19 @@ def deleted(resource_type, resource_name):
 
 def does_not_exist(resource_type, resource_name):
     return '{} {} does not exist in Azure'.format(resource_type, resource_name)
+
+def child_context(context, **values):
+    """A context sharing the clients and caches in context.obj, with values set."""
+    return types.SimpleNamespace(obj=dict(context.obj, **values))
+
+def format_table(columns, rows, format_cell):
+    """Rows as left-aligned columns under a header, each cell through
+    format_cell.
+    """
+    cells = [columns] + [[format_cell(row[column]) for column in columns]
+                         for row in rows]
+    widths = [max(len(row[index]) for row in cells)
+              for index in range(len(columns))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width
+                               in zip(row, widths)).rstrip()
+                     for row in cells)
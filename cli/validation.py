@@ -40,6 +40,45 @@ def validate_cluster_name(context, param, value):
 def validate_workspace_name(context, param, value):
     return regex_matches(REGEX_DICT['workspace'], value, 'Names can only contain a combination of alphanumeric characters along with dash (-) and underscore (_). The name must be from 1 through 64 characters long.')
 
+def validate_prefix(context, param, value):
+    """A virtual directory: without leading or trailing slashes, no empty,
+    . or .. parts.
+    """
+    if value is None:
+        return None
+    prefix = value.strip('/')
+    if not prefix or any(part in ('', '.', '..') for part in prefix.split('/')):
+        raise click.BadParameter('Prefix must be a path like runs/42, without '
+                                 'empty, . or .. parts.')
+    return prefix
+
+def validate_destinations(validate_name):
+    """Callback for ACCOUNT/NAME[/PREFIX] values, with validate_name checking
+    the container or fileshare name.
+    """
+    def validate(context, param, values):
+        destinations = []
+        for value in values:
+            parts = value.split('/', 2)
+            if len(parts) < 2:
+                raise click.BadParameter(
+                    '{} is not ACCOUNT/NAME[/PREFIX].'.format(value))
+            validate_storage_name(context, param, parts[0])
+            validate_name(context, param, parts[1])
+            if len(parts) > 2:
+                parts[2] = validate_prefix(context, param, parts[2])
+            destinations.append('/'.join(parts))
+        return tuple(destinations)
+    return validate
+
+def optional(validate):
+    """Callback that runs validate only when the option was given."""
+    def validate_if_given(context, param, value):
+        if value is None:
+            return None
+        return validate(context, param, value)
+    return validate_if_given
+
 def regex_matches(pattern, value, bad_param_message):
     pattern = re.compile(pattern)
     if pattern.match(value):
@@ -1,19 +1,106 @@
+"""pybatchai command line.
+
+Only click and the validation callbacks are imported at module load. Each
+command imports the cli modules, and through them the Azure SDKs, that it
+needs when it runs, so --help and parameter errors stay fast.
+"""
 import logging
 
-from azure.common.credentials import ServicePrincipalCredentials
-import azure.mgmt.batchai as training
-from msrestazure.azure_cloud import AZURE_PUBLIC_CLOUD
 import click
-import coloredlogs
 
-import cli.blob_storage
-import cli.cluster
 import cli.constants
-import cli.fileshare
-import cli.resource_group
-import cli.storage
 import cli.validation
 
+def transfer_options(command):
+    """Options shared by every upload and download command."""
+    command = click.option(
+        '--dedup', is_flag=True,
+        help='store each distinct file once, by content digest')(command)
+    command = click.option(
+        '--shard-size-mb', default=64, type=click.IntRange(min=1),
+        help='with --pack, approximate size of each archive')(command)
+    command = click.option(
+        '--pack', is_flag=True,
+        help='transfer the tree as tar shards plus an index')(command)
+    command = click.option(
+        '--delete', is_flag=True,
+        help='with --sync, delete files missing on the sending side')(command)
+    command = click.option(
+        '--sync', is_flag=True,
+        help='only transfer files that changed since the last sync')(command)
+    command = click.option(
+        '--prefix', callback=cli.validation.validate_prefix,
+        help='remote virtual directory to transfer to or from')(command)
+    command = click.option(
+        '--exclude', multiple=True,
+        help='skip paths matching this pattern, may be repeated')(command)
+    command = click.option(
+        '--include', multiple=True,
+        help='only transfer paths matching this pattern, may be repeated')(command)
+    command = click.option(
+        '--memory-budget-mb', default=1024, type=click.IntRange(min=64),
+        help='memory auto concurrency may use for buffers')(command)
+    command = click.option(
+        '--cpu-budget', type=click.IntRange(min=1),
+        help='cores auto concurrency may use, defaults to all')(command)
+    command = click.option(
+        '--engine', default='blobxfer', type=click.Choice(['blobxfer', 'async']),
+        help='blobxfer, or one event loop for many small files')(command)
+    command = click.option(
+        '--concurrency', default='fixed', type=click.Choice(['fixed', 'auto']),
+        help='fixed thread counts, or fit them to the files being moved')(command)
+    return command
+
+def tail_options(command):
+    """Options shared by fileshare tail and job logs."""
+    command = click.option(
+        '--resume', is_flag=True,
+        help='start where the last --resume run stopped')(command)
+    command = click.option(
+        '--lines', default=10, type=click.IntRange(min=0),
+        help='lines to show from the end of each file first')(command)
+    command = click.option(
+        '--follow', '-f', is_flag=True,
+        help='keep showing output as it is written')(command)
+    return command
+
+def run_tail(context: object, files: object, follow: bool, lines: int,
+             resume: bool, finished: object = None) -> None:
+    import cli.tail
+
+    offsets = (cli.tail.load_offsets(context.obj['cache_dir'], files.key)
+               if resume else {})
+    try:
+        cli.tail.tail(files, offsets, lines, follow, finished)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if resume:
+            cli.tail.save_offsets(context.obj['cache_dir'], files.key, offsets)
+
+def set_transfer_options(context: object, local_path: str, options: dict) -> None:
+    if options['delete'] and not options['sync']:
+        raise click.UsageError('--delete requires --sync.')
+    if options['pack'] and options['sync']:
+        raise click.UsageError('--pack cannot be combined with --sync.')
+    if options.get('compress') and options['pack']:
+        raise click.UsageError('--compress cannot be combined with --pack.')
+    if options.get('member') and not options['pack']:
+        raise click.UsageError('--member requires --pack.')
+    if options['pack'] and (options['include'] or options['exclude']
+                            or options['prefix']):
+        raise click.UsageError(
+            '--include, --exclude and --prefix cannot be combined with --pack.')
+    if options['dedup'] and (options['pack'] or options['sync']
+                             or options.get('compress')):
+        raise click.UsageError(
+            '--dedup cannot be combined with --pack, --sync or --compress.')
+    if options['delete'] and (options['include'] or options['exclude']):
+        raise click.UsageError(
+            '--delete cannot be combined with --include or --exclude.')
+    context.obj['local_path'] = local_path
+    context.obj['transfer_options'] = options
+
 @click.group()
 @click.option('--subscription-id', required=True,
               callback=cli.validation.validate_uuid)
@@ -26,6 +113,25 @@ import cli.validation
 @click.option('--aad-key', required=True)
 @click.option('--aad-directory-id', required=True,
               callback=cli.validation.validate_uuid)
+@click.option('--token-cache', is_flag=True,
+              help='reuse AAD tokens cached on disk across invocations')
+@click.option('--cache-dir', default=cli.constants.CACHE_DIR,
+              type=click.Path(file_okay=False),
+              help='directory for pybatchai caches')
+@click.option('--state-ttl', default=0, type=click.IntRange(min=0),
+              help='seconds to trust cached resource existence checks')
+@click.option('--key-cache-ttl', default=0, type=click.IntRange(min=0),
+              help='seconds to keep storage account keys in an encrypted cache')
+@click.option('--http-pool-size', default=32, type=click.IntRange(min=1),
+              help='connections kept open to Azure Resource Manager')
+@click.option('--http-retries', default=3, type=click.IntRange(min=0),
+              help='retries of failed Azure Resource Manager requests')
+@click.option('--http-backoff', default=0.8, type=click.FloatRange(min=0),
+              help='backoff factor in seconds between those retries')
+@click.option('--profile', is_flag=True,
+              help='log time, retries and bytes per phase and Azure call')
+@click.option('--trace-file', type=click.Path(dir_okay=False, writable=True),
+              help='write phase and Azure call spans as a Chrome trace')
 @click.pass_context
 def main(
         context: object,
@@ -34,7 +140,16 @@ def main(
         location: str,
         aad_app_id: str,
         aad_key: str,
-        aad_directory_id: str
+        aad_directory_id: str,
+        token_cache: bool,
+        cache_dir: str,
+        state_ttl: int,
+        key_cache_ttl: int,
+        http_pool_size: int,
+        http_retries: int,
+        http_backoff: float,
+        profile: bool,
+        trace_file: str
     ) -> None:
     """A Python tool for Batch AI.
 
@@ -53,21 +168,63 @@ def main(
     https://github.com/Azure/BatchAI/blob/master/recipes/Preparation.md#using-portal
     """
 
+    settings = {
+        'subscription_id': subscription_id,
+        'resource_group': resource_group,
+        'location': location,
+        'aad_app_id': aad_app_id,
+        'aad_key': aad_key,
+        'aad_directory_id': aad_directory_id,
+        'token_cache': token_cache,
+        'cache_dir': cache_dir,
+        'state_ttl': state_ttl,
+        'key_cache_ttl': key_cache_ttl,
+        'http_pool_size': http_pool_size,
+        'http_retries': http_retries,
+        'http_backoff': http_backoff
+    }
+    if profile or trace_file:
+        import cli.trace
+
+        cli.trace.start()
+        context.call_on_close(lambda: cli.trace.finish(
+            'pybatchai {}'.format(context.invoked_subcommand), trace_file, profile))
+    # cli.daemon.WarmObjects when the daemon runs the command
+    warm = context.obj
+    if warm is not None:
+        context.obj = warm.lookup(settings)
+        if context.obj is not None:
+            return
+
+    import coloredlogs
+    import cli.resource_group
+    import cli.token_cache
+
     coloredlogs.install()
     logging.basicConfig(level=logging.INFO)
 
-    aad_token_uri = 'https://login.microsoftonline.com/{0}/oauth2/token'.format(aad_directory_id)
-    credentials = ServicePrincipalCredentials(client_id=aad_app_id,
-                                              secret=aad_key,
-                                              token_uri=aad_token_uri)
+    credentials = cli.token_cache.get_credentials(
+        aad_directory_id, aad_app_id, aad_key,
+        cache_dir=cache_dir if token_cache else None)
     context.obj = {
         'subscription_id': subscription_id,
         'resource_group': resource_group,
         'location': location,
-        'aad_credentials': credentials
+        'aad_credentials': credentials,
+        'aad_app_id': aad_app_id,
+        'aad_key': aad_key,
+        'cache_dir': cache_dir,
+        'state_ttl': state_ttl,
+        'key_cache_ttl': key_cache_ttl,
+        'http_pool_size': http_pool_size,
+        'http_retries': http_retries,
+        'http_backoff': http_backoff,
+        'settings': settings
     }
 
     cli.resource_group.create_rg_if_not_exists(context)
+    if warm is not None:
+        context.obj = warm.keep(context.obj)
 
 @main.group()
 @click.option('--name', required=True, help='storage account name',
@@ -78,8 +235,11 @@ def storage(
         name: str
     ) -> None:
     """Storage options."""
+    import cli.clients
+    import cli.storage
+
     context.obj['storage_account'] = name
-    cli.storage.set_storage_client(context)
+    cli.clients.set_storage_client(context)
     valid_storage_acct = cli.storage.create_acct_if_not_exists(context)
     if not valid_storage_acct:
         return
@@ -94,32 +254,67 @@ def fileshare(
         name: str
     ) -> None:
     """Fileshare."""
+    import cli.fileshare
+
     context.obj['fileshare'] = name
+    cli.fileshare.set_fileshare_service(context)
 
 @fileshare.command(name='upload')
 @click.option('--local-path', required=True, type=click.Path(exists=True),
               help='upload files or a directory at this path')
+@transfer_options
 @click.pass_context
 def upload_to_fileshare(
         context: object,
-        local_path: str
+        local_path: str,
+        **options
     ) -> None:
     """Upload directory or file to fileshare."""
-    context.obj['local_path'] = local_path
+    import cli.fileshare
+
+    set_transfer_options(context, local_path, options)
     cli.fileshare.upload(context)
 
 @fileshare.command(name='download')
 @click.option('--local-path', required=True, type=click.Path(),
               help='download files or a directory at this path')
+@click.option('--member', multiple=True,
+              help='with --pack, only download this packed file')
+@transfer_options
 @click.pass_context
 def download_fileshare(
         context: object,
-        local_path: str
+        local_path: str,
+        **options
     ) -> None:
     """Download directory or file from fileshare."""
-    context.obj['local_path'] = local_path
+    import cli.fileshare
+
+    set_transfer_options(context, local_path, options)
     cli.fileshare.download(context)
 
+@fileshare.command(name='tail')
+@click.argument('paths', nargs=-1, required=True)
+@tail_options
+@click.pass_context
+def tail_fileshare(
+        context: object,
+        paths: tuple,
+        follow: bool,
+        lines: int,
+        resume: bool
+    ) -> None:
+    """Show the end of files in the fileshare, optionally following them.
+
+    PATHS are files or directories in the fileshare; directories are followed
+    with every file below them.
+    """
+    import cli.tail
+
+    files = cli.tail.FileshareFiles(context.obj['fileshare_service'],
+                                    context.obj['fileshare'], paths)
+    run_tail(context, files, follow, lines, resume)
+
 @storage.group()
 @click.option('--container', required=True, help='container name',
               callback=cli.validation.validate_container_name)
@@ -129,36 +324,53 @@ def blobstorage(
         container: str
     ) -> None:
     """Blob Storage."""
+    import cli.blob_storage
+
     cli.blob_storage.set_blob_storage_service(context)
     context.obj['container_name'] = container
 
 @blobstorage.command(name='upload')
 @click.option('--local-path', required=True, type=click.Path(exists=True))
+@click.option('--compress', is_flag=True,
+              help='gzip files that compress well, served with Content-Encoding')
+@click.option('--compress-level', default=1, type=click.IntRange(min=1, max=9),
+              help='with --compress, gzip level from 1 (fastest) to 9')
+@transfer_options
 @click.pass_context
 def upload_to_blob_container(
         context: object,
-        local_path: str
+        local_path: str,
+        **options
     ) -> None:
     """Upload directory or file to blob container."""
-    context.obj['local_path'] = local_path
+    import cli.blob_storage
+
+    set_transfer_options(context, local_path, options)
     cli.blob_storage.upload(context)
 
 @blobstorage.command(name='download')
 @click.option('--local-path', required=True, type=click.Path())
+@click.option('--member', multiple=True,
+              help='with --pack, only download this packed file')
+@transfer_options
 @click.pass_context
 def download_from_blob_container(
         context: object,
-        local_path: str
+        local_path: str,
+        **options
     ) -> None:
     """Download directory or file from blob container."""
-    context.obj['local_path'] = local_path
+    import cli.blob_storage
+
+    set_transfer_options(context, local_path, options)
     cli.blob_storage.download(context)
 
 @main.group()
-@click.option('--name', required=True, help='cluster name',
-              callback=cli.validation.validate_cluster_name)
-@click.option('--workspace', required=True, help='workspace name',
-              callback=cli.validation.validate_workspace_name)
+@click.option('--name', help='cluster name, required by show and delete',
+              callback=cli.validation.optional(cli.validation.validate_cluster_name))
+@click.option('--workspace', help='workspace name, required by show and delete',
+              callback=cli.validation.optional(
+                  cli.validation.validate_workspace_name))
 @click.pass_context
 def cluster(
         context: object,
@@ -166,17 +378,32 @@ def cluster(
         workspace: str
     ) -> None:
     """Cluster."""
+    import cli.clients
+
     context.obj['cluster_name'] = name
     context.obj['workspace'] = workspace
-    create_batchai_client(context)
+    cli.clients.create_batchai_client(context)
+
+def require_cluster(context: object) -> None:
+    for option, key in [('--name', 'cluster_name'), ('--workspace', 'workspace')]:
+        if context.obj[key] is None:
+            raise click.UsageError('Missing option "{}" for cluster.'.format(option))
 
 @cluster.command(name='delete')
+@click.option('--wait', is_flag=True, help='wait until the cluster is gone')
+@click.option('--timeout', default=cli.constants.OPERATION_TIMEOUT,
+              type=click.IntRange(min=1), help='seconds to wait with --wait')
 @click.pass_context
 def delete_cluster(
-        context: object
+        context: object,
+        wait: bool,
+        timeout: int
     ) -> None:
     """Delete your batchai cluster."""
-    cli.cluster.delete_cluster(context)
+    import cli.cluster
+
+    require_cluster(context)
+    cli.cluster.delete_cluster(context, wait=wait, timeout=timeout)
 
 @cluster.command(name='show')
 @click.pass_context
@@ -184,27 +411,344 @@ def show_cluster(
         context:object
     ) -> None:
     """Show details of your batchai cluster."""
+    import cli.cluster
+
+    require_cluster(context)
     cli.cluster.show_cluster(context)
 
-def create_batchai_client(context: object) -> None:
-    """Client to create batchai resources."""
-    if 'batchai_client' not in context.obj:
-        batchai_client = training.BatchAIManagementClient(
-            credentials=context.obj['aad_credentials'],
-            subscription_id=context.obj['subscription_id'],
-            base_url=AZURE_PUBLIC_CLOUD.endpoints.resource_manager)
-        context.obj['batchai_client'] = batchai_client
+@cluster.command(name='status')
+@click.argument('targets', nargs=-1)
+@click.option('--output', 'output_format', default='table',
+              type=click.Choice(['table', 'json']))
+@click.option('--workers', default=16, type=click.IntRange(min=1),
+              help='workspaces and clusters to fetch at the same time')
+@click.pass_context
+def cluster_status(
+        context: object,
+        targets: tuple,
+        output_format: str,
+        workers: int
+    ) -> None:
+    """Show many clusters at once.
+
+    TARGETS are WORKSPACE for every cluster in a workspace, or WORKSPACE/NAME
+    where NAME may be a glob. Without TARGETS, --workspace and --name of the
+    cluster group are used.
+    """
+    import cli.cluster_status
+
+    cli.cluster_status.cluster_status(context, cluster_targets(context, targets),
+                                      output_format, workers)
+
+@cluster.command(name='watch')
+@click.option('--until', type=click.Choice(['steady', 'idle', 'gone']),
+              help='exit once the cluster is steady, has all target nodes '
+                   'idle, or is deleted')
+@click.option('--timeout', type=click.IntRange(min=1),
+              help='seconds to watch before giving up, default forever')
+@click.option('--output', 'output_format', default='text',
+              type=click.Choice(['text', 'json']),
+              help='log lines, or one JSON event per line on stdout')
+@click.pass_context
+def watch_cluster(
+        context: object,
+        until: str,
+        timeout: int,
+        output_format: str
+    ) -> None:
+    """Follow changes of your batchai cluster."""
+    import cli.cluster_watch
+
+    require_cluster(context)
+    if not cli.cluster_watch.watch(context, until, timeout, output_format):
+        context.exit(1)
+
+@cluster.command(name='record')
+@click.argument('targets', nargs=-1)
+@click.option('--interval', default=60, type=click.IntRange(min=1),
+              help='seconds between samples')
+@click.option('--samples', type=click.IntRange(min=1),
+              help='samples to take before exiting, default forever')
+@click.option('--data-dir', type=click.Path(file_okay=False),
+              help='where series are kept, defaults to timeseries in the cache dir')
+@click.pass_context
+def record_clusters(
+        context: object,
+        targets: tuple,
+        interval: int,
+        samples: int,
+        data_dir: str
+    ) -> None:
+    """Record node counts of clusters over time.
+
+    TARGETS are given as for cluster status.
+    """
+    import cli.utilization
+
+    cli.utilization.record(context, cluster_targets(context, targets),
+                           timeseries_dir(context, data_dir), interval, samples)
+
+@cluster.command(name='report')
+@click.argument('targets', nargs=-1)
+@click.option('--since', default='24h',
+              help='window start, as UTC YYYY-MM-DDTHH:MM:SS or a duration '
+                   'ago such as 90m, 24h or 7d')
+@click.option('--until', default='now', help='window end, as for --since')
+@click.option('--output', 'output_format', default='table',
+              type=click.Choice(['table', 'json']))
+@click.option('--data-dir', type=click.Path(file_okay=False),
+              help='where series are kept, defaults to timeseries in the cache dir')
+@click.pass_context
+def report_clusters(
+        context: object,
+        targets: tuple,
+        since: str,
+        until: str,
+        output_format: str,
+        data_dir: str
+    ) -> None:
+    """Report node-hours, utilization and scale-up latency of recorded clusters.
+
+    TARGETS are given as for cluster status and default to every recorded
+    cluster.
+    """
+    import cli.utilization
+
+    try:
+        start = cli.utilization.parse_time(since)
+        end = cli.utilization.parse_time(until)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+    if start >= end:
+        raise click.UsageError('--since must be before --until.')
+    cli.utilization.report(context, targets, timeseries_dir(context, data_dir),
+                           start, end, output_format)
+
+@cluster.group()
+@click.pass_context
+def job(
+        context: object
+    ) -> None:
+    """Jobs in the workspace given by --workspace."""
+    if context.obj['workspace'] is None:
+        raise click.UsageError('Missing option "--workspace" for cluster.')
+
+@job.command(name='sweep')
+@click.option('--spec', 'spec_path', required=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='JSON or YAML job template with its parameter grid or list')
+@click.option('--workers', default=16, type=click.IntRange(min=1),
+              help='jobs to submit at the same time')
+@click.option('--dry-run', is_flag=True,
+              help='print the jobs that would be submitted')
+@click.pass_context
+def sweep_jobs(
+        context: object,
+        spec_path: str,
+        workers: int,
+        dry_run: bool
+    ) -> None:
+    """Submit one job per point of a parameter sweep.
+
+    Submitted jobs are checkpointed, so running the same sweep again only
+    submits the jobs that are missing.
+    """
+    import cli.spec
+    import cli.sweep
+
+    require_cluster(context)
+    counts = cli.sweep.sweep(context, cli.spec.load_spec(spec_path), workers,
+                             dry_run)
+    if counts.get(cli.sweep.FAILED):
+        context.exit(1)
+
+@job.command(name='logs')
+@click.option('--experiment', required=True, help='experiment of the job')
+@click.option('--job', 'job_name', required=True, help='job name')
+@click.option('--directory', default='stdouterr',
+              help='output directory id of the job to show')
+@tail_options
+@click.pass_context
+def job_logs(
+        context: object,
+        experiment: str,
+        job_name: str,
+        directory: str,
+        follow: bool,
+        lines: int,
+        resume: bool
+    ) -> None:
+    """Show the output of a job, optionally following it until the job ends."""
+    import cli.tail
+
+    files = cli.tail.JobOutputFiles(context, experiment, job_name, directory)
+    run_tail(context, files, follow, lines, resume, files.finished)
+
+@main.command(name='daemon')
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False),
+              help='Unix socket to listen on, defaults to $PYBATCHAI_SOCKET '
+                   'or daemon.sock in ~/.pybatchai')
+@click.option('--idle-timeout', type=click.IntRange(min=1),
+              help='seconds without commands before exiting, default never')
+@click.pass_context
+def daemon(
+        context: object,
+        socket_path: str,
+        idle_timeout: int
+    ) -> None:
+    """Serve commands from pybatchai-client, keeping clients warm."""
+    import cli.daemon
+    import cli.daemon_client
+
+    if context.obj.get('in_daemon'):
+        raise click.UsageError('pybatchai-client cannot start a daemon.')
+    cli.daemon.serve(context, main, socket_path or cli.daemon_client.socket_path(),
+                     idle_timeout)
+
+def cluster_targets(context: object, targets: tuple) -> list:
+    """TARGETS, or the workspace and name given to the cluster group."""
+    if targets:
+        return list(targets)
+    if context.obj['workspace'] is None:
+        raise click.UsageError('Give TARGETS or --workspace for cluster.')
+    return ['/'.join(filter(None, [context.obj['workspace'],
+                                   context.obj['cluster_name']]))]
+
+def timeseries_dir(context: object, data_dir: str) -> str:
+    import os
+
+    import cli.utilization
+
+    return data_dir or os.path.join(context.obj['cache_dir'],
+                                    cli.utilization.TIMESERIES_DIR)
+
+@main.command(name='up')
+@click.option('--spec', 'spec_path', required=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='JSON or YAML description of the environment')
+@click.option('--workers', default=8, type=click.IntRange(min=1),
+              help='resources to create at the same time')
+@click.pass_context
+def up(
+        context: object,
+        spec_path: str,
+        workers: int
+    ) -> None:
+    """Create storage, fileshares, containers and clusters in parallel."""
+    import cli.clients
+    import cli.dag
+    import cli.environment
+    import cli.spec
+
+    spec = cli.spec.load_spec(spec_path)
+    cli.clients.create_batchai_client(context)
+    timings = cli.environment.up(context, spec, workers)
+    if any(timing.status != cli.dag.SUCCEEDED for timing in timings.values()):
+        context.exit(1)
+
+@main.command(name='run')
+@click.argument('manifest_path', metavar='MANIFEST',
+                type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', type=click.IntRange(min=1),
+              help='operations to run at the same time, defaults to the '
+                   'manifest\'s workers or 8')
+@click.option('--output', 'output_format', default='table',
+              type=click.Choice(['table', 'json']))
+@click.pass_context
+def run_manifest(
+        context: object,
+        manifest_path: str,
+        workers: int,
+        output_format: str
+    ) -> None:
+    """Run the operations of a JSON or YAML manifest in one process.
+
+    Each operation is a command line without the global options, which come
+    from this command. Operations that do not depend on each other run in
+    parallel, sharing clients, keys and existence checks.
+    """
+    import cli.batch
+    import cli.dag
+    import cli.spec
+
+    manifest = cli.spec.load_spec(manifest_path)
+    cli.batch.share(context)
+    timings = cli.batch.run(context, main, manifest,
+                            workers or manifest.get('workers', 8), output_format)
+    if any(timing.status != cli.dag.SUCCEEDED for timing in timings.values()):
+        context.exit(1)
+
+@main.command(name='upload')
+@click.option('--local-path', required=True, type=click.Path(exists=True),
+              help='upload files or a directory at this path')
+@click.option('--blob', 'blobs', multiple=True, metavar='ACCOUNT/CONTAINER[/PREFIX]',
+              callback=cli.validation.validate_destinations(
+                  cli.validation.validate_container_name),
+              help='a blob container to upload to, may be repeated')
+@click.option('--fileshare', 'fileshares', multiple=True,
+              metavar='ACCOUNT/SHARE[/PREFIX]',
+              callback=cli.validation.validate_destinations(
+                  cli.validation.validate_fileshare_name),
+              help='a fileshare to upload to, may be repeated')
+@click.option('--include', multiple=True,
+              help='only upload paths matching this pattern, may be repeated')
+@click.option('--exclude', multiple=True,
+              help='skip paths matching this pattern, may be repeated')
+@click.option('--connections', default=32, type=click.IntRange(min=1),
+              help='connections to each destination')
+@click.pass_context
+def upload_to_destinations(
+        context: object,
+        local_path: str,
+        blobs: tuple,
+        fileshares: tuple,
+        include: tuple,
+        exclude: tuple,
+        connections: int
+    ) -> None:
+    """Upload to several containers and fileshares, reading files once.
+
+    Destinations may be in different storage accounts. Each chunk is read
+    from disk once and sent to every destination at the same time; a
+    destination that fails does not stop the others.
+    """
+    import blobxfer.models.azure as azmodels
+
+    import cli.fanout
+
+    if not blobs and not fileshares:
+        raise click.UsageError('Give at least one --blob or --fileshare.')
+    destinations = [cli.fanout.destination(azmodels.StorageModes.Block, value)
+                    for value in blobs] + \
+        [cli.fanout.destination(azmodels.StorageModes.File, value)
+         for value in fileshares]
+    context.obj['local_path'] = local_path
+    context.obj['transfer_options'] = {'include': include, 'exclude': exclude}
+    if cli.fanout.upload(context, destinations, connections):
+        context.exit(1)
 
 main.add_command(storage)
+main.add_command(upload_to_destinations)
 storage.add_command(fileshare)
 fileshare.add_command(upload_to_fileshare)
 fileshare.add_command(download_fileshare)
+fileshare.add_command(tail_fileshare)
 storage.add_command(blobstorage)
 blobstorage.add_command(upload_to_blob_container)
 blobstorage.add_command(download_from_blob_container)
 main.add_command(cluster)
 cluster.add_command(delete_cluster)
 cluster.add_command(show_cluster)
+cluster.add_command(cluster_status)
+cluster.add_command(watch_cluster)
+cluster.add_command(record_clusters)
+cluster.add_command(report_clusters)
+cluster.add_command(job)
+job.add_command(sweep_jobs)
+job.add_command(job_logs)
+main.add_command(up)
+main.add_command(daemon)
+main.add_command(run_manifest)
 
 if __name__ == '__main__':
     main()
@@ -3,6 +3,8 @@ from setuptools import setup
 setup(
     name="pybatchai",
     version='0.0.1',
+    py_modules=['pybatchai'],
+    packages=['cli'],
     install_requires=[
         'azure',
         'azure-mgmt >= 2.0.0',
@@ -11,6 +13,8 @@ setup(
         'blobxfer',
         'Click',
         'coloredlogs',
+        'cryptography',
+        'PyYAML',
         'uuid'
     ],
     extras_require={
@@ -21,6 +25,9 @@ setup(
         ]
     },
     entry_points={
-        'console_scripts': ['pybatchai=pybatchai:cli']
+        'console_scripts': [
+            'pybatchai=pybatchai:main',
+            'pybatchai-client=cli.daemon_client:main'
+        ]
     }
 )
@@ -0,0 +1,205 @@
+import asyncio
+import base64
+import os
+import socket
+import types
+
+from azure.storage.blob import BlockBlobService
+from azure.storage.file import FileService
+import blobxfer.models.azure as azmodels
+from hypothesis import given, settings
+from hypothesis.strategies import binary, integers
+import pytest
+
+import cli.async_http
+import cli.async_transfer
+import cli.blobxfer_util
+import cli.tuning
+from benchmarks import fake_storage
+
+KEY = base64.b64encode(b'k' * 64).decode()
+PLAN = cli.tuning.TransferPlan(disk_threads=1, transfer_threads=4,
+                               chunk_size_bytes=64 * 1024)
+
+def make_context(server, local_path, **options):
+    blob_service = BlockBlobService(account_name='acct', account_key=KEY,
+                                    protocol='http',
+                                    custom_domain=server.address + '/blob')
+    file_service = FileService('acct', KEY)
+    file_service.protocol = 'http'
+    file_service.primary_endpoint = server.address + '/file'
+    server.store.create_container('data')
+    server.store.create_share('data')
+    return types.SimpleNamespace(obj={
+        'blob_storage_service': blob_service,
+        'fileshare_service': file_service,
+        'local_path': str(local_path),
+        'transfer_options': dict({'engine': 'async'}, **options)
+    })
+
+def write_tree(source):
+    files = {'a.txt': b'a' * 10, 'empty.bin': b'',
+             'sub/dir/big.dat': os.urandom(200 * 1024),
+             'sub/no_extension': b'included, as every file is'}
+    for name, data in files.items():
+        path = source.join(*name.split('/'))
+        path.dirpath().ensure(dir=True)
+        path.write_binary(data)
+    return files
+
+def test_round_trips_in_both_modes(tmpdir):
+    source = tmpdir.mkdir('source')
+    files = write_tree(source)
+    with fake_storage.running() as server:
+        for mode in [azmodels.StorageModes.Block, azmodels.StorageModes.File]:
+            context = make_context(server, source)
+            cli.async_transfer.upload(context, mode, 'data', PLAN)
+            target = tmpdir.join('target-' + mode.name)
+            download = types.SimpleNamespace(obj=dict(context.obj,
+                                                      local_path=str(target)))
+            cli.async_transfer.download(download, mode, 'data', PLAN)
+            for name, data in files.items():
+                assert target.join(*name.split('/')).read_binary() == data
+        # blobs beyond one chunk are sent as blocks
+        assert server.store.containers['data']['sub/dir/big.dat'].data == \
+            files['sub/dir/big.dat']
+        assert server.store.operations['PUT blob blocklist'] == 1
+
+def test_prefix_include_and_exclude_select_files_in_both_modes(tmpdir):
+    source = tmpdir.mkdir('source')
+    write_tree(source)
+    with fake_storage.running() as server:
+        for mode in [azmodels.StorageModes.Block, azmodels.StorageModes.File]:
+            context = make_context(server, source, include=['*.txt', 'sub/*'],
+                                   exclude=['*.dat'])
+            cli.async_transfer.upload(context, mode, 'data/runs/1', PLAN)
+            # a neighbouring prefix that shares the first characters
+            cli.async_transfer.upload(make_context(server, source), mode,
+                                      'data/runs/10', PLAN)
+            target = tmpdir.join('target-' + mode.name)
+            download = types.SimpleNamespace(obj=dict(
+                context.obj, local_path=str(target),
+                transfer_options={'engine': 'async', 'exclude': ['a.*']}))
+            cli.async_transfer.download(download, mode, 'data/runs/1', PLAN)
+            assert sorted(path.relto(target) for path in target.visit()
+                          if path.isfile()) == ['sub/no_extension']
+        assert sorted(name for name in server.store.containers['data']
+                      if name.startswith('runs/1/')) == ['runs/1/a.txt',
+                                                         'runs/1/sub/no_extension']
+
+def test_engine_option_picks_the_async_engine(tmpdir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(cli.async_transfer, 'download',
+                        lambda *args: calls.append(args))
+    context = types.SimpleNamespace(obj={'local_path': str(tmpdir),
+                                         'transfer_options': {'engine': 'async'}})
+    cli.blobxfer_util.start_downloader(context, azmodels.StorageModes.File, 'data')
+    assert calls == [(context, azmodels.StorageModes.File, 'data',
+                      cli.blobxfer_util.FIXED_PLANS[cli.blobxfer_util.DOWNLOAD],
+                      None)]
+
+def test_auto_concurrency_records_async_runs_apart(tmpdir, monkeypatch):
+    source = tmpdir.mkdir('source')
+    files = write_tree(source)
+    recorded = []
+    monkeypatch.setattr(cli.tuning, 'record_run',
+                        lambda cache_dir, key, plan, total_bytes, seconds:
+                        recorded.append((key, total_bytes)))
+    with fake_storage.running() as server:
+        context = make_context(server, source, concurrency='auto',
+                               memory_budget_mb=1024)
+        context.obj.update(storage_account='acct',
+                           cache_dir=str(tmpdir.mkdir('cache')))
+        cli.blobxfer_util.start_uploader(context, azmodels.StorageModes.Block,
+                                         'data')
+        download = types.SimpleNamespace(obj=dict(
+            context.obj, local_path=str(tmpdir.join('target'))))
+        cli.blobxfer_util.start_downloader(download, azmodels.StorageModes.Block,
+                                           'data')
+    total_bytes = sum(map(len, files.values()))
+    assert recorded == [('acct/Block/upload/small/async', total_bytes),
+                        ('acct/Block/download/small/async', total_bytes)]
+
+def test_many_small_files_share_few_connections(tmpdir, monkeypatch):
+    source = tmpdir.mkdir('source')
+    for number in range(300):
+        source.join('{}.txt'.format(number)).write_binary(b'x' * number)
+    connections = []
+    connect = cli.async_http.ConnectionPool.connect
+
+    async def counting_connect(pool, parts):
+        connections.append(parts)
+        return await connect(pool, parts)
+
+    monkeypatch.setattr(cli.async_http.ConnectionPool, 'connect', counting_connect)
+    with fake_storage.running() as server:
+        context = make_context(server, source)
+        cli.async_transfer.upload(context, azmodels.StorageModes.Block, 'data', PLAN)
+        assert len(server.store.containers['data']) == 300
+    assert len(connections) <= PLAN.transfer_threads
+
+def test_sync_download_skips_fresh_files_and_deletes_extraneous(tmpdir):
+    source = tmpdir.mkdir('source')
+    write_tree(source)
+    target = tmpdir.mkdir('target')
+    with fake_storage.running() as server:
+        context = make_context(server, source)
+        cli.async_transfer.upload(context, azmodels.StorageModes.File, 'data', PLAN)
+        download = types.SimpleNamespace(obj=dict(
+            context.obj, local_path=str(target),
+            transfer_options={'engine': 'async', 'sync': True, 'delete': True}))
+        cli.async_transfer.download(download, azmodels.StorageModes.File, 'data',
+                                    PLAN)
+        target.join('stale.txt').write_binary(b'gone remotely')
+        server.store.reset_counters()
+        cli.async_transfer.download(download, azmodels.StorageModes.File, 'data',
+                                    PLAN)
+        assert not server.store.operations['GET file']
+        assert not target.join('stale.txt').exists()
+        assert target.join('a.txt').read_binary() == b'a' * 10
+
+@settings(max_examples=50)
+@given(binary(max_size=5000), integers(min_value=1, max_value=100))
+def test_chunked_bodies_are_joined(data, chunk):
+    encoded = b''.join(b'%x\r\n%s\r\n' % (len(data[start:start + chunk]),
+                                          data[start:start + chunk])
+                       for start in range(0, len(data), chunk))
+    encoded += b'0\r\n\r\n'
+
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                         + encoded)
+        reader.feed_eof()
+        return await cli.async_http.read_response(reader, 'GET', None)
+
+    response, keep_alive = cli.async_http.run(read())
+    assert response.body == data
+    assert keep_alive
+
+def test_silent_servers_time_out_and_are_retried(monkeypatch):
+    monkeypatch.setattr(cli.async_http, 'READ_TIMEOUT', 0.05)
+    monkeypatch.setattr(cli.async_http, 'CONNECT_TIMEOUT', 0.05)
+    monkeypatch.setattr(cli.async_http, 'BACKOFF', 0)
+    monkeypatch.setattr(cli.async_http, 'RETRIES', 2)
+    # the kernel accepts connections to a listening socket nobody answers
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    url = 'http://127.0.0.1:{}/data'.format(listener.getsockname()[1])
+    try:
+        with pytest.raises(cli.async_http.TimedOut):
+            cli.async_http.run(cli.async_http.ConnectionPool(2).request('GET', url))
+    finally:
+        listener.close()
+
+    connects = []
+
+    async def never_connect(*args, **kwargs):
+        connects.append(args)
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(asyncio, 'open_connection', never_connect)
+    with pytest.raises(cli.async_http.TimedOut):
+        cli.async_http.run(cli.async_http.ConnectionPool(2).request('GET', url))
+    assert len(connects) == 3
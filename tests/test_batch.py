@@ -0,0 +1,84 @@
+import json
+import threading
+
+import click
+import pytest
+
+import cli.batch
+import cli.dag
+from cli.dag import FAILED, SKIPPED, SUCCEEDED
+
+@click.group()
+def toy():
+    pass
+
+@toy.group()
+@click.option('--name', required=True)
+@click.pass_context
+def account(context, name):
+    context.obj['account'] = name
+    context.obj['seen'].append(name)
+
+@account.command()
+@click.pass_context
+def wait(context):
+    context.obj['barrier'].wait()
+
+@account.command()
+@click.option('--code', default=1)
+@click.pass_context
+def fail(context, code):
+    context.exit(code)
+
+@toy.command()
+def daemon():
+    pass
+
+def run_manifest(operations, obj=None, output_format=cli.batch.TABLE):
+    obj = dict(obj or {}, seen=[])
+    context = click.Context(toy, obj=obj)
+    timings = cli.batch.run(context, toy, {'operations': operations}, 4,
+                            output_format)
+    return timings, obj
+
+def test_independent_operations_share_obj_and_run_concurrently():
+    timings, obj = run_manifest(
+        ['account --name a wait', 'account --name b wait',
+         {'name': 'c', 'command': ['account', '--name', 'c', 'wait']}],
+        {'barrier': threading.Barrier(3, timeout=5)})
+    assert set(timings) == {'account --name a wait', 'account --name b wait', 'c'}
+    assert all(timing.status == SUCCEEDED for timing in timings.values())
+    assert sorted(obj['seen']) == ['a', 'b', 'c']
+    # each operation sets its options on its own copy
+    assert 'account' not in obj
+
+def test_failed_operations_skip_their_dependents(capsys):
+    timings, _ = run_manifest(
+        [{'name': 'bad', 'command': 'account --name a fail --code 3'},
+         {'name': 'usage', 'command': 'account wait'},
+         {'name': 'after', 'command': 'account --name b fail --code 0',
+          'depends_on': 'bad'},
+         {'name': 'fine', 'command': 'account --name c fail --code 0'}],
+        output_format=cli.batch.JSON)
+    assert timings['bad'].status == FAILED
+    assert str(timings['bad'].result) == 'bad exited with 3.'
+    assert timings['usage'].status == FAILED
+    assert timings['after'].status == SKIPPED
+    assert timings['fine'].status == SUCCEEDED
+    rows = {row['name']: row for row in json.loads(capsys.readouterr().out)['operations']}
+    assert rows['fine'] == dict(rows['fine'], status=SUCCEEDED, error=None)
+    assert 'Missing option' in rows['usage']['error']
+
+@pytest.mark.parametrize('operations', [
+    [],
+    ['daemon'],
+    ['unknown'],
+    [{'name': 'a', 'command': 'account --name a wait'},
+     {'name': 'a', 'command': 'account --name b wait'}],
+    [{'command': 'account --name a wait', 'depends_on': ['missing']}],
+    [{'name': 'a', 'command': 'account --name a wait', 'depends_on': 'b'},
+     {'name': 'b', 'command': 'account --name b wait', 'depends_on': 'a'}],
+])
+def test_invalid_manifests_are_rejected_before_running(operations):
+    with pytest.raises(click.BadParameter):
+        run_manifest(operations)
@@ -0,0 +1,71 @@
+import base64
+import os
+import types
+
+import blobxfer.api
+import blobxfer.models.azure as azmodels
+from hypothesis import given
+from hypothesis.strategies import lists, sampled_from
+
+import cli.blobxfer_util
+import cli.local_files
+import cli.tuning
+
+NAMES = ['train.py', 'README', 'logs/0.log', 'logs/deep/1.log', 'data/x.csv']
+PATTERNS = ['*', '*.py', '*.log', 'logs/*', 'README', 'data/*.csv', '?????.py']
+
+@given(lists(sampled_from(PATTERNS), max_size=3),
+       lists(sampled_from(PATTERNS), max_size=3))
+def test_downloads_select_what_uploads_select(includes, excludes):
+    source_path = cli.blobxfer_util.FilteringSourcePath('runs/1', includes,
+                                                        excludes, ())
+    for name in NAMES:
+        assert source_path._inclusion_check('runs/1/' + name) == \
+            cli.local_files.selected(name, includes, excludes)
+        assert not source_path._inclusion_check('runs/10/' + name)
+
+def test_remote_paths_carry_the_prefix():
+    context = type('Context', (), {'obj': {
+        'transfer_options': {'prefix': 'runs/1'}}})
+    remote_path = cli.blobxfer_util.prefixed_remote_path(context, 'data')
+    assert remote_path == 'data/runs/1'
+    assert cli.blobxfer_util.split_remote_path(remote_path) == ('data', 'runs/1')
+    assert cli.blobxfer_util.split_remote_path('data') == ('data', '')
+    assert cli.blobxfer_util.relative_name('runs/1', 'runs/1/a/b') == 'a/b'
+    assert cli.blobxfer_util.relative_name('', 'a/b') == 'a/b'
+
+def test_downloads_into_an_existing_tree_record_the_bytes_written(tmpdir,
+                                                                 monkeypatch):
+    files = {'a.bin': 300 * 1024, 'sub/b.bin': 700 * 1024}
+    target = tmpdir.mkdir('target')
+
+    class Downloader:
+        def __init__(self, general_options, credentials, specification):
+            pass
+
+        def start(self):
+            for name, size in files.items():
+                path = target.join(*name.split('/'))
+                path.dirpath().ensure(dir=True)
+                path.write_binary(b'x' * size)
+
+    recorded = []
+    monkeypatch.setattr(blobxfer.api, 'Downloader', Downloader)
+    monkeypatch.setattr(cli.blobxfer_util, 'sample_remote_sizes',
+                        lambda *args: list(files.values()))
+    monkeypatch.setattr(cli.tuning, 'record_run',
+                        lambda cache_dir, key, plan, total_bytes, seconds:
+                        recorded.append(total_bytes))
+    context = types.SimpleNamespace(obj={
+        'storage_account': 'acct',
+        'storage_account_key': base64.b64encode(b'k' * 64).decode(),
+        'cache_dir': str(tmpdir.mkdir('cache')),
+        'local_path': str(target),
+        'transfer_options': {'concurrency': 'auto', 'memory_budget_mb': 1024}})
+    for _ in range(2):
+        cli.blobxfer_util.start_downloader(context, azmodels.StorageModes.Block,
+                                           'data')
+    assert recorded == [sum(files.values())] * 2
+    # files written before the download started do not count
+    os.utime(str(target.join('a.bin')), (1, 1))
+    assert cli.blobxfer_util.downloaded_bytes(str(target), 2) == 700 * 1024
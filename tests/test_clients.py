@@ -0,0 +1,66 @@
+import http.server
+import json
+import socketserver
+import threading
+import types
+
+from msrest.authentication import BasicTokenAuthentication
+
+import cli.clients
+
+class ArmHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    authorizations = []
+
+    def handle_request(self):
+        ArmHandler.connections.add(self.client_address)
+        ArmHandler.authorizations.append(self.headers.get('Authorization'))
+        if self.command == 'HEAD':
+            self.send_response(204)
+            self.end_headers()
+            return
+        body = json.dumps({'name': self.path.rsplit('/', 1)[-1].split('?')[0],
+                           'location': 'eastus'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_HEAD = handle_request
+
+    def log_message(self, *args):
+        pass
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+def test_management_clients_share_one_keep_alive_connection():
+    server = Server(('127.0.0.1', 0), ArmHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        context = types.SimpleNamespace(obj={
+            'aad_credentials': BasicTokenAuthentication({'access_token': 'token'}),
+            'subscription_id': '00000000-0000-4000-8000-000000000000',
+            'resource_manager_url': 'http://127.0.0.1:{}'.format(server.server_port)})
+        cli.clients.set_resource_client(context)
+        cli.clients.set_storage_client(context)
+        cli.clients.create_batchai_client(context)
+        assert context.obj['resource_client'].resource_groups.check_existence('rg')
+        context.obj['batchai_client'].workspaces.get('rg', 'ws')
+        context.obj['storage_client'].storage_accounts.get_properties('rg', 'acct')
+        assert len(ArmHandler.connections) == 1
+        assert ArmHandler.authorizations == ['Bearer token'] * 3
+    finally:
+        cli.clients.http_session(context).close()
+        server.shutdown()
+        server.server_close()
+
+def test_pool_size_and_retries_come_from_context():
+    context = types.SimpleNamespace(obj={'http_pool_size': 4, 'http_retries': 7})
+    adapter = cli.clients.http_session(context).get_adapter('https://management.azure.com')
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 7
+    assert cli.clients.http_session(context) is context.obj['http_session']
@@ -0,0 +1,57 @@
+import types
+
+from azure.mgmt.batchai.models import (
+    Cluster,
+    ManualScaleSettings,
+    NodeStateCounts,
+    ScaleSettings
+)
+
+import cli.cluster_status
+
+class FakeClusters:
+    def __init__(self, workspaces):
+        self.workspaces = workspaces
+        self.calls = []
+
+    def get(self, resource_group, workspace, name):
+        self.calls.append(('get', workspace))
+        return next(cluster for cluster in self.workspaces[workspace]
+                    if cluster.name == name)
+
+    def list_by_workspace(self, resource_group, workspace):
+        self.calls.append(('list', workspace))
+        return iter(self.workspaces[workspace])
+
+def cluster(name, idle):
+    result = Cluster(scale_settings=ScaleSettings(
+        manual=ManualScaleSettings(target_node_count=idle)))
+    result.name = name
+    result.allocation_state = 'steady'
+    result.current_node_count = idle
+    result.node_state_counts = NodeStateCounts()
+    result.node_state_counts.idle_node_count = idle
+    return result
+
+def test_parse_targets_groups_names_by_workspace():
+    assert cli.cluster_status.parse_targets(['ws1/a', 'ws2', 'ws1/b*']) == {
+        'ws1': {'a', 'b*'}, 'ws2': {'*'}}
+
+def test_single_name_is_a_get_and_globs_are_one_list():
+    clusters = FakeClusters({'ws1': [cluster('a', 1), cluster('b1', 2),
+                                     cluster('c', 3)],
+                             'ws2': [cluster('gpu', 4)]})
+    context = types.SimpleNamespace(obj={
+        'resource_group': 'rg',
+        'batchai_client': types.SimpleNamespace(clusters=clusters)})
+    rows = cli.cluster_status.cluster_status(
+        context, ['ws1/b*', 'ws1/a', 'ws1/missing', 'ws2/gpu'],
+        output_format=cli.cluster_status.JSON)
+    assert sorted(clusters.calls) == [('get', 'ws2'), ('list', 'ws1')]
+    assert [(row['workspace'], row['name'], row['idle']) for row in rows] == [
+        ('ws1', 'a', 1), ('ws1', 'b1', 2), ('ws1', 'missing', None),
+        ('ws2', 'gpu', 4)]
+    assert rows[2]['allocation_state'] == cli.cluster_status.NOT_FOUND
+    table = cli.cluster_status.format_table(rows).splitlines()
+    assert table[0].split() == cli.cluster_status.COLUMNS
+    assert table[2].split()[:4] == ['ws1', 'b1', 'steady', '2']
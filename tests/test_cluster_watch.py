@@ -0,0 +1,71 @@
+import json
+import types
+
+from azure.mgmt.batchai.models import (
+    Cluster,
+    ManualScaleSettings,
+    NodeStateCounts,
+    ScaleSettings
+)
+
+import cli.cluster_watch
+from cli.cluster_watch import NOT_MODIFIED
+
+def cluster(allocation_state, idle, preparing=0):
+    result = Cluster(scale_settings=ScaleSettings(
+        manual=ManualScaleSettings(target_node_count=2)))
+    result.allocation_state = allocation_state
+    result.current_node_count = idle + preparing
+    result.node_state_counts = NodeStateCounts()
+    result.node_state_counts.idle_node_count = idle
+    result.node_state_counts.preparing_node_count = preparing
+    return result
+
+def run_watch(responses, until, timeout=None, output_format='text'):
+    responses = iter(responses)
+    etags, sleeps = [], []
+    clock = types.SimpleNamespace(now=0.0)
+
+    def fetch(etag):
+        etags.append(etag)
+        return next(responses)
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock.now += seconds
+
+    context = types.SimpleNamespace(obj={'workspace': 'ws', 'cluster_name': 'c'})
+    met = cli.cluster_watch.watch(context, until, timeout, output_format,
+                                  fetch=fetch, sleep=sleep,
+                                  clock=lambda: clock.now)
+    return met, etags, sleeps
+
+def test_polls_fast_while_preparing_and_stops_when_idle(capsys):
+    met, etags, sleeps = run_watch([
+        (cluster('resizing', 0, preparing=2), '"1"', None),
+        (cluster('steady', 0, preparing=2), '"2"', None),
+        (NOT_MODIFIED, '"2"', None),
+        (cluster('steady', 2), '"3"', None)], until='idle', output_format='json')
+    assert met
+    assert etags == [None, '"1"', '"2"', '"2"']
+    assert sleeps == [2, 2, 2]
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [event['event'] for event in events] == [
+        'changed', 'changed', 'changed', 'condition_met']
+    assert events[1]['changes'] == {'allocation_state': ['resizing', 'steady']}
+    assert events[2]['changes'] == {'idle': [0, 2], 'preparing': [2, 0]}
+
+def test_backs_off_while_steady_and_times_out():
+    steady = cluster('steady', 1)
+    met, _, sleeps = run_watch([(steady, '"1"', None)]
+                               + [(NOT_MODIFIED, '"1"', None)] * 20,
+                               until='gone', timeout=100)
+    assert not met
+    assert sleeps[:5] == [2, 4, 8, 16, 30]
+    assert sum(sleeps) == 100
+
+def test_deletion_meets_gone_after_honoring_retry_after():
+    met, _, sleeps = run_watch([(cluster('steady', 1), '"1"', 45),
+                                (None, None, None)], until='gone')
+    assert met
+    assert sleeps == [45]
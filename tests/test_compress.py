@@ -0,0 +1,149 @@
+import base64
+import gzip
+import io
+import os
+import types
+
+import pytest
+import requests
+from azure.storage.blob import BlockBlobService
+import blobxfer.models.azure as azmodels
+from hypothesis import given, settings
+from hypothesis.strategies import binary, integers
+
+import cli.blobxfer_util
+import cli.compress
+from benchmarks import fake_storage
+
+KEY = base64.b64encode(b'k' * 64).decode()
+
+@settings(max_examples=50)
+@given(binary(max_size=50000), integers(min_value=1, max_value=9))
+def test_gzip_reader_round_trips(data, level):
+    reader = cli.compress.GzipReader(io.BytesIO(data), level)
+    chunks = []
+    while True:
+        chunk = reader.read(1000)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert gzip.decompress(b''.join(chunks)) == data
+    assert reader.size == sum(len(chunk) for chunk in chunks)
+
+def test_files_are_picked_by_extension_or_sample(tmpdir):
+    def worth(name, data):
+        path = tmpdir.join(name)
+        path.write_binary(data)
+        return cli.compress.worth_compressing(str(path), len(data))
+
+    assert worth('table.CSV', os.urandom(4096))
+    assert not worth('archive.gz', b'a' * 4096)
+    assert not worth('small.csv', b'a' * 100)
+    assert worth('weights.bin', b'0123' * 4096)
+    assert not worth('weights.bin', os.urandom(4096))
+
+def make_context(server, local_path, **options):
+    service = BlockBlobService(account_name='acct', account_key=KEY)
+    service.create_container('data')
+    return types.SimpleNamespace(obj={
+        'blob_storage_service': service,
+        'local_path': str(local_path),
+        'transfer_options': dict({'compress': True, 'compress_level': 6},
+                                 **options)
+    })
+
+def test_compressed_upload_and_download_round_trip(tmpdir, monkeypatch):
+    monkeypatch.setattr(cli.compress, 'IN_MEMORY_BYTES', 64 * 1024)
+    source = tmpdir.mkdir('source')
+    source.join('small.csv').write_binary(b'a,b\n' * 1000)
+    source.mkdir('logs').join('big.log').write_binary(b'line\n' * 100000)
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        context = make_context(server, source)
+        cli.compress.start_uploader(context, azmodels.StorageModes.Block, 'data')
+        stored = server.store.containers['data']
+        assert sorted(stored) == ['logs/big.log', 'small.csv']
+        assert len(stored['logs/big.log'].data) < 500000 / 50
+        assert stored['small.csv'].metadata == {'pybatchai_size': '4000'}
+
+        service = context.obj['blob_storage_service']
+        response = requests.get(cli.compress.blob_url(service, 'data', 'small.csv'))
+        # any HTTP client gets the original bytes back
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.content == b'a,b\n' * 1000
+
+        target = tmpdir.join('target')
+        download = types.SimpleNamespace(obj=dict(context.obj,
+                                                  local_path=str(target)))
+        cli.compress.start_downloader(download, azmodels.StorageModes.Block, 'data')
+        assert target.join('small.csv').read_binary() == b'a,b\n' * 1000
+        assert target.join('logs', 'big.log').read_binary() == b'line\n' * 100000
+        assert not any(name.endswith(cli.compress.PARTIAL_SUFFIX)
+                       for name in os.listdir(str(target)))
+
+        names, compressed = cli.compress.list_compressed(service, 'data')
+        assert names == {'logs/big.log', 'small.csv'}
+        assert all(cli.compress.up_to_date(str(target), blob) for blob in compressed)
+        target.join('small.csv').write_binary(b'changed')
+        assert [blob.name for blob in compressed
+                if not cli.compress.up_to_date(str(target), blob)] == ['small.csv']
+
+def test_prefix_is_listed_on_the_server_and_stripped_locally(tmpdir):
+    source = tmpdir.mkdir('source')
+    source.join('keep.csv').write_binary(b'a,b\n' * 1000)
+    source.join('skip.log').write_binary(b'line\n' * 1000)
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        context = make_context(server, source, include=['*.csv'])
+        cli.compress.start_uploader(context, azmodels.StorageModes.Block,
+                                    'data/runs/1')
+        cli.compress.start_uploader(make_context(server, source),
+                                    azmodels.StorageModes.Block, 'data/runs/10')
+        assert 'runs/1/keep.csv' in server.store.containers['data']
+        assert 'runs/1/skip.log' not in server.store.containers['data']
+
+        target = tmpdir.join('target')
+        download = types.SimpleNamespace(obj=dict(context.obj,
+                                                  local_path=str(target)))
+        cli.compress.start_downloader(download, azmodels.StorageModes.Block,
+                                      'data/runs/1')
+        assert os.listdir(str(target)) == ['keep.csv']
+        names, _ = cli.compress.list_compressed(
+            context.obj['blob_storage_service'], 'data', 'runs/10',
+            excludes=['*.csv'])
+        assert names == {'skip.log'}
+
+def test_unmarked_containers_go_straight_to_blobxfer(tmpdir, monkeypatch):
+    downloads = []
+    monkeypatch.setattr(cli.blobxfer_util, 'start_downloader',
+                        lambda context, mode, remote_path, excluded=None:
+                        downloads.append(remote_path))
+    source = tmpdir.mkdir('source')
+    source.join('keep.csv').write_binary(b'a,b\n' * 1000)
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        context = make_context(server, tmpdir.join('target'))
+        cli.compress.start_downloader(context, azmodels.StorageModes.Block,
+                                      'data/runs/1')
+        assert downloads == ['data/runs/1']
+        assert server.store.operations['GET blob container list'] == 0
+
+        upload = types.SimpleNamespace(obj=dict(context.obj,
+                                                local_path=str(source)))
+        cli.compress.start_uploader(upload, azmodels.StorageModes.Block,
+                                    'data/runs/2')
+        assert server.store.container_metadata['data'] == {
+            cli.compress.COMPRESSED_METADATA: 'true'}
+        cli.compress.start_downloader(context, azmodels.StorageModes.Block,
+                                      'data/runs/2')
+        assert server.store.operations['GET blob container list'] == 1
+        assert tmpdir.join('target', 'keep.csv').read_binary() == b'a,b\n' * 1000
+
+def test_truncated_gzip_is_not_left_behind(tmpdir):
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        context = make_context(server, tmpdir)
+        context.obj['blob_storage_service'].create_blob_from_bytes(
+            'data', 'cut.txt', gzip.compress(b'x' * 10000)[:-8],
+            content_settings=cli.compress.content_settings('cut.txt'))
+        session = requests.Session()
+        with pytest.raises(ValueError):
+            cli.compress.download_file(session, context.obj['blob_storage_service'],
+                                       'data', 'cut.txt', str(tmpdir))
+        assert tmpdir.listdir() == []
@@ -0,0 +1,57 @@
+import os
+
+import click
+import requests
+
+import pybatchai
+from benchmarks import control_plane, fake_arm, fake_storage
+
+# daemon serves until interrupted
+UNMEASURED = {'daemon'}
+
+def command_paths(group, path=()):
+    for name, command in group.commands.items():
+        if isinstance(command, click.Group):
+            yield from command_paths(command, path + (name,))
+        else:
+            yield ' '.join(path + (name,))
+
+def scenario_path(arguments):
+    command, path = pybatchai.main, []
+    for argument in arguments:
+        if isinstance(command, click.Group) and argument in command.commands:
+            command = command.commands[argument]
+            path.append(argument)
+    return ' '.join(path)
+
+def test_scenario_runs_every_command():
+    measured = {scenario_path(arguments)
+                for _, arguments, _ in control_plane.SCENARIO}
+    assert set(command_paths(pybatchai.main)) - measured == UNMEASURED
+
+def test_every_command_stays_within_its_call_budget(tmpdir):
+    paths = control_plane.write_inputs(str(tmpdir))
+    with fake_arm.running() as arm, fake_storage.running() as storage:
+        for number, (name, arguments, budget) in enumerate(control_plane.SCENARIO):
+            args = control_plane.command_args(
+                arguments, paths, os.path.join(str(tmpdir), 'cache{}'.format(number)))
+            arm.store.reset_counters()
+            assert control_plane.run_command(args, arm.address,
+                                             storage.address) == 0, name
+            calls = arm.store.counters()
+            assert calls['requests'] <= budget, (name, calls['operations'])
+        assert not any('/clusters/' in key for key in arm.store.resources)
+
+def test_fake_arm_serves_resources_and_collections():
+    with fake_arm.running() as arm, fake_arm.redirect(arm.address):
+        group = 'https://management.azure.com/subscriptions/s/resourcegroups/rg'
+        assert requests.head(group).status_code == 404
+        assert requests.put(group, json={'location': 'westus'}).status_code == 201
+        workspace = (group + '/providers/Microsoft.BatchAI/workspaces/ws')
+        created = requests.put(workspace, json={'location': 'westus'}).json()
+        assert created['properties']['provisioningState'] == 'succeeded'
+        listed = requests.get(group + '/providers/Microsoft.BatchAI/workspaces')
+        assert [resource['name'] for resource in listed.json()['value']] == ['ws']
+        assert requests.delete(group).status_code == 200
+        assert requests.get(workspace).status_code == 404
+        assert arm.store.counters()['operations']['HEAD subscriptions/resourcegroups'] == 1
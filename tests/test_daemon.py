@@ -0,0 +1,129 @@
+import io
+import logging
+import threading
+
+import click
+import pytest
+
+import cli.daemon
+import cli.daemon_client
+
+STARTS = []
+
+@click.group()
+@click.option('--name', default='a')
+@click.pass_context
+def toy(context, name):
+    settings = {'name': name}
+    warm = context.obj
+    if warm is not None:
+        context.obj = warm.lookup(settings)
+        if context.obj is not None:
+            return
+    STARTS.append(name)
+    context.obj = {'settings': settings}
+    if warm is not None:
+        context.obj = warm.keep(context.obj)
+
+@toy.command()
+@click.pass_context
+def hello(context):
+    context.obj.setdefault('http_session', object())
+    print('hello {}'.format(id(context.obj['http_session'])))
+    logging.getLogger('toy').warning('careful')
+
+@toy.command()
+def fail():
+    raise click.UsageError('bad')
+
+def run_commands(tmp_path, commands):
+    path = str(tmp_path / 'daemon.sock')
+    server = cli.daemon.DaemonServer(path, toy, cli.daemon.WarmObjects())
+    handler = logging.StreamHandler()
+    logging.getLogger().addHandler(handler)
+
+    def serve():
+        with cli.daemon.relayed_output(server.output):
+            for _ in commands:
+                server.handle_request()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    results = []
+    try:
+        for argv in commands:
+            stdout, stderr = io.BytesIO(), io.BytesIO()
+            code = cli.daemon_client.run(cli.daemon_client.connect(path), argv,
+                                         stdout, stderr)
+            results.append((code, stdout.getvalue().decode(),
+                            stderr.getvalue().decode()))
+    finally:
+        thread.join()
+        server.server_close()
+        logging.getLogger().removeHandler(handler)
+    return results
+
+def test_commands_reuse_warm_objects_and_relay_output(tmp_path):
+    del STARTS[:]
+    first, second, other, failed = run_commands(tmp_path, [
+        ['hello'], ['hello'], ['--name', 'b', 'hello'], ['fail']])
+    assert STARTS == ['a', 'b']
+    assert first[0] == second[0] == other[0] == 0
+    assert first[1].startswith('hello ') and first[1] == second[1]
+    assert other[1] != first[1]
+    assert 'careful' in first[2]
+    assert failed[0] == 2
+    assert 'bad' in failed[2]
+
+def test_help_exits_cleanly(tmp_path):
+    [(code, stdout, _)] = run_commands(tmp_path, [['--help']])
+    assert code == 0
+    assert 'hello' in stdout
+
+def test_malformed_requests_get_an_error_and_the_daemon_carries_on(tmp_path):
+    path = str(tmp_path / 'daemon.sock')
+    server = cli.daemon.DaemonServer(path, toy, cli.daemon.WarmObjects())
+
+    def serve():
+        with cli.daemon.relayed_output(server.output):
+            for _ in range(3):
+                server.handle_request()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    results = []
+    try:
+        for line in [b'not json\n', b'{"argv": ["hello"]}\n']:
+            stderr = io.BytesIO()
+            connection = cli.daemon_client.connect(path)
+            with connection:
+                connection.sendall(line)
+                while True:
+                    channel, size = cli.daemon_client.FRAME.unpack(
+                        cli.daemon_client.read_exactly(
+                            connection, cli.daemon_client.FRAME.size))
+                    payload = cli.daemon_client.read_exactly(connection, size)
+                    if channel == cli.daemon_client.EXIT:
+                        break
+                    stderr.write(payload)
+            results.append((int(payload), stderr.getvalue().decode()))
+        stdout = io.BytesIO()
+        code = cli.daemon_client.run(cli.daemon_client.connect(path), ['hello'],
+                                     stdout, io.BytesIO())
+    finally:
+        thread.join()
+        server.server_close()
+    assert all(code == 2 and 'Malformed' in message for code, message in results)
+    assert code == 0 and stdout.getvalue().startswith(b'hello ')
+
+def test_unusable_socket_paths_are_usage_errors(tmp_path, monkeypatch):
+    path = tmp_path / 'daemon.sock'
+    path.write_text('')
+
+    def connect(path):
+        raise PermissionError(13, 'Permission denied')
+
+    monkeypatch.setattr(cli.daemon_client, 'connect', connect)
+    with pytest.raises(click.UsageError):
+        cli.daemon.remove_stale_socket(str(path))
+    assert path.exists()
@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+import cli.dag
+from cli.dag import FAILED, SKIPPED, SUCCEEDED, CycleError, critical_path, node, run
+
+def test_independent_nodes_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    nodes = [node('rg', lambda: None)]
+    nodes += [node(name, barrier.wait, depends_on=['rg'])
+              for name in ('storage a', 'storage b', 'cluster')]
+    timings = run(nodes, max_workers=4)
+    assert all(timing.status == SUCCEEDED for timing in timings.values())
+
+def test_dependents_of_failed_node_are_skipped():
+    def fail():
+        raise RuntimeError('boom')
+
+    nodes = [node('account', fail),
+             node('container', lambda: None, depends_on=['account']),
+             node('share', lambda: None, depends_on=['container']),
+             node('workspace', lambda: 'ok')]
+    timings = run(nodes)
+    assert timings['account'].status == FAILED
+    assert timings['container'].status == SKIPPED
+    assert timings['share'].status == SKIPPED
+    assert timings['workspace'].result == 'ok'
+
+def test_cycles_are_rejected():
+    with pytest.raises(CycleError):
+        run([node('a', None, depends_on=['b']), node('b', None, depends_on=['a'])])
+
+def test_critical_path_follows_latest_dependencies():
+    nodes = [node('rg', None), node('account', None, depends_on=['rg']),
+             node('workspace', None, depends_on=['rg']),
+             node('cluster', None, depends_on=['workspace'])]
+    timings = {
+        'rg': cli.dag.Timing(SUCCEEDED, 0, 1, None),
+        'account': cli.dag.Timing(SUCCEEDED, 1, 30, None),
+        'workspace': cli.dag.Timing(SUCCEEDED, 1, 10, None),
+        'cluster': cli.dag.Timing(SUCCEEDED, 10, 20, None),
+    }
+    assert critical_path(nodes, timings) == ['rg', 'account']
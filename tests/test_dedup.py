@@ -0,0 +1,140 @@
+import base64
+import os
+
+from azure.storage.blob import BlockBlobService
+from azure.storage.file import FileService
+from hypothesis import given, settings
+from hypothesis.strategies import binary, dictionaries, from_regex, sampled_from
+import pytest
+
+import cli.dedup
+import cli.local_files
+import cli.remote
+from benchmarks import fake_storage
+
+KEY = base64.b64encode(b'k' * 64).decode()
+
+class MemoryRemote:
+    def __init__(self):
+        self.objects = {}
+        self.puts = []
+        self.gets = []
+
+    def put(self, name, data):
+        self.objects[name] = data
+
+    def put_file(self, name, path):
+        self.puts.append(name)
+        with open(path, 'rb') as local_file:
+            self.objects[name] = local_file.read()
+
+    def exists(self, name):
+        return name in self.objects
+
+    def get(self, name):
+        return self.objects[name]
+
+    def get_to_stream(self, name, stream):
+        self.gets.append(name)
+        stream.write(self.objects[name])
+
+def write_tree(root, files):
+    for relative_path, data in files.items():
+        path = os.path.join(root, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as local_file:
+            local_file.write(data)
+
+def read_tree(root):
+    files = {}
+    for local_file in cli.local_files.scan(root):
+        with open(local_file.path, 'rb') as data:
+            files[local_file.relative_path] = data.read()
+    return files
+
+@settings(max_examples=30, deadline=None)
+@given(dictionaries(from_regex(r'[a-z]{1,6}(/[a-z]{1,6}){0,2}\.bin', fullmatch=True),
+                    sampled_from([b'', b'weights', b'shard' * 1000, b'wheel']),
+                    min_size=1, max_size=12))
+def test_each_content_is_stored_and_fetched_once(tmpdir_factory, files):
+    # one name may not be both a file and a directory
+    if any(other.startswith(name + '/') for name in files for other in files):
+        return
+    source = str(tmpdir_factory.mktemp('source'))
+    write_tree(source, files)
+    remote = MemoryRemote()
+    cli.dedup.upload(remote, list(cli.local_files.scan(source)), 'runs/1', 2)
+    distinct = len(set(files.values()))
+    assert len(remote.puts) == distinct
+    assert cli.dedup.index_name('runs/1') in remote.objects
+
+    cli.dedup.upload(remote, list(cli.local_files.scan(source)), 'runs/2', 2)
+    assert len(remote.puts) == distinct
+
+    target = str(tmpdir_factory.mktemp('target'))
+    cli.dedup.download(remote, target, 'runs/2')
+    assert read_tree(target) == files
+    assert len(remote.gets) == distinct
+
+def test_corrupt_content_is_not_left_behind(tmpdir):
+    source = tmpdir.mkdir('source')
+    source.join('weights.bin').write_binary(b'weights')
+    remote = MemoryRemote()
+    index = cli.dedup.upload(remote, list(cli.local_files.scan(str(source))), None, 1)
+    digest = index['files']['weights.bin'][0]
+    remote.objects[cli.dedup.OBJECT_NAME.format(digest)] = b'tampered'
+    target = tmpdir.mkdir('target')
+    with pytest.raises(ValueError):
+        cli.dedup.download(remote, str(target), None)
+    assert target.listdir() == []
+
+def test_blob_and_file_remotes_store_digests(tmpdir):
+    source = tmpdir.mkdir('source')
+    write_tree(str(source), {'a/wheel.whl': b'wheel', 'b/wheel.whl': b'wheel'})
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        blob_service = BlockBlobService(account_name='acct', account_key=KEY)
+        blob_service.create_container('data')
+        file_service = FileService('acct', KEY)
+        file_service.create_share('data')
+        for remote in [cli.remote.BlobRemote(blob_service, 'data'),
+                       cli.remote.FileRemote(file_service, 'data')]:
+            cli.dedup.upload(remote, list(cli.local_files.scan(str(source))),
+                             'runs/1', 2)
+            target = tmpdir.join('target-' + type(remote).__name__)
+            cli.dedup.download(remote, str(target), 'runs/1',
+                               excludes=['b/*'])
+            assert read_tree(str(target)) == {'a/wheel.whl': b'wheel'}
+        assert sum(name.startswith('pybatchai-cas/')
+                   for name in server.store.containers['data']) == 1
+
+def test_interrupted_share_uploads_are_sent_again(tmpdir):
+    source = tmpdir.mkdir('source')
+    data = os.urandom(2048)
+    source.join('weights.bin').write_binary(data)
+    local_files = list(cli.local_files.scan(str(source)))
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        file_service = FileService('acct', KEY)
+        file_service.create_share('data')
+        file_service.MAX_RANGE_SIZE = 512
+        update_range = file_service.update_range
+        ranges = []
+
+        def interrupted_update_range(*args, **kwargs):
+            ranges.append(args)
+            if len(ranges) == 2:
+                raise ConnectionError('connection reset')
+            return update_range(*args, **kwargs)
+
+        file_service.update_range = interrupted_update_range
+        remote = cli.remote.FileRemote(file_service, 'data')
+        with pytest.raises(ConnectionError):
+            cli.dedup.upload(remote, local_files, None, 1)
+        # the file exists at full size, but is not taken for the content
+        name = cli.dedup.OBJECT_NAME.format(cli.dedup.file_digest(local_files[0].path))
+        assert len(server.store.shares['data']['files'][name].data) == len(data)
+        assert not remote.exists(name)
+
+        file_service.update_range = update_range
+        cli.dedup.upload(remote, local_files, None, 1)
+        assert server.store.shares['data']['files'][name].data == data
+        assert remote.exists(name)
@@ -0,0 +1,44 @@
+import base64
+
+from azure.storage.blob import BlockBlobService
+from azure.storage.file import FileService
+
+from benchmarks import fake_storage
+
+KEY = base64.b64encode(b'k' * 64).decode()
+
+def test_local_url_rewrites_only_storage_hosts():
+    assert fake_storage.local_url(
+        'https://acct.blob.core.windows.net/container/a%20b?comp=list',
+        '127.0.0.1:1') == 'http://127.0.0.1:1/blob/container/a%20b?comp=list'
+    assert fake_storage.local_url('https://management.azure.com/x',
+                                  '127.0.0.1:1') == 'https://management.azure.com/x'
+
+def test_blob_round_trip():
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        service = BlockBlobService(account_name='acct', account_key=KEY)
+        service.MAX_SINGLE_PUT_SIZE = 1024
+        service.MAX_BLOCK_SIZE = 1024
+        assert service.create_container('container')
+        data = bytes(range(256)) * 20
+        service.create_blob_from_bytes('container', 'dir/blob', data)
+        assert service.get_blob_to_bytes('container', 'dir/blob').content == data
+        assert service.get_blob_to_bytes('container', 'dir/blob', start_range=10,
+                                         end_range=19).content == data[10:20]
+        assert [blob.name for blob in service.list_blobs('container')] == ['dir/blob']
+        service.delete_blob('container', 'dir/blob')
+        assert not service.exists('container', 'dir/blob')
+        assert server.store.counters()['operations']['PUT blob block'] == 5
+
+def test_file_round_trip():
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        service = FileService('acct', KEY)
+        assert service.create_share('share')
+        service.create_directory('share', 'dir')
+        data = b'x' * 5000
+        service.create_file_from_bytes('share', 'dir', 'file', data)
+        assert service.get_file_to_bytes('share', 'dir', 'file').content == data
+        assert [entry.name for entry in
+                service.list_directories_and_files('share')] == ['dir']
+        assert [entry.properties.content_length for entry in
+                service.list_directories_and_files('share', 'dir')] == [5000]
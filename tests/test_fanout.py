@@ -0,0 +1,90 @@
+import os
+import socket
+
+from azure.storage.blob import BlockBlobService
+import blobxfer.models.azure as azmodels
+
+import cli.async_http
+import cli.async_transfer
+import cli.fanout
+import cli.local_files
+from benchmarks import fake_storage
+from tests.test_async_transfer import KEY, make_context, write_tree
+
+def destinations(server, source, *targets):
+    context = make_context(server, source)
+    result = []
+    for mode, remote_path in targets:
+        destination = cli.fanout.destination(mode, 'acct/' + remote_path)
+        destination.service = cli.async_transfer.service(context, mode)
+        result.append(destination)
+    return result
+
+def test_each_chunk_is_read_once_for_every_destination(tmpdir, monkeypatch):
+    source = tmpdir.mkdir('source')
+    files = write_tree(source)
+    reads = []
+    read_range = cli.async_transfer.read_range
+
+    async def counting_read_range(path, offset, size):
+        reads.append((path, offset))
+        return await read_range(path, offset, size)
+
+    monkeypatch.setattr(cli.async_transfer, 'read_range', counting_read_range)
+    with fake_storage.running() as server:
+        targets = destinations(server, source,
+                               (azmodels.StorageModes.Block, 'data'),
+                               (azmodels.StorageModes.Block, 'data/copy'),
+                               (azmodels.StorageModes.File, 'data/runs/1'))
+        local_files = list(cli.local_files.scan(str(source)))
+        cli.async_http.run(cli.fanout.upload_files(targets, 4, 64 * 1024, local_files))
+        blobs = server.store.containers['data']
+        for name, data in files.items():
+            assert blobs[name].data == data
+            assert blobs['copy/' + name].data == data
+            assert server.store.shares['data']['files']['runs/1/' + name].data == data
+    assert len(reads) == len(set(reads)) == 7
+    assert all(target.files == 4 and target.bytes == sum(map(len, files.values()))
+               for target in targets)
+
+def test_a_failing_destination_does_not_stop_the_others(tmpdir):
+    source = tmpdir.mkdir('source')
+    source.join('a.txt').write_binary(os.urandom(300 * 1024))
+    with fake_storage.running() as server:
+        # the share missing is never created, so every request to it fails
+        targets = destinations(server, source,
+                               (azmodels.StorageModes.File, 'missing'),
+                               (azmodels.StorageModes.Block, 'data'))
+        local_files = list(cli.local_files.scan(str(source)))
+        cli.async_http.run(cli.fanout.upload_files(targets, 4, 64 * 1024, local_files))
+        assert targets[0].error is not None and targets[0].files == 0
+        assert targets[1].error is None and targets[1].files == 1
+        assert server.store.containers['data']['a.txt'].data == \
+            source.join('a.txt').read_binary()
+
+def test_a_stalled_destination_does_not_hold_up_the_others(tmpdir, monkeypatch):
+    monkeypatch.setattr(cli.fanout, 'STEP_TIMEOUT', 0.2)
+    source = tmpdir.mkdir('source')
+    source.join('a.txt').write_binary(os.urandom(300 * 1024))
+    # accepts connections but never answers
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    try:
+        with fake_storage.running() as server:
+            targets = destinations(server, source,
+                                   (azmodels.StorageModes.Block, 'stalled'),
+                                   (azmodels.StorageModes.Block, 'data'))
+            targets[0].service = BlockBlobService(
+                account_name='acct', account_key=KEY, protocol='http',
+                custom_domain='127.0.0.1:{}/blob'.format(
+                    listener.getsockname()[1]))
+            local_files = list(cli.local_files.scan(str(source)))
+            cli.async_http.run(cli.fanout.upload_files(targets, 4, 64 * 1024,
+                                                       local_files))
+            assert isinstance(targets[0].error, cli.async_http.TimedOut)
+            assert targets[1].error is None and targets[1].files == 1
+            assert server.store.containers['data']['a.txt'].data == \
+                source.join('a.txt').read_binary()
+    finally:
+        listener.close()
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import cli.key_cache
+import cli.storage
+
+def make_context(tmpdir, aad_key='secret', key_cache_ttl=60):
+    return SimpleNamespace(obj={
+        'subscription_id': 'a2cfad07-90d4-4e4c-9227-095d90fcc7dd',
+        'resource_group': 'rg',
+        'storage_account': 'mystorage',
+        'aad_app_id': '6b8f1c36-4a1e-4a7c-9d8f-0c1f1d2e3f40',
+        'aad_key': aad_key,
+        'cache_dir': str(tmpdir),
+        'key_cache_ttl': key_cache_ttl
+    })
+
+def set_key_lister(context, keys):
+    calls = []
+
+    def list_keys(resource_group, account_name):
+        calls.append(account_name)
+        return SimpleNamespace(keys=[SimpleNamespace(key_name='key1',
+                                                     value=keys[len(calls) - 1])])
+    context.obj['storage_client'] = SimpleNamespace(
+        storage_accounts=SimpleNamespace(list_keys=list_keys))
+    return calls
+
+def test_key_round_trip_is_encrypted(tmpdir):
+    context = make_context(tmpdir)
+    cli.key_cache.store(context, 'storage-key')
+    assert cli.key_cache.load(context) == 'storage-key'
+    assert 'storage-key' not in tmpdir.join(cli.key_cache.KEY_CACHE_FILE).read()
+
+def test_other_secret_cannot_read_key(tmpdir):
+    cli.key_cache.store(make_context(tmpdir), 'storage-key')
+    assert cli.key_cache.load(make_context(tmpdir, aad_key='other')) is None
+
+def test_expired_key_is_ignored(tmpdir):
+    cli.key_cache.store(make_context(tmpdir, key_cache_ttl=0), 'storage-key')
+    assert cli.key_cache.load(make_context(tmpdir)) is None
+
+def test_key_is_listed_once_across_commands(tmpdir):
+    first, second = make_context(tmpdir), make_context(tmpdir)
+    first_calls = set_key_lister(first, ['key-a'])
+    second_calls = set_key_lister(second, ['key-b'])
+
+    for _ in range(2):
+        cli.storage.set_storage_account_key(first)
+    cli.storage.set_storage_account_key(second)
+
+    assert len(first_calls) == 1 and not second_calls
+    assert second.obj['storage_account_key'] == 'key-a'
+
+def test_refresh_replaces_cached_key(tmpdir):
+    context = make_context(tmpdir)
+    calls = set_key_lister(context, ['old-key', 'new-key'])
+
+    cli.storage.set_storage_account_key(context)
+    cli.storage.set_storage_account_key(context, refresh=True)
+
+    assert len(calls) == 2
+    assert context.obj['storage_account_key'] == 'new-key'
+    assert cli.key_cache.load(context) == 'new-key'
@@ -0,0 +1,62 @@
+import itertools
+
+from hypothesis import given
+from hypothesis.strategies import integers
+import pytest
+
+import cli.async_http
+import cli.lro
+from cli.lro import OperationTimeout, Status, backoff_delays, wait, wait_async
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def clock(self):
+        return self.now
+
+def statuses(*retry_afters):
+    pending = [Status(False, None, retry_after) for retry_after in retry_afters]
+    return iter(pending + [Status(True, 'done', None)])
+
+@given(integers(min_value=1, max_value=20))
+def test_backoff_delays_grow_within_bounds(count):
+    delays = list(itertools.islice(backoff_delays(2, 60), count))
+    for index, delay in enumerate(delays):
+        ceiling = min(2 * 2 ** index, 60)
+        assert ceiling / 2 <= delay <= ceiling
+
+def test_wait_honors_retry_after():
+    clock = FakeClock()
+    checks = statuses(None, 30)
+    result = wait(lambda: next(checks), delays=iter([1, 1]),
+                  sleep=clock.sleep, clock=clock.clock)
+    assert result == 'done'
+    assert clock.sleeps == [1, 30]
+
+def test_wait_times_out():
+    clock = FakeClock()
+    with pytest.raises(OperationTimeout):
+        wait(lambda: Status(False, None, None), timeout=10,
+             delays=itertools.repeat(4), sleep=clock.sleep, clock=clock.clock)
+    assert clock.now == 10
+
+def test_wait_async():
+    checks = statuses(None)
+    result = cli.async_http.run(wait_async(lambda: next(checks),
+                                           delays=itertools.repeat(0)))
+    assert result == 'done'
+
+def test_retry_after_parses_seconds_and_dates():
+    class Response(object):
+        def __init__(self, value):
+            self.headers = {'Retry-After': value} if value else {}
+
+    assert cli.lro.retry_after(Response('7')) == 7
+    assert cli.lro.retry_after(Response('Wed, 21 Oct 2015 07:28:00 GMT')) == 0
+    assert cli.lro.retry_after(Response(None)) is None
@@ -0,0 +1,34 @@
+import os
+
+import cli.local_files
+import cli.manifest
+
+def changes_after(connection, local_path):
+    return cli.manifest.compare(connection,
+                                list(cli.local_files.scan(local_path)))
+
+def test_only_changed_files_are_sent_again(tmpdir):
+    source = tmpdir.mkdir('source')
+    source.join('train.py').write('print(1)')
+    source.mkdir('conf').join('model.json').write('{}')
+    source.join('README').write('readme')
+    connection = cli.manifest.connect(str(tmpdir.join('manifest.sqlite')))
+
+    changes = changes_after(connection, str(source))
+    assert len(changes.changed) == 3
+    cli.manifest.record(connection, changes.changed, changes.touched, [])
+    assert changes_after(connection, str(source)) == ([], [], [])
+
+    source.join('train.py').write('print(2)')
+    source.join('README').remove()
+    conf = source.join('conf', 'model.json')
+    os.utime(str(conf), (1, 1))
+    changes = changes_after(connection, str(source))
+
+    assert [f.relative_path for f in changes.changed] == ['train.py']
+    assert [f.relative_path for f, _ in changes.touched] == ['conf/model.json']
+    assert changes.deleted == ['README']
+
+    cli.manifest.record(connection, changes.changed, changes.touched,
+                        changes.deleted)
+    assert changes_after(connection, str(source)) == ([], [], [])
@@ -0,0 +1,122 @@
+import base64
+import os
+import tempfile
+
+from azure.storage.blob import BlockBlobService
+from azure.storage.file import FileService
+from hypothesis import given, settings
+from hypothesis.strategies import binary, dictionaries, from_regex
+
+import cli.pack
+import cli.remote
+from benchmarks import fake_storage
+
+class MemoryRemote:
+    def __init__(self):
+        self.objects = {}
+
+    def put(self, name, data):
+        self.objects[name] = data
+
+    def put_stream(self, name, stream, size):
+        self.objects[name] = stream.read()
+        assert len(self.objects[name]) == size
+
+    def get(self, name):
+        return self.objects[name]
+
+    def get_range(self, name, start, end):
+        return self.objects[name][start:end + 1]
+
+    def get_to_stream(self, name, stream):
+        data = self.objects[name]
+        for start in range(0, len(data), 4096):
+            stream.write(data[start:start + 4096])
+
+def write_tree(root, files):
+    for relative_path, data in files.items():
+        path = os.path.join(root, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as local_file:
+            local_file.write(data)
+
+def read_tree(root):
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as local_file:
+                files[os.path.relpath(path, root).replace(os.sep, '/')] = \
+                    local_file.read()
+    return files
+
+@settings(max_examples=20, deadline=None)
+@given(dictionaries(from_regex(r'\A[a-z]{1,8}(/[a-z]{1,8}){0,2}\.txt\Z'),
+                    binary(max_size=3000), min_size=1, max_size=30))
+def test_pack_round_trip(tmp_path_factory, files):
+    source = str(tmp_path_factory.mktemp('source'))
+    dest = str(tmp_path_factory.mktemp('dest'))
+    write_tree(source, files)
+    remote = MemoryRemote()
+    index = cli.pack.upload(remote, source, shard_size_bytes=8192)
+    assert sorted(index['files']) == sorted(files)
+    cli.pack.download(remote, dest)
+    assert read_tree(dest) == files
+
+def test_member_download_reads_only_its_range(tmp_path):
+    source, dest = str(tmp_path / 'source'), str(tmp_path / 'dest')
+    files = {'a/one.txt': b'1' * 5000, 'b/two.txt': b'two', 'empty.txt': b''}
+    write_tree(source, files)
+    remote = MemoryRemote()
+    cli.pack.upload(remote, source, shard_size_bytes=1)
+    assert len([name for name in remote.objects if name.endswith('.tar')]) == 3
+    ranges = []
+    get_range = remote.get_range
+    remote.get_range = lambda name, start, end: ranges.append((start, end)) or \
+        get_range(name, start, end)
+    cli.pack.download(remote, dest, members=['b/two.txt', 'empty.txt', 'missing'])
+    assert read_tree(dest) == {'b/two.txt': b'two', 'empty.txt': b''}
+    assert [end - start + 1 for start, end in ranges] == [3]
+
+def test_shards_over_the_shard_size_are_not_built_in_memory(tmp_path,
+                                                             monkeypatch):
+    shards = []
+
+    class Shard(tempfile.SpooledTemporaryFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.on_disk = False
+            shards.append(self)
+
+        def rollover(self):
+            self.on_disk = True
+            super().rollover()
+
+    monkeypatch.setattr(tempfile, 'SpooledTemporaryFile', Shard)
+    source, dest = str(tmp_path / 'source'), str(tmp_path / 'dest')
+    files = {'small.txt': b'small', 'large.bin': os.urandom(64 * 1024),
+             'tail.txt': b'tail'}
+    write_tree(source, files)
+    remote = MemoryRemote()
+    cli.pack.upload(remote, source, shard_size_bytes=16 * 1024)
+    # large.bin closes the first shard, tail.txt is left for a second one
+    assert [shard.on_disk for shard in shards] == [True, False]
+    cli.pack.download(remote, dest)
+    assert read_tree(dest) == files
+
+def test_blob_and_file_remotes_store_shards(tmp_path):
+    source = str(tmp_path / 'source')
+    files = {'a/one.txt': b'1' * 5000, 'b/two.bin': os.urandom(100 * 1024)}
+    write_tree(source, files)
+    key = base64.b64encode(b'k' * 64).decode()
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        blob_service = BlockBlobService(account_name='acct', account_key=key)
+        blob_service.create_container('data')
+        file_service = FileService('acct', key)
+        file_service.create_share('data')
+        for remote in [cli.remote.BlobRemote(blob_service, 'data'),
+                       cli.remote.FileRemote(file_service, 'data')]:
+            cli.pack.upload(remote, source, shard_size_bytes=8192)
+            dest = str(tmp_path / ('dest-' + type(remote).__name__))
+            cli.pack.download(remote, dest)
+            assert read_tree(dest) == files
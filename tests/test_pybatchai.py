@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+import pytest
+
+import benchmarks.startup
+from benchmarks.startup import HELP_COMMAND, ROOT, command_imports
+import pybatchai
+
+HEAVY_PACKAGES = ('azure', 'blobxfer', 'coloredlogs', 'msrest', 'msrestazure')
+
+def loaded_heavy_packages(code):
+    check = ('import sys; {}; print(sorted({{m.split(".")[0] for m in sys.modules}}'
+             ' & set({!r})))').format(code, HEAVY_PACKAGES)
+    output = subprocess.check_output([sys.executable, '-c', check], cwd=ROOT,
+                                     universal_newlines=True)
+    return output.strip()
+
+def test_module_load_imports_no_sdk():
+    assert loaded_heavy_packages('import pybatchai') == '[]'
+
+def test_validation_imports_no_sdk():
+    assert loaded_heavy_packages('import cli.validation') == '[]'
+
+def test_every_command_declares_its_imports():
+    commands = command_imports(pybatchai.main, pybatchai)
+    assert commands.pop(HELP_COMMAND) == []
+    assert commands
+    for imports in commands.values():
+        assert imports
+
+@pytest.mark.parametrize('importtime', [True, False])
+def test_import_time_is_measured(monkeypatch, importtime):
+    # Python 3.6 ignores -X importtime, and falls back on the wall clock
+    monkeypatch.setattr(benchmarks.startup, 'IMPORTTIME', importtime)
+    assert benchmarks.startup.time_imports(['import json'], 1) > 0
+
+def test_import_time_output_without_imports_is_an_error():
+    with pytest.raises(RuntimeError):
+        benchmarks.startup.sum_self_time('')
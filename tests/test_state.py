@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import cli.state
+
+def make_context(tmpdir, state_ttl):
+    return SimpleNamespace(obj={
+        'subscription_id': 'a2cfad07-90d4-4e4c-9227-095d90fcc7dd',
+        'resource_group': 'rg',
+        'cache_dir': str(tmpdir),
+        'state_ttl': state_ttl
+    })
+
+def test_cached_results_skip_lookup(tmpdir):
+    context = make_context(tmpdir, state_ttl=60)
+    lookups = []
+
+    def check():
+        lookups.append(True)
+        return False
+
+    assert not cli.state.exists(context, 'cluster', 'ws/c1', check)
+    assert not cli.state.exists(context, 'cluster', 'ws/c1', check)
+    assert len(lookups) == 1
+
+def test_record_overrides_cached_result(tmpdir):
+    context = make_context(tmpdir, state_ttl=60)
+    cli.state.exists(context, 'resource group', 'rg', lambda: False)
+    cli.state.record(context, 'resource group', 'rg', True)
+    assert cli.state.cached(context, 'resource group', 'rg') is True
+
+def test_zero_ttl_always_looks_up(tmpdir):
+    context = make_context(tmpdir, state_ttl=0)
+    lookups = []
+    for _ in range(2):
+        cli.state.exists(context, 'cluster', 'ws/c1',
+                         lambda: lookups.append(True) or True)
+    assert len(lookups) == 2
+    assert cli.state.cached(context, 'cluster', 'ws/c1') is None
+
+def test_known_state_is_shared_without_a_ttl(tmpdir):
+    context = make_context(tmpdir, state_ttl=0)
+    context.obj['known_state'] = {}
+    other = SimpleNamespace(obj=dict(context.obj))
+    lookups = []
+    cli.state.exists(context, 'storage account', 'acct',
+                     lambda: lookups.append(True) or True)
+    assert cli.state.exists(other, 'storage account', 'acct',
+                            lambda: lookups.append(True) or True)
+    assert len(lookups) == 1
@@ -0,0 +1,118 @@
+import itertools
+import threading
+import types
+
+import click
+import pytest
+import requests
+from msrest.exceptions import ClientRequestError
+from msrestazure.azure_exceptions import CloudError
+
+import cli.lro
+import cli.sweep
+
+SPEC = {'experiment': 'lr-sweep',
+        'command_line': 'python train.py --lr {lr} --batch-size {batch}',
+        'std_out_err_path_prefix': '$AZ_BATCHAI_MOUNT_ROOT/logs',
+        'environment_variables': {'SEED': '{seed}'},
+        'grid': {'lr': [0.1, 0.01], 'batch': [32, 64, 128]},
+        'parameters': [{'seed': 1}, {'seed': 2}]}
+
+def cloud_error(status_code, retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    response._content = b''
+    return CloudError(response)
+
+class FakeJobs:
+    def __init__(self, throttled=0, existing=(), unreachable=()):
+        self.lock = threading.Lock()
+        self.throttled = throttled
+        self.created = {}
+        self.existing = set(existing)
+        self.unreachable = set(unreachable)
+
+    def create(self, resource_group, workspace, experiment, name, parameters,
+               polling):
+        with self.lock:
+            if name in self.unreachable:
+                raise ClientRequestError('connection reset')
+            if self.throttled:
+                self.throttled -= 1
+                raise cloud_error(429, retry_after=0)
+            if name in self.existing or name in self.created:
+                raise cloud_error(409)
+            self.created[name] = parameters
+
+def sweep_context(tmp_path, jobs):
+    client = types.SimpleNamespace(
+        jobs=jobs,
+        clusters=types.SimpleNamespace(
+            get=lambda *args: types.SimpleNamespace(id='/clusters/c')),
+        experiments=types.SimpleNamespace(get=lambda *args: object()))
+    return types.SimpleNamespace(obj={
+        'batchai_client': client, 'resource_group': 'rg', 'workspace': 'ws',
+        'cluster_name': 'c', 'cache_dir': str(tmp_path), 'state_ttl': 0})
+
+def test_grid_and_list_expand_to_stable_unique_names():
+    definitions = cli.sweep.job_definitions(SPEC)
+    assert len(definitions) == 12
+    assert definitions == cli.sweep.job_definitions(dict(SPEC))
+    assert len({name for name, _ in definitions}) == 12
+    assert all(name.startswith('lr-sweep-') for name, _ in definitions)
+    assert definitions[0][1] == {'batch': 32, 'lr': 0.1, 'seed': 1}
+
+def test_unknown_placeholder_and_duplicate_names_are_rejected():
+    with pytest.raises(click.BadParameter):
+        cli.sweep.job_definitions(dict(SPEC, command_line='train --x {x}'))
+    with pytest.raises(click.BadParameter):
+        cli.sweep.job_definitions(dict(SPEC, job_name='lr-{lr}'))
+
+def test_sweep_backs_off_when_throttled_and_resumes_without_duplicates(
+        tmp_path, monkeypatch):
+    monkeypatch.setattr(cli.lro, 'backoff_delays', lambda: itertools.repeat(0.01))
+    names = [name for name, _ in cli.sweep.job_definitions(SPEC)]
+    # the first five were submitted before an interruption, the fifth unrecorded
+    with open(cli.sweep.checkpoint_path(sweep_context(tmp_path, None), 'lr-sweep'),
+              'w') as checkpoint:
+        checkpoint.write('\n'.join(names[:4]) + '\n' + names[4][:3])
+    jobs = FakeJobs(throttled=3, existing=names[:5])
+    counts = cli.sweep.sweep(sweep_context(tmp_path, jobs), SPEC, workers=4)
+    assert counts == {cli.sweep.SUBMITTED: 7, cli.sweep.ALREADY_SUBMITTED: 1,
+                      cli.sweep.FAILED: 0}
+    assert sorted(jobs.created) == sorted(names[5:])
+    parameters = jobs.created[names[5]]
+    assert parameters.cluster.id == '/clusters/c'
+    assert parameters.custom_toolkit_settings.command_line == \
+        'python train.py --lr 0.01 --batch-size 128'
+    counts = cli.sweep.sweep(sweep_context(tmp_path, jobs), SPEC, workers=4)
+    assert counts == {cli.sweep.SUBMITTED: 0, cli.sweep.ALREADY_SUBMITTED: 0,
+                      cli.sweep.FAILED: 0}
+
+def test_connection_errors_fail_one_job_not_the_sweep(tmp_path):
+    names = [name for name, _ in cli.sweep.job_definitions(SPEC)]
+    jobs = FakeJobs(unreachable=names[:2])
+    counts = cli.sweep.sweep(sweep_context(tmp_path, jobs), SPEC, workers=4)
+    assert counts == {cli.sweep.SUBMITTED: 10, cli.sweep.ALREADY_SUBMITTED: 0,
+                      cli.sweep.FAILED: 2}
+    jobs.unreachable.clear()
+    counts = cli.sweep.sweep(sweep_context(tmp_path, jobs), SPEC, workers=4)
+    assert counts[cli.sweep.SUBMITTED] == 2
+    assert sorted(jobs.created) == sorted(names)
+
+def test_throttle_pauses_every_worker():
+    now = types.SimpleNamespace(value=0.0)
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now.value += seconds
+
+    throttle = cli.sweep.Throttle(sleep=sleep, clock=lambda: now.value)
+    throttle.pause(5)
+    throttle.pause(2)
+    throttle.wait()
+    throttle.wait()
+    assert sleeps == [5]
@@ -0,0 +1,73 @@
+import base64
+import io
+import types
+
+from azure.storage.file import FileService
+
+import cli.tail
+from benchmarks import fake_storage
+
+KEY = base64.b64encode(b'k' * 64).decode()
+
+class FakeFiles:
+    def __init__(self, **contents):
+        self.contents = contents
+        self.reads = []
+
+    def sizes(self):
+        return {name: len(data) for name, data in self.contents.items()}
+
+    def read(self, name, start, end):
+        self.reads.append((name, start, end))
+        return self.contents[name][start:end + 1]
+
+def test_last_lines_and_only_new_bytes():
+    files = FakeFiles(log=b'one\ntwo\nthree\n')
+    offsets, out = {}, io.BytesIO()
+    cli.tail.tail(files, offsets, lines=2, out=out)
+    assert out.getvalue() == b'two\nthree\n'
+    files.contents['log'] += b'four\n'
+    files.reads.clear()
+    cli.tail.tail(files, offsets, out=out)
+    assert out.getvalue() == b'two\nthree\nfour\n'
+    assert files.reads == [('log', 14, 18)]
+    assert offsets == {'log': 19}
+
+def test_large_growth_is_read_in_chunks(monkeypatch):
+    monkeypatch.setattr(cli.tail, 'CHUNK_BYTES', 4)
+    files = FakeFiles(log=b'')
+    offsets, out = {}, io.BytesIO()
+    cli.tail.tail(files, offsets, out=out)
+    files.contents['log'] = b'0123456789'
+    cli.tail.tail(files, offsets, out=out)
+    assert out.getvalue() == b'0123456789'
+    assert files.reads == [('log', 0, 3), ('log', 4, 7), ('log', 8, 9)]
+
+def test_follow_shows_new_files_with_headers_until_finished():
+    files = FakeFiles(stdout=b'a\n')
+    finished = iter([False, False, True])
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        files.contents['stdout'] += b'b\n'
+        files.contents.setdefault('stderr', b'oops\n')
+
+    out = io.BytesIO()
+    cli.tail.tail(files, {}, follow=True, finished=lambda: next(finished),
+                  out=out, sleep=sleep)
+    assert out.getvalue() == (b'a\n==> stderr <==\noops\n'
+                              b'\n==> stdout <==\nb\nb\n')
+    assert sleeps == [2, 2]
+
+def test_fileshare_files_list_directories_once_per_poll():
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        service = FileService('acct', KEY)
+        service.create_share('share')
+        service.create_directory('share', 'job')
+        service.create_directory('share', 'job/stdouterr')
+        service.create_file_from_bytes('share', 'job/stdouterr', 'stdout.txt', b'x\ny\n')
+        service.create_file_from_bytes('share', 'job', 'other.txt', b'z')
+        files = cli.tail.FileshareFiles(service, 'share', ['job/stdouterr', 'job/other.txt'])
+        assert files.sizes() == {'job/stdouterr/stdout.txt': 4, 'job/other.txt': 1}
+        assert files.read('job/stdouterr/stdout.txt', 2, 3) == b'y\n'
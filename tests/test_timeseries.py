@@ -0,0 +1,81 @@
+import os
+import tempfile
+import types
+
+import pytest
+from hypothesis import given, strategies as st
+
+import cli.timeseries
+import cli.utilization
+from cli.timeseries import Sample
+
+def sample(time, target=2, current=2, idle=0, running=2):
+    return Sample(time, target, current, idle, running, 0, 0, 0)
+
+@given(st.lists(st.floats(min_value=0, max_value=1e9), min_size=1, max_size=50,
+                unique=True))
+def test_index_at_finds_first_sample_at_or_after(times):
+    times = sorted(times)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ws', 'c.series')
+        for time in times:
+            cli.timeseries.append(path, sample(time), 60)
+        with cli.timeseries.Series(path) as series:
+            assert len(series) == len(times)
+            assert series.interval == 60
+            for index, time in enumerate(times):
+                assert series.index_at(time) == index
+                assert series[index].time == time
+            assert series.index_at(times[-1] + 1) == len(times)
+
+def test_partial_record_is_overwritten(tmp_path):
+    path = str(tmp_path / 'c.series')
+    cli.timeseries.append(path, sample(0), 60)
+    with open(path, 'ab') as series_file:
+        series_file.write(b'\0' * 5)
+    cli.timeseries.append(path, sample(60, running=1), 60)
+    with cli.timeseries.Series(path) as series:
+        assert list(series.samples()) == [sample(0), sample(60, running=1)]
+
+def test_rejects_files_that_are_not_series(tmp_path):
+    path = tmp_path / 'c.series'
+    path.write_bytes(b'not a series at all')
+    with pytest.raises(cli.timeseries.FormatError):
+        cli.timeseries.Series(str(path))
+
+def test_summarize_integrates_window_and_scale_up_latency(tmp_path):
+    path = str(tmp_path / 'c.series')
+    for time, target, current, idle, running in [
+            (0, 2, 2, 0, 2), (60, 4, 2, 2, 0), (120, 4, 4, 2, 0),
+            (180, 4, 4, 4, 0), (1000, 4, 4, 0, 4)]:
+        cli.timeseries.append(path, sample(time, target, current, idle, running), 60)
+    with cli.timeseries.Series(path) as series:
+        usage = cli.utilization.summarize(series, 30, 1030)
+    # 30-60 at 2 nodes, 60-120 at 2, 120-300 at 4 until the gap, 1000-1030 at 4
+    assert usage['observed_hours'] == pytest.approx(300 / 3600)
+    assert usage['allocated_node_hours'] == pytest.approx(
+        (30 * 2 + 60 * 2 + 180 * 4 + 30 * 4) / 3600)
+    assert usage['running_node_hours'] == pytest.approx((30 * 2 + 30 * 4) / 3600)
+    assert usage['idle_node_hours'] == pytest.approx((60 * 2 + 60 * 2 + 120 * 4) / 3600)
+    assert usage['scale_ups'] == 1
+    assert usage['scale_up_max_s'] == 120
+
+def test_record_skips_missing_clusters(tmp_path, monkeypatch):
+    rows = [{'workspace': 'ws', 'name': 'a', 'allocation_state': 'steady',
+             'target': 1, 'current': 1, 'idle': 1, 'running': 0,
+             'preparing': None, 'leaving': None, 'unusable': None},
+            {'workspace': 'ws', 'name': 'b', 'allocation_state': 'not found'}]
+    monkeypatch.setattr('cli.cluster_status.fetch_rows', lambda *args: rows)
+    context = types.SimpleNamespace(obj={'resource_group': 'rg'})
+    cli.utilization.record(context, ['ws'], str(tmp_path), 30, samples=2,
+                           sleep=lambda seconds: None, clock=iter([0, 1, 30, 31]).__next__)
+    assert cli.utilization.recorded_clusters(str(tmp_path), 'rg', []) == [
+        ('ws/a', str(tmp_path / 'rg' / 'ws' / 'a.series'))]
+    with cli.timeseries.Series(str(tmp_path / 'rg' / 'ws' / 'a.series')) as series:
+        assert list(series.samples()) == [Sample(0, 1, 1, 1, 0, 0, 0, 0),
+                                          Sample(30, 1, 1, 1, 0, 0, 0, 0)]
+
+def test_parse_time():
+    assert cli.utilization.parse_time('now', now=1000.0) == 1000.0
+    assert cli.utilization.parse_time('90m', now=10000.0) == 4600.0
+    assert cli.utilization.parse_time('1970-01-02T00:00:00') == 86400.0
@@ -0,0 +1,48 @@
+import os
+import stat
+import time
+
+from hypothesis import given
+from hypothesis.strategies import integers
+
+import cli.token_cache
+from cli.token_cache import REFRESH_MARGIN, get_credentials, token_is_fresh
+
+DIRECTORY_ID = 'a2cfad07-90d4-4e4c-9227-095d90fcc7dd'
+APP_ID = '6b8f1c36-4a1e-4a7c-9d8f-0c1f1d2e3f40'
+
+@given(integers(min_value=0, max_value=10 ** 10))
+def test_token_is_fresh(now):
+    assert token_is_fresh({'expires_on': now + REFRESH_MARGIN + 1}, now=now)
+    assert not token_is_fresh({'expires_on': now + REFRESH_MARGIN}, now=now)
+
+def test_token_without_expiry_is_stale():
+    assert not token_is_fresh({'access_token': 'token'})
+
+def test_cache_hit_skips_fetch(tmpdir, monkeypatch):
+    fetches = []
+
+    def fetch_token(*args):
+        fetches.append(args)
+        return {'access_token': 'token', 'expires_on': time.time() + 3600}
+    monkeypatch.setattr(cli.token_cache, 'fetch_token', fetch_token)
+
+    first = get_credentials(DIRECTORY_ID, APP_ID, 'key', cache_dir=str(tmpdir))
+    second = get_credentials(DIRECTORY_ID, APP_ID, 'key', cache_dir=str(tmpdir))
+
+    assert len(fetches) == 1
+    assert first.token == second.token
+    cache_file = os.path.join(str(tmpdir), cli.token_cache.TOKEN_CACHE_FILE)
+    assert stat.S_IMODE(os.stat(cache_file).st_mode) == 0o600
+
+def test_expiring_token_is_refetched(tmpdir, monkeypatch):
+    expiries = iter([time.time() + REFRESH_MARGIN - 1, time.time() + 3600])
+    monkeypatch.setattr(cli.token_cache, 'fetch_token',
+                        lambda *args: {'access_token': 'token',
+                                       'expires_on': next(expiries)})
+
+    get_credentials(DIRECTORY_ID, APP_ID, 'key', cache_dir=str(tmpdir))
+    credentials = get_credentials(DIRECTORY_ID, APP_ID, 'key',
+                                  cache_dir=str(tmpdir))
+
+    assert token_is_fresh(credentials.token)
@@ -0,0 +1,92 @@
+import base64
+import json
+import logging
+import urllib.parse
+
+import pytest
+import requests
+from azure.storage.blob import BlockBlobService
+
+import cli.trace
+from benchmarks import fake_storage
+
+KEY = base64.b64encode(b'k' * 64).decode()
+
+@cli.trace.traced
+def upload(service, data):
+    service.create_container('data')
+    service.create_blob_from_bytes('data', 'a.txt', data)
+    return service.get_blob_to_bytes('data', 'a.txt').content
+
+@pytest.fixture
+def tracer():
+    tracer = cli.trace.start(clock=iter(range(1000)).__next__)
+    yield tracer
+    cli.trace.stop()
+
+@pytest.mark.parametrize('method,url,name', [
+    ('POST', 'https://management.azure.com/subscriptions/s/resourceGroups/rg/providers/'
+             'Microsoft.Storage/storageAccounts/acct/listKeys?api-version=1',
+     'POST Microsoft.Storage/storageAccounts/listKeys'),
+    ('POST', 'https://management.azure.com/subscriptions/s/providers/'
+             'Microsoft.Storage/checkNameAvailability',
+     'POST Microsoft.Storage/checkNameAvailability'),
+    ('HEAD', 'https://management.azure.com/subscriptions/s/resourcegroups/rg',
+     'HEAD subscriptions/resourcegroups'),
+    ('PUT', 'https://acct.blob.core.windows.net/data/a.txt?comp=block&blockid=x',
+     'PUT blob block'),
+    ('GET', 'https://acct.blob.core.windows.net/data?restype=container&comp=list',
+     'GET blob container list'),
+    ('POST', 'https://login.microsoftonline.com/tenant/oauth2/token',
+     'POST login.microsoftonline.com'),
+])
+def test_operation_names_leave_out_resource_names(method, url, name):
+    assert cli.trace.operation_name(method, urllib.parse.urlsplit(url)) == name
+
+def test_phases_and_azure_calls_are_traced(tracer):
+    with fake_storage.running() as server, fake_storage.redirect(server.address):
+        service = BlockBlobService(account_name='acct', account_key=KEY)
+        assert upload(service, b'x' * 1000) == b'x' * 1000
+    events = {event['name']: event for event in tracer.events}
+    phase = events[upload.__module__ + '.upload']
+    put = events['PUT blob']
+    assert phase['cat'] == cli.trace.PHASE
+    assert put['cat'] == cli.trace.HTTP
+    assert put['args'] == dict(put['args'], method='PUT', path='/data/a.txt',
+                               status=201, retries=0, bytes_sent=1000)
+    assert events['GET blob']['args']['bytes_received'] == 1000
+    # HTTP spans nest inside the phase that made them
+    assert phase['ts'] < put['ts'] and put['ts'] + put['dur'] < phase['ts'] + phase['dur']
+    summary = {row['name']: row for row in cli.trace.summarize(tracer)}
+    assert summary['PUT blob']['bytes_sent'] == 1000
+
+def test_failures_are_recorded(tracer):
+    with pytest.raises(requests.ConnectionError):
+        requests.get('http://127.0.0.1:9/')
+    assert tracer.events[0]['args']['error'] == 'ConnectionError'
+
+def test_disabled_tracing_leaves_requests_alone():
+    send = requests.Session.send
+    cli.trace.start()
+    assert requests.Session.send is cli.trace.traced_send
+    cli.trace.stop()
+    assert requests.Session.send is send
+    with cli.trace.span('ignored') as args:
+        args['bytes'] = 1
+    assert cli.trace.TRACER is None
+
+def test_finish_writes_chrome_trace_and_profile(tmpdir, caplog):
+    path = str(tmpdir.join('trace.json'))
+    cli.trace.start()
+    with cli.trace.span('phase one', retries=2):
+        pass
+    with caplog.at_level(logging.INFO):
+        cli.trace.finish('pybatchai storage', path, profile=True)
+    with open(path) as trace_file:
+        trace = json.load(trace_file)
+    names = [event['name'] for event in trace['traceEvents']]
+    assert names[0] == 'thread_name'
+    assert {'phase one', 'pybatchai storage'} <= set(names)
+    assert all(event['ph'] in ('M', 'X') for event in trace['traceEvents'])
+    assert 'phase one' in caplog.text
+    assert cli.trace.TRACER is None
@@ -0,0 +1,38 @@
+from hypothesis import given
+from hypothesis.strategies import integers, lists
+
+from cli.tuning import (
+    MAX_BLOCK_BYTES,
+    MAX_FILE_RANGE_BYTES,
+    MiB,
+    TransferPlan,
+    adjust_for_history,
+    plan_transfer
+)
+
+@given(lists(integers(min_value=0, max_value=200 * 1024 * MiB), min_size=1),
+       integers(min_value=1, max_value=64),
+       integers(min_value=64, max_value=64 * 1024))
+def test_plan_stays_within_budget(sizes, cpu_budget, memory_budget_mb):
+    memory_budget = memory_budget_mb * MiB
+    plan = plan_transfer(sizes, cpu_budget, memory_budget, MAX_FILE_RANGE_BYTES)
+    assert plan.transfer_threads >= 1 and plan.disk_threads >= 1
+    assert plan.chunk_size_bytes <= MAX_FILE_RANGE_BYTES
+    in_flight = (plan.transfer_threads + plan.disk_threads) * plan.chunk_size_bytes
+    assert in_flight <= max(memory_budget, 2 * plan.chunk_size_bytes)
+
+def test_small_files_get_more_threads_than_large_files():
+    small = plan_transfer([512] * 100000, 4, 1024 * MiB, MAX_BLOCK_BYTES)
+    large = plan_transfer([50 * 1024 * MiB] * 3, 4, 1024 * MiB, MAX_BLOCK_BYTES)
+    assert small.transfer_threads > large.transfer_threads
+    assert small.chunk_size_bytes < large.chunk_size_bytes
+
+def test_history_steps_threads_while_throughput_improves():
+    plan = TransferPlan(disk_threads=4, transfer_threads=16, chunk_size_bytes=4 * MiB)
+    improving = [{'transfer_threads': 16, 'mbps': 100},
+                 {'transfer_threads': 24, 'mbps': 150}]
+    worse = [{'transfer_threads': 16, 'mbps': 100},
+             {'transfer_threads': 24, 'mbps': 60}]
+    assert adjust_for_history(plan, [], 1024 * MiB) == plan
+    assert adjust_for_history(plan, improving, 1024 * MiB).transfer_threads == 36
+    assert adjust_for_history(plan, worse, 1024 * MiB).transfer_threads == 16